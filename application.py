@@ -1,10 +1,17 @@
 from flask import Flask, jsonify, request, render_template_string, send_from_directory
 from datetime import datetime, timedelta
 import json
+import os
+import random
+import threading
+import time
 import boto3
 from botocore.exceptions import ClientError
 import logging
 from logging.handlers import RotatingFileHandler
+from event_log import EventLog, is_precondition_failed
+from write_behind import WriteBehindLog
+from batch_store import BatchStore
 
 app = Flask(__name__, static_folder='static')
 
@@ -13,6 +20,14 @@ S3_BUCKET = 'chickentraining'
 S3_KEY = 'chicken_data.json'
 S3_OVEN_STATE_KEY = 'oven_states.json'
 
+# Seconds a cached copy of oven_states.json is served before revalidating with S3
+OVEN_STATE_TTL = 5
+# Attempts at the conditional oven state write before giving up
+OVEN_STATE_MAX_RETRIES = 8
+
+# Local write-ahead log for buffered /log actions
+WAL_DIR = os.environ.get('WAL_DIR', 'wal')
+
 # Initialize S3 client
 s3 = boto3.client('s3')
 
@@ -27,6 +42,22 @@ app.logger.addHandler(file_handler)
 app.logger.setLevel(logging.INFO)
 app.logger.info('Chicken Tracker startup')
 
+# Append-only event log; the old chicken_data.json stays readable as its first segment
+event_log = EventLog(s3, S3_BUCKET, legacy_key=S3_KEY, logger=app.logger)
+event_log.start_compactor()
+
+# /log actions are acknowledged after a local fsync and shipped to S3 in batches;
+# start() replays anything a previous process left in the WAL
+write_behind = WriteBehindLog(event_log, WAL_DIR, logger=app.logger)
+write_behind.start()
+
+# /log_batch data, partitioned by business date
+batch_store = BatchStore(s3, S3_BUCKET, legacy=event_log.iter_events)
+
+# In-process copy of oven_states.json and the S3 ETag it was read at
+oven_state_cache = {'states': None, 'etag': None, 'checked': 0.0}
+oven_state_lock = threading.Lock()
+
 @app.route('/js/<path:path>')
 def send_js(path):
     return send_from_directory('static/js', path)
@@ -90,15 +121,7 @@ def log_batch():
         oven['time_of_day'] = batch_end.strftime('%H:%M')
         oven['is_weekend'] = batch_end.weekday() >= 5
     
-    # Load existing data from S3
-    try:
-        response = s3.get_object(Bucket=S3_BUCKET, Key=S3_KEY)
-        existing_data = json.loads(response['Body'].read().decode('utf-8'))
-    except ClientError as e:
-        if e.response['Error']['Code'] == 'NoSuchKey':
-            existing_data = []
-        else:
-            return jsonify({'error': 'Failed to retrieve existing data'}), 500
+    new_entries = []
     
     # If this is the first batch of the shift, add estimated previous batches
     if data['first_batch_of_shift']:
@@ -129,34 +152,14 @@ def log_batch():
                 'is_weekend': end_time.weekday() >= 5,
                 'estimated': True
             })
-        existing_data.extend(estimated_batches)
+        new_entries.extend(estimated_batches)
     
     # Append new data
-    existing_data.extend(data['ovens'])
+    new_entries.extend(data['ovens'])
     
-    # Sort data by date and time
-    existing_data.sort(key=lambda x: x['batch_end_time'])
-    
-    # Assign batch numbers for each day
-    current_date = None
-    batch_number = 0
-    for entry in existing_data:
-        entry_date = datetime.fromisoformat(entry['batch_end_time']).date()
-        if entry_date != current_date:
-            current_date = entry_date
-            batch_number = 1
-        else:
-            batch_number += 1
-        entry['batch_number'] = batch_number
-    
-    # Save updated data to S3
+    # Merge into each day's partition; batch numbers are reassigned for that day only
     try:
-        s3.put_object(
-            Bucket=S3_BUCKET,
-            Key=S3_KEY,
-            Body=json.dumps(existing_data, indent=2).encode('utf-8'),
-            ContentType='application/json'
-        )
+        batch_store.add(new_entries)
     except ClientError:
         return jsonify({'error': 'Failed to save data'}), 500
     
@@ -172,16 +175,6 @@ def log_action():
     
     app.logger.info(f"Logged action: {action}, Data: {json.dumps(log_data)}")
     
-    # Load existing data from S3
-    try:
-        response = s3.get_object(Bucket=S3_BUCKET, Key=S3_KEY)
-        existing_data = json.loads(response['Body'].read().decode('utf-8'))
-    except ClientError as e:
-        if e.response['Error']['Code'] == 'NoSuchKey':
-            existing_data = []
-        else:
-            return jsonify({'error': 'Failed to retrieve existing data'}), 500
-    
     # Process the log data based on the action
     if action == 'start_cooking':
         log_entry = {
@@ -227,18 +220,11 @@ def log_action():
     # Add timestamp to the log entry
     log_entry['timestamp'] = datetime.now().isoformat()
     
-    # Append new data
-    existing_data.append(log_entry)
-    
-    # Save updated data to S3
+    # Write to the local WAL; the flusher appends it to the event log
     try:
-        s3.put_object(
-            Bucket=S3_BUCKET,
-            Key=S3_KEY,
-            Body=json.dumps(existing_data, indent=2).encode('utf-8'),
-            ContentType='application/json'
-        )
-    except ClientError:
+        write_behind.append([log_entry])
+    except OSError as e:
+        app.logger.error(f"Error writing to WAL: {str(e)}")
         return jsonify({'error': 'Failed to save data'}), 500
     
     return jsonify({'message': 'Action logged successfully'}), 200
@@ -251,29 +237,61 @@ def health_check():
         'message': 'Chicken Tracker is running'
     }), 200
 
+def load_oven_states(max_age=OVEN_STATE_TTL):
+    with oven_state_lock:
+        if oven_state_cache['states'] is not None and time.time() - oven_state_cache['checked'] < max_age:
+            return oven_state_cache['states'], oven_state_cache['etag']
+        
+        params = {'Bucket': S3_BUCKET, 'Key': S3_OVEN_STATE_KEY}
+        if oven_state_cache['etag']:
+            # Conditional GET: S3 answers 304 with no body if nothing changed
+            params['IfNoneMatch'] = oven_state_cache['etag']
+        try:
+            response = s3.get_object(**params)
+            oven_state_cache['states'] = json.loads(response['Body'].read().decode('utf-8'))
+            oven_state_cache['etag'] = response['ETag']
+        except ClientError as e:
+            code = e.response['Error']['Code']
+            if code in ('304', 'NotModified'):
+                pass
+            elif code == 'NoSuchKey':
+                # If the file doesn't exist, create an empty oven states object,
+                # but only if nobody has created it since our GET; otherwise
+                # use what they wrote
+                oven_states = {}
+                try:
+                    response = s3.put_object(
+                        Bucket=S3_BUCKET,
+                        Key=S3_OVEN_STATE_KEY,
+                        Body=json.dumps(oven_states).encode('utf-8'),
+                        ContentType='application/json',
+                        IfNoneMatch='*'
+                    )
+                except ClientError as e:
+                    if not is_precondition_failed(e):
+                        raise
+                    response = s3.get_object(Bucket=S3_BUCKET, Key=S3_OVEN_STATE_KEY)
+                    oven_states = json.loads(response['Body'].read().decode('utf-8'))
+                oven_state_cache['states'] = oven_states
+                oven_state_cache['etag'] = response['ETag']
+            else:
+                raise
+        oven_state_cache['checked'] = time.time()
+        return oven_state_cache['states'], oven_state_cache['etag']
+
 @app.route('/oven_states', methods=['GET'])
 def get_oven_states():
     try:
-        response = s3.get_object(Bucket=S3_BUCKET, Key=S3_OVEN_STATE_KEY)
-        oven_states = json.loads(response['Body'].read().decode('utf-8'))
+        oven_states, etag = load_oven_states()
     except ClientError as e:
-        if e.response['Error']['Code'] == 'NoSuchKey':
-            # If the file doesn't exist, create an empty oven states object
-            oven_states = {}
-            try:
-                s3.put_object(
-                    Bucket=S3_BUCKET,
-                    Key=S3_OVEN_STATE_KEY,
-                    Body=json.dumps(oven_states).encode('utf-8'),
-                    ContentType='application/json'
-                )
-            except ClientError as put_error:
-                app.logger.error(f"Error creating oven states file: {str(put_error)}")
-                return jsonify({'error': 'Failed to create oven states file'}), 500
-        else:
-            app.logger.error(f"Error retrieving oven states: {str(e)}")
-            return jsonify({'error': 'Failed to retrieve oven states'}), 500
-    return jsonify(oven_states)
+        app.logger.error(f"Error retrieving oven states: {str(e)}")
+        return jsonify({'error': 'Failed to retrieve oven states'}), 500
+    
+    # Reuse the S3 ETag so unchanged polls get a 304 with no body
+    response = jsonify(oven_states)
+    response.set_etag(etag.strip('"'))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 @app.route('/update_oven_state', methods=['POST'])
 def update_oven_state():
@@ -281,29 +299,45 @@ def update_oven_state():
     oven_number = data.get('oven')
     oven_state = data.get('state')
     
-    try:
-        response = s3.get_object(Bucket=S3_BUCKET, Key=S3_OVEN_STATE_KEY)
-        oven_states = json.loads(response['Body'].read().decode('utf-8'))
-    except ClientError as e:
-        if e.response['Error']['Code'] == 'NoSuchKey':
-            # If the file doesn't exist, create an empty oven states object
-            oven_states = {}
-        else:
+    # Compare-and-swap: the write only lands if oven_states.json still has the
+    # ETag we read, so concurrent updates to other ovens are never overwritten
+    for attempt in range(OVEN_STATE_MAX_RETRIES):
+        try:
+            # Start from the cached copy; after a conflict, re-read from S3
+            oven_states, etag = load_oven_states(max_age=OVEN_STATE_TTL if attempt == 0 else 0)
+        except ClientError as e:
             app.logger.error(f"Error retrieving oven states: {str(e)}")
             return jsonify({'error': 'Failed to retrieve oven states'}), 500
+        
+        oven_states = dict(oven_states)
+        oven_states[str(oven_number)] = oven_state
+        
+        try:
+            response = s3.put_object(
+                Bucket=S3_BUCKET,
+                Key=S3_OVEN_STATE_KEY,
+                Body=json.dumps(oven_states, indent=2).encode('utf-8'),
+                ContentType='application/json',
+                IfMatch=etag
+            )
+        except ClientError as e:
+            if is_precondition_failed(e) or e.response['Error']['Code'] == 'NoSuchKey':
+                # Someone else wrote first; back off a little and retry on fresh state
+                time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+                continue
+            app.logger.error(f"Error saving oven state: {str(e)}")
+            return jsonify({'error': 'Failed to save oven state'}), 500
+        break
+    else:
+        app.logger.error(f"Gave up saving oven {oven_number} state after {OVEN_STATE_MAX_RETRIES} conflicts")
+        return jsonify({'error': 'Failed to save oven state'}), 409
     
-    oven_states[str(oven_number)] = oven_state
-    
-    try:
-        s3.put_object(
-            Bucket=S3_BUCKET,
-            Key=S3_OVEN_STATE_KEY,
-            Body=json.dumps(oven_states, indent=2).encode('utf-8'),
-            ContentType='application/json'
-        )
-    except ClientError as e:
-        app.logger.error(f"Error saving oven state: {str(e)}")
-        return jsonify({'error': 'Failed to save oven state'}), 500
+    with oven_state_lock:
+        # Skip if another thread has already cached a newer version
+        if oven_state_cache['etag'] == etag:
+            oven_state_cache['states'] = oven_states
+            oven_state_cache['etag'] = response['ETag']
+            oven_state_cache['checked'] = time.time()
     
     return jsonify({'message': 'Oven state updated successfully'}), 200
 
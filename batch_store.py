@@ -0,0 +1,127 @@
+import json
+import threading
+from datetime import datetime
+from botocore.exceptions import ClientError
+from event_log import is_missing, is_precondition_failed
+
+# Batches are stored one object per business date, batches/<YYYY-MM-DD>.json,
+# so logging a batch only reads, renumbers and rewrites the day it belongs to.
+BATCH_PREFIX = 'batches/'
+MAX_RETRIES = 5
+# Batches logged before the partitions existed are in the event log. They are
+# copied into the partitions once, before the first batch is added, and this
+# object records that it has been done.
+MIGRATED_KEY = 'batch_partitions_migrated.json'
+
+
+def batch_date(entry):
+    return datetime.fromisoformat(entry['batch_end_time']).date()
+
+
+def number_batches(entries):
+    # Sort by end time and number the day's batches from 1
+    entries.sort(key=lambda x: x['batch_end_time'])
+    for batch_number, entry in enumerate(entries, 1):
+        entry['batch_number'] = batch_number
+    return entries
+
+
+class BatchStore:
+    def __init__(self, s3, bucket, legacy=None):
+        self.s3 = s3
+        self.bucket = bucket
+        # legacy(): every event logged before the partitions, e.g. EventLog.iter_events
+        self.legacy = legacy
+        self.migrated = legacy is None
+        self.migrate_lock = threading.Lock()
+
+    def partition_key(self, date):
+        return f"{BATCH_PREFIX}{date.isoformat()}.json"
+
+    def load_day(self, date):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self.partition_key(date))
+        except ClientError as e:
+            if is_missing(e):
+                return [], None
+            raise
+        return json.loads(response['Body'].read().decode('utf-8')), response['ETag']
+
+    def migrate(self):
+        # Create each day's partition from the legacy batches of that day.
+        # Only a missing partition is created, so migrations racing in other
+        # processes, or batches added once one of them has finished, are
+        # never doubled or overwritten.
+        with self.migrate_lock:
+            if self.migrated:
+                return
+            try:
+                self.s3.get_object(Bucket=self.bucket, Key=MIGRATED_KEY)
+            except ClientError as e:
+                if not is_missing(e):
+                    raise
+                by_date = {}
+                for entry in self.legacy():
+                    if 'batch_end_time' in entry:
+                        by_date.setdefault(batch_date(entry), []).append(entry)
+                for date, day_entries in sorted(by_date.items()):
+                    try:
+                        self.s3.put_object(
+                            Bucket=self.bucket,
+                            Key=self.partition_key(date),
+                            Body=json.dumps(number_batches(day_entries), indent=2).encode('utf-8'),
+                            ContentType='application/json',
+                            IfNoneMatch='*'
+                        )
+                    except ClientError as e:
+                        if not is_precondition_failed(e):
+                            raise
+                self.s3.put_object(
+                    Bucket=self.bucket,
+                    Key=MIGRATED_KEY,
+                    Body=json.dumps({'migrated_at': datetime.now().isoformat(), 'days': len(by_date)}).encode('utf-8'),
+                    ContentType='application/json'
+                )
+            self.migrated = True
+
+    def add(self, entries):
+        self.migrate()
+        by_date = {}
+        for entry in entries:
+            by_date.setdefault(batch_date(entry), []).append(entry)
+        for date, day_entries in by_date.items():
+            self.add_to_day(date, day_entries)
+
+    def add_to_day(self, date, entries):
+        # Conditional write so two requests for the same day cannot drop each other's batches
+        for attempt in range(MAX_RETRIES):
+            existing, etag = self.load_day(date)
+            # The caller's entries pick up their batch numbers here
+            day = number_batches(existing + entries)
+            condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+            try:
+                self.s3.put_object(
+                    Bucket=self.bucket,
+                    Key=self.partition_key(date),
+                    Body=json.dumps(day, indent=2).encode('utf-8'),
+                    ContentType='application/json',
+                    **condition
+                )
+            except ClientError as e:
+                if is_precondition_failed(e) and attempt < MAX_RETRIES - 1:
+                    continue
+                raise
+            return day
+
+    def iter_batches(self, start_date=None, end_date=None):
+        paginator = self.s3.get_paginator('list_objects_v2')
+        params = {'Bucket': self.bucket, 'Prefix': BATCH_PREFIX}
+        if start_date:
+            # Keys sort by date, so skip straight to the first partition we need
+            params['StartAfter'] = f"{BATCH_PREFIX}{start_date.isoformat()}"
+        for page in paginator.paginate(**params):
+            for obj in page.get('Contents', []):
+                if end_date and obj['Key'] > self.partition_key(end_date):
+                    return
+                date = datetime.strptime(obj['Key'][len(BATCH_PREFIX):-len('.json')], '%Y-%m-%d').date()
+                yield from self.load_day(date)[0]
@@ -0,0 +1,544 @@
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from time import perf_counter
+import numpy as np
+from botocore.exceptions import ClientError
+
+# Latency benchmarks for application.py and frontend/backend.py. Both apps are
+# driven in-process through Flask test clients. application.py's S3 client is
+# swapped for LocalS3, an in-memory bucket seeded with `history` events, so
+# every S3-bound endpoint runs at each history size; backend.py keeps no
+# history and runs once per concurrency. extend_chain and rebuild_chain time
+# backend.py's prediction chain directly, outside any request. Each case reports p50/p95/p99
+# latency and throughput and is compared with the stored baseline.
+#
+#   python benchmark.py                          full matrix, compared with the baseline
+#   python benchmark.py --history 1000 --concurrency 1 4 --requests 100
+#   python benchmark.py --endpoints /log /predict
+#   python benchmark.py --endpoints extend_chain rebuild_chain
+#   python benchmark.py --s3-latency 20          add 20 ms to every S3 call
+#   python benchmark.py --save-baseline          store these results as the baseline
+#   python benchmark.py --check                  exit with status 1 if anything regressed
+#   python benchmark.py --sse 3000               SSE load test through a real uvicorn server
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+HISTORY_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+CONCURRENCY = [1, 8]
+REQUESTS = 200  # measured requests per endpoint and case
+WARMUP_REQUESTS = 5
+# Each case is measured this many times and every figure is the median run's
+REPEATS = 3
+# Seeded history is spread over days at this rate, with a batches/ partition per day
+EVENTS_PER_DAY = 50
+BATCHES_PER_DAY = 12
+# A case has regressed if its throughput is this many times lower than the
+# baseline's, or, with a single thread, its p50 this many times higher (and
+# slower by more than REGRESSION_MIN_MS). Percentiles of concurrent cases are
+# reported but not judged: with more threads than cores they mostly measure
+# the interpreter's thread switching and move by several times between runs.
+REGRESSION_RATIO = 2.0
+REGRESSION_MIN_MS = 0.5
+# backend.py answers differently before opening, so it runs on a clock that
+# starts at a Wednesday lunchtime (Eastern) whenever the benchmark is run
+BACKEND_CLOCK = '2024-05-15T12:00:00'
+# Chain cases: the week (Monday to Sunday) extend_chain days are drawn from,
+# and chains built per run
+CHAIN_WEEK_START = datetime(2024, 5, 13).date()
+CHAIN_SAMPLES = 50
+# SSE load test: /events connections held open, opened this many at a time,
+# and /predict requests made while they are open, this many at once
+SSE_CONNECTIONS = 3000
+SSE_CONNECT_BATCH = 200
+SSE_PREDICT_REQUESTS = 200
+SSE_PREDICT_CONCURRENCY = 8
+
+
+class LocalS3:
+    # In-memory stand-in for the boto3 S3 client calls the app makes,
+    # including conditional gets and puts, with errors raised as botocore's
+    # ClientError. latency (seconds) is slept on every call to model the
+    # round trip to S3.
+    def __init__(self, latency=0.0):
+        self.objects = {}  # (bucket, key) -> (body, etag)
+        self.lock = threading.Lock()
+        self.latency = latency
+
+    def round_trip(self):
+        if self.latency:
+            threading.Event().wait(self.latency)
+
+    def error(self, code, operation):
+        return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        self.round_trip()
+        with self.lock:
+            stored = self.objects.get((Bucket, Key))
+        if stored is None:
+            raise self.error('NoSuchKey', 'GetObject')
+        body, etag = stored
+        if IfNoneMatch is not None and IfNoneMatch == etag:
+            raise self.error('304', 'GetObject')
+        return {'Body': io.BytesIO(body), 'ETag': etag, 'ContentLength': len(body)}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None, IfMatch=None, IfNoneMatch=None):
+        self.round_trip()
+        body = Body if isinstance(Body, bytes) else Body.encode('utf-8')
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        with self.lock:
+            stored = self.objects.get((Bucket, Key))
+            if IfMatch is not None and stored is None:
+                raise self.error('NoSuchKey', 'PutObject')
+            if (IfMatch is not None and stored[1] != IfMatch) or (IfNoneMatch == '*' and stored is not None):
+                raise self.error('PreconditionFailed', 'PutObject')
+            self.objects[(Bucket, Key)] = (body, etag)
+        return {'ETag': etag}
+
+    def delete_object(self, Bucket, Key):
+        self.round_trip()
+        with self.lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete):
+        self.round_trip()
+        with self.lock:
+            for obj in Delete['Objects']:
+                self.objects.pop((Bucket, obj['Key']), None)
+        return {}
+
+    def get_paginator(self, operation):
+        if operation != 'list_objects_v2':
+            raise NotImplementedError(operation)
+        return self
+
+    def paginate(self, Bucket, Prefix='', StartAfter=''):
+        # list_objects_v2 pages of up to 1000 keys in key order. The listing is
+        # a snapshot taken under the lock, so puts and deletes made while the
+        # pages are read neither break the iteration nor show up half way.
+        with self.lock:
+            listing = sorted((key, len(body)) for (bucket, key), (body, _) in self.objects.items()
+                             if bucket == Bucket and key.startswith(Prefix) and key > StartAfter)
+        for i in range(0, max(len(listing), 1), 1000):
+            self.round_trip()
+            page = [{'Key': key, 'Size': size} for key, size in listing[i:i + 1000]]
+            yield {'Contents': page} if page else {}
+
+
+def seed_bucket(s3, bucket, history, rng):
+    # `history` /log events in the legacy chicken_data.json, a batches/
+    # partition for every day they cover (marked as migrated), and the four
+    # ovens' states.
+    # Returns the days covered, oldest first.
+    days = max(1, history // EVENTS_PER_DAY)
+    first_day = datetime(2024, 5, 15) - timedelta(days=days - 1)
+    events = []
+    for i in range(history):
+        start = first_day + timedelta(days=i // EVENTS_PER_DAY, hours=8, minutes=(i % EVENTS_PER_DAY) * 12)
+        end = start + timedelta(minutes=100)
+        oven = rng.randint(1, 4)
+        if i % 2 == 0:
+            events.append({'action': 'start_cooking', 'oven': oven, 'chickens': 28, 'start_time': start.isoformat(),
+                           'expected_end_time': end.isoformat(), 'timestamp': start.isoformat()})
+        else:
+            events.append({'action': 'finish_cooking', 'oven': oven, 'chickens': 28, 'start_time': start.isoformat(),
+                           'expected_end_time': end.isoformat(), 'actual_end_time': end.isoformat(),
+                           'timestamp': end.isoformat()})
+    s3.put_object(Bucket=bucket, Key='chicken_data.json', Body=json.dumps(events, indent=2).encode('utf-8'))
+    del events
+
+    dates = [(first_day + timedelta(days=day)).date() for day in range(days)]
+    for date in dates:
+        batches = []
+        for number in range(1, BATCHES_PER_DAY + 1):
+            end = datetime.combine(date, datetime.min.time()) + timedelta(hours=8, minutes=50 * number)
+            batches.append({'batch_start_time': (end - timedelta(minutes=100)).isoformat(), 'batch_end_time': end.isoformat(),
+                            'chickens_cooked': 28, 'chickens_leftover': 4, 'chickens_sold': 24, 'oven': number % 4 + 1,
+                            'day_of_week': end.weekday(), 'time_of_day': end.strftime('%H:%M'),
+                            'is_weekend': end.weekday() >= 5, 'batch_number': number})
+        s3.put_object(Bucket=bucket, Key=f'batches/{date.isoformat()}.json', Body=json.dumps(batches, indent=2).encode('utf-8'))
+    # The history's batches are already in partitions
+    s3.put_object(Bucket=bucket, Key='batch_partitions_migrated.json', Body=b'{}')
+
+    states = {str(oven): {'status': 'idle', 'chickens': 0} for oven in range(1, 5)}
+    s3.put_object(Bucket=bucket, Key='oven_states.json', Body=json.dumps(states, indent=2).encode('utf-8'))
+    return dates
+
+
+class Clock:
+    # Stands in for backend.py's `datetime`: now() starts at `start` and runs
+    # at real speed, everything else is datetime's
+    def __init__(self, start):
+        self.start = start
+        self.started = perf_counter()
+
+    def now(self, tz=None):
+        now = self.start + timedelta(seconds=perf_counter() - self.started)
+        return now.astimezone(tz) if tz else now
+
+    def __getattr__(self, name):
+        return getattr(datetime, name)
+
+
+def load_apps(work_dir):
+    # Both apps keep their runtime files (app.log, the WAL, the SQLite
+    # prediction state) in work_dir rather than in the repository
+    os.environ['WAL_DIR'] = os.path.join(work_dir, 'wal')
+    os.environ['SHARED_STATE_PATH'] = os.path.join(work_dir, 'prediction_state.sqlite')
+    os.environ.setdefault('ADMIN_TOKEN', 'benchmark')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    repo = os.path.dirname(os.path.abspath(__file__))
+    sys.path[:0] = [repo, os.path.join(repo, 'frontend')]
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        import application
+        import backend
+    finally:
+        os.chdir(cwd)
+    # Request logging still goes to app.log, just not to the terminal
+    for handler in logging.getLogger().handlers:
+        handler.setLevel(logging.WARNING)
+    backend.datetime = Clock(backend.registry.get().timezone.localize(datetime.fromisoformat(BACKEND_CLOCK)))
+    return application, backend
+
+
+def use_bucket(application, s3):
+    # Point every S3 user in application.py at s3 and forget cached state
+    application.s3 = s3
+    application.event_log.s3 = s3
+    application.batch_store.s3 = s3
+    application.batch_store.migrated = False
+    with application.oven_state_lock:
+        application.oven_state_cache.update({'states': None, 'etag': None, 'checked': 0.0})
+
+
+def application_requests(dates):
+    # endpoint -> function(client, rng) that makes one request
+    def log(client, rng):
+        start = datetime.now()
+        return client.post('/log', json={'action': 'start_cooking', 'data': {
+            'oven': rng.randint(1, 4), 'chickens': 28, 'start_time': start.isoformat(),
+            'expected_end_time': (start + timedelta(minutes=100)).isoformat(),
+        }})
+
+    def log_batch(client, rng):
+        end = datetime.combine(rng.choice(dates), datetime.min.time()) + timedelta(hours=rng.randint(9, 19))
+        ovens = [{'oven': oven, 'start_time': (end - timedelta(minutes=100)).isoformat(), 'end_time': end.isoformat(),
+                  'chickens_cooked': 28, 'chickens_leftover': rng.randint(0, 8)} for oven in range(1, 5)]
+        return client.post('/log_batch', json={'ovens': ovens, 'first_batch_of_shift': False, 'weather': 'sunny', 'temperature': 70})
+
+    def update_oven_state(client, rng):
+        return client.post('/update_oven_state', json={'oven': rng.randint(1, 4), 'state': {'status': 'cooking', 'chickens': rng.randint(1, 28)}})
+
+    return {
+        '/log': log,
+        '/log_batch': log_batch,
+        '/oven_states': lambda client, rng: client.get('/oven_states'),
+        '/update_oven_state': update_oven_state,
+    }
+
+
+def backend_requests(backend):
+    def report_actual_time(client, rng):
+        actual_time = backend.datetime.now(backend.registry.get().timezone) - timedelta(minutes=rng.randint(5, 90))
+        return client.post('/report-actual-time', json={'actual_time': actual_time.isoformat()})
+
+    return {
+        '/predict': lambda client, rng: client.get('/predict'),
+        '/oven-status': lambda client, rng: client.get('/oven-status'),
+        '/report-actual-time': report_actual_time,
+        '/schedule': lambda client, rng: client.get('/schedule'),
+    }
+
+
+def run_case(app, make_request, requests, concurrency, repeats=REPEATS):
+    # Median of `repeats` runs of the case, figure by figure
+    runs = [measure(app, make_request, requests, concurrency, seed) for seed in range(repeats)]
+    result = {name: float(np.median([run[name] for run in runs])) for name in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput')}
+    return dict(result, requests=requests, concurrency=concurrency, repeats=repeats, errors=sum(run['errors'] for run in runs))
+
+
+def measure(app, make_request, requests, concurrency, seed):
+    # One run: `requests` split over `concurrency` threads, each with its own test client
+    def worker(index, count):
+        client = app.test_client()
+        rng = random.Random(seed * 1000 + index)
+        times, errors = [], 0
+        for _ in range(count):
+            start = perf_counter()
+            response = make_request(client, rng)
+            times.append(perf_counter() - start)
+            errors += response.status_code >= 400
+        return times, errors
+
+    worker(-1, WARMUP_REQUESTS)
+    counts = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, range(concurrency), counts))
+    elapsed = perf_counter() - start
+    return summarize([t for worker_times, _ in results for t in worker_times], elapsed, sum(errors for _, errors in results))
+
+
+def summarize(times, elapsed, errors):
+    times = np.array(times) * 1000
+    p50, p95, p99 = np.percentile(times, [50, 95, 99])
+    return {
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'throughput': round(len(times) / elapsed, 1),
+        'errors': errors,
+    }
+
+
+def chain_cases(backend):
+    # case -> function(rng) that sets up one chain build and returns it to be
+    # timed. extend_chain walks a whole day's chain from opening to closing
+    # (what the first request of a day pays); rebuild_chain replays today's
+    # chain up to the benchmark clock with a new model, as a model swap does.
+    store = backend.registry.get()
+
+    def extend(rng):
+        model = backend.models.get(store.id).current
+        day = CHAIN_WEEK_START + timedelta(days=rng.randrange(7))
+        chain = backend.new_chain(store.hours.opening_time(day), day, model)
+        return lambda: backend.extend_chain(store, chain, store.hours.closing_time(day), model)
+
+    def rebuild(rng):
+        model = backend.models.get(store.id).current
+        today = backend.datetime.now(store.timezone).date()
+        with backend.shared_state.transaction() as state:
+            # A chain from another model version, so the rebuild has work to do
+            state[backend.state_key(store, 'chain')] = dict(backend.new_chain(store.hours.opening_time(today), today, model), version='stale')
+        return lambda: backend.rebuild_chain(store, model)
+
+    return {'extend_chain': extend, 'rebuild_chain': rebuild}
+
+
+def run_chain_case(prepare, samples, repeats=REPEATS):
+    # Like run_case, single-threaded: each sample is one chain build
+    runs = []
+    for seed in range(repeats):
+        rng = random.Random(seed)
+        prepare(rng)()  # warm up
+        times = []
+        for _ in range(samples):
+            call = prepare(rng)
+            start = perf_counter()
+            call()
+            times.append(perf_counter() - start)
+        runs.append(summarize(times, sum(times), 0))
+    result = {name: float(np.median([run[name] for run in runs])) for name in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput')}
+    return dict(result, requests=samples, concurrency=1, repeats=repeats, errors=0)
+
+
+def case_key(endpoint, history, concurrency):
+    return f"{endpoint} history={history if history is not None else '-'} concurrency={concurrency}"
+
+
+def compare(result, baseline, concurrency):
+    # (summary against the baseline, whether the case regressed)
+    p50 = result['p50_ms'] / max(baseline['p50_ms'], 1e-9)
+    throughput = result['throughput'] / max(baseline['throughput'], 1e-9)
+    slower = concurrency == 1 and p50 > REGRESSION_RATIO and result['p50_ms'] - baseline['p50_ms'] > REGRESSION_MIN_MS
+    regressed = slower or throughput < 1 / REGRESSION_RATIO
+    return f"{'REGRESSED ' if regressed else ''}p50 {p50:.2f}x, req/s {throughput:.2f}x", regressed
+
+
+def run_benchmarks(history_sizes=HISTORY_SIZES, concurrency=CONCURRENCY, requests=REQUESTS, endpoints=None,
+                   s3_latency=0.0, baseline=None):
+    # Returns {case key: result}, printing each case as it finishes
+    baseline = baseline or {}
+    results = {}
+    print(f"{'endpoint':<20} {'history':>9} {'conc':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'errors':>6}  vs baseline")
+
+    def report(key, endpoint, history, workers, result):
+        results[key] = result
+        compared = compare(result, baseline[key], workers)[0] if key in baseline else ''
+        history = f'{history:,}' if history is not None else '-'
+        print(f"{endpoint:<20} {history:>9} {workers:>5} {result['p50_ms']:>9.3f} {result['p95_ms']:>9.3f} "
+              f"{result['p99_ms']:>9.3f} {result['throughput']:>9.1f} {result['errors']:>6}  {compared}", flush=True)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        application, backend = load_apps(work_dir)
+        for history in history_sizes:
+            s3 = LocalS3()
+            dates = seed_bucket(s3, application.S3_BUCKET, history, random.Random(history))
+            s3.latency = s3_latency / 1000
+            use_bucket(application, s3)
+            for endpoint, make_request in application_requests(dates).items():
+                if endpoints and endpoint not in endpoints:
+                    continue
+                for workers in concurrency:
+                    key = case_key(endpoint, history, workers)
+                    report(key, endpoint, history, workers, run_case(application.app, make_request, requests, workers))
+            # Ship what /log left in the WAL before the bucket is dropped
+            application.write_behind.flush()
+
+        for endpoint, make_request in backend_requests(backend).items():
+            if endpoints and endpoint not in endpoints:
+                continue
+            for workers in concurrency:
+                key = case_key(endpoint, None, workers)
+                report(key, endpoint, None, workers, run_case(backend.app, make_request, requests, workers))
+        for case, prepare in chain_cases(backend).items():
+            if endpoints and case not in endpoints:
+                continue
+            report(case_key(case, None, 1), case, None, 1, run_chain_case(prepare, CHAIN_SAMPLES))
+        application.write_behind.stop()
+    return results
+
+
+def sse_load(connections=SSE_CONNECTIONS, requests=SSE_PREDICT_REQUESTS, concurrency=SSE_PREDICT_CONCURRENCY):
+    # Serves backend.asgi_app with uvicorn on a local port, as one gunicorn
+    # worker would, and holds `connections` /events streams open. Measures
+    # /predict latency while they are open, then reports a time and measures
+    # how long every stream takes to get the update, which includes the
+    # shared state's watch poll. Clients run on this thread's event loop, the
+    # server on its own thread.
+    import asyncio
+    import socket
+    import uvicorn
+
+    async def http(port, method, path, body=None):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        writer.write(f'{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(data)}\r\nConnection: close\r\n\r\n'.encode('ascii') + data)
+        response = await reader.read()
+        writer.close()
+        return int(response.split(b' ', 2)[1])
+
+    async def subscribe(port, opened, updates):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET /events HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        await reader.readuntil(b'\r\n\r\n')
+        opened.append(perf_counter())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                if line.startswith(b'data: update'):
+                    updates.append(perf_counter())
+                    return
+        finally:
+            writer.close()
+
+    async def run(backend, port):
+        opened, updates = [], []
+        streams = []
+        start = perf_counter()
+        for i in range(0, connections, SSE_CONNECT_BATCH):
+            batch = [asyncio.ensure_future(subscribe(port, opened, updates)) for _ in range(min(SSE_CONNECT_BATCH, connections - i))]
+            streams += batch
+            while len(opened) < len(streams):
+                await asyncio.sleep(0.01)
+        print(f"Opened {len(opened):,} /events connections in {perf_counter() - start:.1f}s", flush=True)
+
+        times, errors = [], 0
+        async def predict(count):
+            nonlocal errors
+            for _ in range(count):
+                request_start = perf_counter()
+                errors += await http(port, 'GET', '/predict') >= 400
+                times.append(perf_counter() - request_start)
+        start = perf_counter()
+        await asyncio.gather(*(predict(requests // concurrency) for _ in range(concurrency)))
+        elapsed = perf_counter() - start
+        p50, p95, p99 = np.percentile(np.array(times) * 1000, [50, 95, 99])
+        print(f"/predict with them open, {concurrency} at a time: p50 {p50:.1f} ms, p95 {p95:.1f} ms, "
+              f"p99 {p99:.1f} ms, {len(times) / elapsed:.0f} req/s, {errors} errors", flush=True)
+
+        actual_time = backend.datetime.now(backend.registry.get().timezone) - timedelta(minutes=30)
+        reported = perf_counter()
+        status = await http(port, 'POST', '/report-actual-time', {'actual_time': actual_time.isoformat()})
+        await asyncio.wait(streams, timeout=10)
+        delays = np.array(updates) - reported
+        print(f"/report-actual-time returned {status}; {len(updates):,} of {len(streams):,} streams got the update, "
+              f"the last {delays.max() if len(delays) else float('nan'):.2f}s after the report "
+              f"(median {np.median(delays) if len(delays) else float('nan'):.2f}s)")
+        for stream in streams:
+            stream.cancel()
+        return {'connections': len(opened), 'predict_p50_ms': float(p50), 'updated': len(updates),
+                'last_update_s': float(delays.max()) if len(delays) else None}
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        application, backend = load_apps(work_dir)
+        application.write_behind.stop()
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        server = uvicorn.Server(uvicorn.Config(backend.asgi_app, host='127.0.0.1', port=port, log_level='warning',
+                                               backlog=connections + 100, timeout_keep_alive=60))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            threading.Event().wait(0.05)
+        try:
+            return asyncio.run(run(backend, port))
+        finally:
+            server.should_exit = True
+            thread.join(10)
+
+
+def load_baseline(path=BASELINE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    # Keeps the baseline of any case that was not run this time
+    merged = dict(load_baseline(path), **results)
+    with open(path, 'w') as f:
+        json.dump({
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': f'{platform.machine()}, {os.cpu_count()} CPUs',
+            'results': dict(sorted(merged.items())),
+        }, f, indent=2)
+        f.write('\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the application.py and backend.py endpoints.")
+    parser.add_argument('--history', type=int, nargs='+', default=HISTORY_SIZES, help="events of history in the S3 stand-in")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=CONCURRENCY, help="threads issuing requests at once")
+    parser.add_argument('--requests', type=int, default=REQUESTS, help="measured requests per endpoint and case")
+    parser.add_argument('--endpoints', nargs='+', help="only these endpoints or chain cases, e.g. /log /predict extend_chain")
+    parser.add_argument('--s3-latency', type=float, default=0.0, help="milliseconds added to every S3 call")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="baseline file to compare with")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results in the baseline file")
+    parser.add_argument('--check', action='store_true', help="exit with status 1 if any case regressed")
+    parser.add_argument('--sse', type=int, metavar='CONNECTIONS', help="run the SSE load test with this many connections instead")
+    args = parser.parse_args()
+
+    if args.sse:
+        result = sse_load(args.sse)
+        sys.exit(0 if result['updated'] == result['connections'] == args.sse else 1)
+
+    baseline = load_baseline(args.baseline)
+    results = run_benchmarks(args.history, args.concurrency, args.requests, args.endpoints, args.s3_latency, baseline)
+    regressed = [key for key, result in results.items()
+                 if key in baseline and compare(result, baseline[key], result['concurrency'])[1]]
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        print(f"\nBaseline saved to '{args.baseline}'")
+    if regressed:
+        print(f"\n{len(regressed)} of {len(results)} cases regressed against the baseline")
+        if args.check:
+            sys.exit(1)
@@ -0,0 +1,113 @@
+import argparse
+import itertools
+from datetime import timedelta
+from time import perf_counter
+import numpy as np
+import pandas as pd
+import clean
+import synthetic
+
+# Scaling benchmark for clean.build_sessions against the row-by-row loop it
+# replaced, on synthetic events (see synthetic.py). reference_sessions is that
+# loop as it was, and tests/test_clean.py checks the two agree.
+#
+#   python benchmark_sessions.py                       1k, 10k and 100k events
+#   python benchmark_sessions.py --events 1000000 --skip-reference
+EVENT_COUNTS = [1_000, 10_000, 100_000]
+# The reference loop is only timed up to this many events; it takes minutes beyond
+REFERENCE_MAX_EVENTS = 100_000
+SEED = 0
+
+
+def reference_sessions(data_filtered):
+    # The per-oven iterrows state machine from before build_sessions. Ties on
+    # timestamp keep their input order.
+    sessions = []
+    for oven in data_filtered['oven'].unique():
+        oven_data = data_filtered[data_filtered['oven'] == oven].sort_values('timestamp', kind='stable')
+        current_session = None
+
+        for _, row in oven_data.iterrows():
+            if row['action'] == 'start_cooking':
+                if current_session is not None:
+                    sessions.append(current_session)
+                current_session = {
+                    'oven': oven,
+                    'start_time': row['timestamp'],
+                    'chickens': row['chickens'],
+                    'expected_end_time': row['expected_end_time'],
+                    'leftovers': None,
+                    'leftovers_time': None
+                }
+            elif row['action'] == 'adjust_cooking_time' and current_session is not None:
+                if pd.notnull(row['new_expected_end_time']):
+                    current_session['expected_end_time'] = row['new_expected_end_time']
+            elif row['action'] == 'finish_cooking':
+                if current_session is None:
+                    # If we have a finish time without a start time, estimate the start time
+                    current_session = {
+                        'oven': oven,
+                        'start_time': row['timestamp'] - timedelta(minutes=90),
+                        'chickens': row['chickens'],
+                        'expected_end_time': row['timestamp'],  # Assume expected = actual if we don't have start data
+                        'leftovers': None,
+                        'leftovers_time': None
+                    }
+                current_session['end_time'] = row['timestamp']
+                current_session['actual_cooking_time'] = (current_session['end_time'] - current_session['start_time']).total_seconds() / 60
+
+                # Adjust start time if cooking duration is less than 60 minutes
+                if current_session['actual_cooking_time'] < 60:
+                    imputed_duration = np.random.uniform(90, 100)  # Random duration between 90-100 minutes
+                    current_session['start_time'] = current_session['end_time'] - timedelta(minutes=imputed_duration)
+                    current_session['actual_cooking_time'] = imputed_duration
+
+                current_session['time_difference'] = (current_session['end_time'] - current_session['expected_end_time']).total_seconds() / 60
+            elif row['action'] == 'post_rush':
+                if current_session is not None:
+                    current_session['leftovers'] = row['chickens_left']
+                    current_session['leftovers_time'] = row['timestamp']
+                    sessions.append(current_session)
+                    current_session = None
+
+        # Append the last session if it exists
+        if current_session is not None:
+            sessions.append(current_session)
+
+    return pd.DataFrame(sessions)
+
+
+def synthetic_events(count, ovens=4, seed=SEED):
+    # The first `count` events of one synthetic store, parsed as load_events does
+    events = pd.DataFrame(itertools.islice(synthetic.generate_store(1, ovens, synthetic.START_DATE, 100_000, seed), count))
+    for col in ['timestamp', 'start_time', 'actual_end_time', 'expected_end_time', 'new_expected_end_time']:
+        if col in events.columns:
+            events[col] = clean.to_eastern(events[col])
+    return events.sort_values(['oven', 'timestamp'])
+
+
+def time_call(function, events):
+    np.random.seed(SEED)
+    start = perf_counter()
+    function(events)
+    return perf_counter() - start
+
+
+def run(event_counts=EVENT_COUNTS, reference=True):
+    print(f"{'events':>10} {'vectorized s':>13} {'row loop s':>11} {'speedup':>8}")
+    for count in event_counts:
+        events = synthetic_events(count)
+        vectorized = time_call(clean.build_sessions, events)
+        if reference and count <= REFERENCE_MAX_EVENTS:
+            loop = time_call(reference_sessions, events)
+            print(f"{len(events):>10,} {vectorized:>13.3f} {loop:>11.3f} {loop / vectorized:>7.1f}x", flush=True)
+        else:
+            print(f"{len(events):>10,} {vectorized:>13.3f} {'-':>11} {'-':>8}", flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time clean.build_sessions against the row-by-row loop it replaced.")
+    parser.add_argument('--events', type=int, nargs='+', default=EVENT_COUNTS)
+    parser.add_argument('--skip-reference', action='store_true', help="only time build_sessions")
+    args = parser.parse_args()
+    run(args.events, not args.skip_reference)
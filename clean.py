@@ -1,173 +1,212 @@
+import sys
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import pytz
-
-def safe_to_datetime(x):
-    try:
-        return pd.to_datetime(x, utc=True)
-    except ValueError:
-        return pd.NaT
-
-def convert_to_eastern(dt):
-    if pd.isnull(dt):
-        return dt
-    eastern = pytz.timezone('US/Eastern')
-    return dt.tz_convert(eastern)
-
-# Load the data
-data = pd.read_json('merged_chicken_data.json')
-
-# Convert timestamp columns to datetime
-datetime_columns = ['timestamp', 'start_time', 'actual_end_time', 'expected_end_time', 'new_expected_end_time', 'estimated_start_time']
-for col in datetime_columns:
-    if col in data.columns:
-        data[col] = data[col].apply(safe_to_datetime)
-        data[col] = data[col].apply(convert_to_eastern)
-
-# Identify and remove duplicates based on 'oven' and 'timestamp'
-duplicates = data[data.duplicated(subset=['oven', 'timestamp'], keep=False)]
-print("Duplicates found:")
-print(duplicates)
-print(f"\nNumber of duplicates: {len(duplicates)}")
-
-# Remove duplicates, keeping the first occurrence
-data_no_duplicates = data.drop_duplicates(subset=['oven', 'timestamp'], keep='first')
-
-# Filter out entries before Oct 3, 10 AM EST
-cutoff_time = pd.Timestamp('2024-10-03 10:00:00', tz='US/Eastern')
-data_filtered = data_no_duplicates[data_no_duplicates['timestamp'] >= cutoff_time]
-
-print(f"\nRows removed due to early timestamp: {len(data_no_duplicates) - len(data_filtered)}")
-
-# Sort the data by oven and timestamp
-data_filtered = data_filtered.sort_values(['oven', 'timestamp'])
-
-# Save the new dataset
-data_filtered.to_json('cleaned_chicken_data.json', date_format='iso')
-print("\nCleaned data saved to 'cleaned_chicken_data.json'")
-
-# Print summary of changes
-print(f"\nOriginal dataset size: {len(data)}")
-print(f"Dataset size after removing duplicates: {len(data_no_duplicates)}")
-print(f"Final dataset size after filtering early entries: {len(data_filtered)}")
-
-# Initialize lists to store cooking sessions
-sessions = []
-
-# Iterate through each oven
-for oven in data_filtered['oven'].unique():
-    oven_data = data_filtered[data_filtered['oven'] == oven].sort_values('timestamp')
-    current_session = None
-    
-    for _, row in oven_data.iterrows():
-        if row['action'] == 'start_cooking':
-            if current_session is not None:
-                sessions.append(current_session)
-            current_session = {
-                'oven': oven,
-                'start_time': row['timestamp'],
-                'chickens': row['chickens'],
-                'expected_end_time': row['expected_end_time'],
-                'leftovers': None,
-                'leftovers_time': None
-            }
-        elif row['action'] == 'adjust_cooking_time' and current_session is not None:
-            if pd.notnull(row['new_expected_end_time']):
-                current_session['expected_end_time'] = row['new_expected_end_time']
-        elif row['action'] == 'finish_cooking':
-            if current_session is None:
-                # If we have a finish time without a start time, estimate the start time
-                current_session = {
-                    'oven': oven,
-                    'start_time': row['timestamp'] - timedelta(minutes=90),
-                    'chickens': row['chickens'],
-                    'expected_end_time': row['timestamp'],  # Assume expected = actual if we don't have start data
-                    'leftovers': None,
-                    'leftovers_time': None
-                }
-            current_session['end_time'] = row['timestamp']
-            current_session['actual_cooking_time'] = (current_session['end_time'] - current_session['start_time']).total_seconds() / 60
-            
-            # Adjust start time if cooking duration is less than 60 minutes
-            if current_session['actual_cooking_time'] < 60:
-                imputed_duration = np.random.uniform(90, 100)  # Random duration between 90-100 minutes
-                current_session['start_time'] = current_session['end_time'] - timedelta(minutes=imputed_duration)
-                current_session['actual_cooking_time'] = imputed_duration
-            
-            current_session['time_difference'] = (current_session['end_time'] - current_session['expected_end_time']).total_seconds() / 60
-        elif row['action'] == 'post_rush':
-            if current_session is not None:
-                current_session['leftovers'] = row['chickens_left']
-                current_session['leftovers_time'] = row['timestamp']
-                sessions.append(current_session)
-                current_session = None
-
-    # Append the last session if it exists
-    if current_session is not None:
-        sessions.append(current_session)
-
-# Create a DataFrame from the sessions
-cooking_sessions = pd.DataFrame(sessions)
-
-# Calculate time between end_time and leftovers_time
-cooking_sessions['time_to_leftovers'] = (cooking_sessions['leftovers_time'] - cooking_sessions['end_time']).dt.total_seconds() / 60
-
-# Add new analysis for leftovers
-print("\nLeftovers Analysis:")
-sessions_with_leftovers = cooking_sessions[cooking_sessions['leftovers'].notnull()]
-print(f"Total sessions with leftovers: {len(sessions_with_leftovers)}")
-
-print("\nLeftovers statistics:")
-print(sessions_with_leftovers['leftovers'].describe())
-
-print("\nTime to log leftovers statistics (minutes):")
-print(sessions_with_leftovers['time_to_leftovers'].describe())
-
-print("\nSample of sessions with leftovers:")
-print(sessions_with_leftovers[['oven', 'end_time', 'chickens', 'leftovers', 'leftovers_time', 'time_to_leftovers']].head())
-
-# Update the formatted output to include leftovers information
-output = []
-for (date, oven), group in cooking_sessions.groupby([cooking_sessions['start_time'].dt.date, 'oven']):
-    output.append(f"\nDate: {date}, Oven: {oven}")
-    for _, session in group.iterrows():
-        start = session['start_time'].strftime('%I:%M %p')
-        end = session['end_time'].strftime('%I:%M %p') if pd.notnull(session['end_time']) else 'N/A'
-        cooking_time = f"{session['actual_cooking_time']:.2f}" if pd.notnull(session['actual_cooking_time']) else 'N/A'
-        time_diff = f"{session['time_difference']:.2f}" if pd.notnull(session['time_difference']) else 'N/A'
-        leftovers = f"{session['leftovers']}" if pd.notnull(session['leftovers']) else 'N/A'
-        leftovers_time = session['leftovers_time'].strftime('%I:%M %p') if pd.notnull(session['leftovers_time']) else 'N/A'
-        time_to_leftovers = f"{session['time_to_leftovers']:.2f}" if pd.notnull(session['time_to_leftovers']) else 'N/A'
-        session_info = (f"  {start} - {end}: {session['chickens']} chickens, {cooking_time} minutes, "
-                        f"Difference: {time_diff} minutes, Leftovers: {leftovers} at {leftovers_time} "
-                        f"({time_to_leftovers} minutes after finish)")
-        if pd.isnull(session['end_time']):
-            session_info += " (No finish time)"
-        output.append(session_info)
-
-# Print the updated formatted output
-print("\nCooking Sessions (including detailed leftovers information):")
-print("\n".join(output))
-
-# Save the grouped sessions to a CSV file
-cooking_sessions.to_csv('grouped_cooking_sessions.csv', index=False)
-print("\nGrouped cooking sessions saved to 'grouped_cooking_sessions.csv'")
-
-# Print some statistics
-print("\nCooking Time Statistics (minutes):")
-print(cooking_sessions['actual_cooking_time'].describe())
-
-print("\nCooking Sessions by Oven:")
-print(cooking_sessions['oven'].value_counts().sort_index())
-
-print("\nDate Range of Cooking Sessions:")
-print(f"Start: {cooking_sessions['start_time'].min()}")
-print(f"End: {cooking_sessions['end_time'].max()}")
-
-print("\nTotal number of sessions:", len(cooking_sessions))
-
-# Add statistics for time difference
-print("\nTime Difference Statistics (minutes):")
-print(cooking_sessions['time_difference'].describe())
-
+from columnar import save_frame
+
+eastern = pytz.timezone('US/Eastern')
+
+def to_eastern(column):
+    # Parse a whole column at once; values that are not dates become NaT
+    return pd.to_datetime(column, utc=True, format='mixed', errors='coerce').dt.tz_convert(eastern)
+
+def total_minutes(delta):
+    # Same arithmetic as Timedelta.total_seconds() on each element, so the
+    # minutes come out bit-for-bit as the row-by-row version computed them
+    whole, rest = np.divmod(delta.to_numpy('timedelta64[ns]').astype('int64'), 10**9)
+    return pd.Series((whole + rest / 1e9) / 60, index=delta.index).where(delta.notnull())
+
+def build_sessions(events):
+    # Rebuild cooking sessions from each oven's event stream without walking it
+    # row by row. Per oven, start_cooking and finish_cooking leave a session
+    # open and post_rush closes it, so whether a session is open before each
+    # event is a forward fill, and session ids are a cumulative sum of the
+    # events that begin one: every start_cooking, and a finish_cooking with no
+    # open session (its start is estimated as 90 minutes earlier).
+    events = events[events['oven'].notnull()].sort_values(['oven', 'timestamp'], kind='stable').reset_index(drop=True)
+    action = events['action']
+    is_start = action == 'start_cooking'
+    is_finish = action == 'finish_cooking'
+    is_adjust = action == 'adjust_cooking_time'
+    is_post_rush = action == 'post_rush'
+
+    opens = pd.Series(np.where(is_start | is_finish, 1.0, np.where(is_post_rush, 0.0, np.nan)))
+    open_after = opens.groupby(events['oven']).ffill().fillna(0).astype(bool)
+    open_before = open_after.groupby(events['oven']).shift(1, fill_value=False)
+    begins = is_start | (is_finish & ~open_before)
+    # Events while no session is open (adjust/post_rush) are ignored
+    events['session'] = begins.cumsum() - 1
+    events = events[begins | open_before]
+    begins, is_start, is_finish, is_adjust, is_post_rush = (
+        mask[events.index] for mask in (begins, is_start, is_finish, is_adjust, is_post_rush)
+    )
+
+    first = events[begins].set_index('session')
+    started = is_start[begins].to_numpy()
+    sessions = pd.DataFrame({
+        'oven': first['oven'],
+        'start_time': first['timestamp'].where(started, first['timestamp'] - timedelta(minutes=90)),
+        'chickens': first['chickens'],
+        'expected_end_time': first['expected_end_time'].where(started, first['timestamp']),
+    })
+    initial_expected = sessions['expected_end_time']
+
+    adjusts = events[is_adjust & events['new_expected_end_time'].notnull()]
+    latest_adjust = adjusts.groupby('session')['new_expected_end_time'].last()
+    sessions['expected_end_time'] = latest_adjust.reindex(sessions.index).fillna(initial_expected)
+
+    post_rush = events[is_post_rush].set_index('session')
+    sessions['leftovers'] = post_rush['chickens_left'].reindex(sessions.index)
+    sessions['leftovers_time'] = post_rush['timestamp'].reindex(sessions.index)
+
+    finish_rows = events[is_finish]
+    finishes = finish_rows.groupby('session')['timestamp']
+    first_finish = finishes.first().reindex(sessions.index)
+    end_time = finishes.last().reindex(sessions.index)
+    sessions['end_time'] = end_time
+
+    # Sessions that look shorter than 60 minutes at their first finish get a
+    # random 90-100 minute duration. A later finish is never sooner than that,
+    # so only the first finish can impute, and the draws are made in session
+    # order, as the per-row state machine made them.
+    cooking_time = total_minutes(first_finish - sessions['start_time'])
+    imputed = (cooking_time < 60).to_numpy()
+    imputed_duration = np.random.uniform(90, 100, size=imputed.sum())
+    sessions.loc[imputed, 'start_time'] = first_finish[imputed] - pd.to_timedelta(np.round(imputed_duration * 60e6), unit='us')
+    durations = np.full(len(sessions), np.nan)
+    durations[imputed] = imputed_duration
+    single_finish = (end_time == first_finish).to_numpy()
+    actual_cooking_time = total_minutes(end_time - sessions['start_time'])
+    sessions['actual_cooking_time'] = actual_cooking_time.mask(imputed & single_finish, durations)
+
+    # Time difference is taken against the expected end time as of the last
+    # finish, so adjustments logged after it do not count. "After" is event
+    # order, not timestamp: an adjustment tied with the finish but sorted
+    # behind it came too late, as it did for the per-row state machine.
+    last_finish = finish_rows.groupby('session').tail(1)
+    expected_at_finish = pd.merge_asof(
+        last_finish[['session']].rename_axis('row').reset_index(),
+        adjusts[['session', 'new_expected_end_time']].rename_axis('row').reset_index(),
+        on='row', by='session', direction='backward'
+    ).set_index('session')['new_expected_end_time'].reindex(sessions.index).fillna(initial_expected)
+    sessions['time_difference'] = total_minutes(end_time - expected_at_finish)
+
+    return sessions.reset_index(drop=True)
+
+def load_events(path='merged_chicken_data.json'):
+    data = pd.read_json(path)
+
+    # Convert timestamp columns to datetime
+    datetime_columns = ['timestamp', 'start_time', 'actual_end_time', 'expected_end_time', 'new_expected_end_time', 'estimated_start_time']
+    for col in datetime_columns:
+        if col in data.columns:
+            data[col] = to_eastern(data[col])
+    return data
+
+def clean_events(data):
+    # Identify and remove duplicates based on 'oven' and 'timestamp'
+    duplicates = data[data.duplicated(subset=['oven', 'timestamp'], keep=False)]
+    print("Duplicates found:")
+    print(duplicates)
+    print(f"\nNumber of duplicates: {len(duplicates)}")
+
+    # Remove duplicates, keeping the first occurrence
+    data_no_duplicates = data.drop_duplicates(subset=['oven', 'timestamp'], keep='first')
+
+    # Filter out entries before Oct 3, 10 AM EST
+    cutoff_time = pd.Timestamp('2024-10-03 10:00:00', tz='US/Eastern')
+    data_filtered = data_no_duplicates[data_no_duplicates['timestamp'] >= cutoff_time]
+
+    print(f"\nRows removed due to early timestamp: {len(data_no_duplicates) - len(data_filtered)}")
+
+    # Sort the data by oven and timestamp
+    data_filtered = data_filtered.sort_values(['oven', 'timestamp'])
+
+    # Print summary of changes
+    print(f"\nOriginal dataset size: {len(data)}")
+    print(f"Dataset size after removing duplicates: {len(data_no_duplicates)}")
+    print(f"Final dataset size after filtering early entries: {len(data_filtered)}")
+    return data_filtered
+
+def report_sessions(cooking_sessions):
+    # Add new analysis for leftovers
+    print("\nLeftovers Analysis:")
+    sessions_with_leftovers = cooking_sessions[cooking_sessions['leftovers'].notnull()]
+    print(f"Total sessions with leftovers: {len(sessions_with_leftovers)}")
+
+    print("\nLeftovers statistics:")
+    print(sessions_with_leftovers['leftovers'].describe())
+
+    print("\nTime to log leftovers statistics (minutes):")
+    print(sessions_with_leftovers['time_to_leftovers'].describe())
+
+    print("\nSample of sessions with leftovers:")
+    print(sessions_with_leftovers[['oven', 'end_time', 'chickens', 'leftovers', 'leftovers_time', 'time_to_leftovers']].head())
+
+    # Update the formatted output to include leftovers information
+    output = []
+    for (date, oven), group in cooking_sessions.groupby([cooking_sessions['start_time'].dt.date, 'oven']):
+        output.append(f"\nDate: {date}, Oven: {oven}")
+        for _, session in group.iterrows():
+            start = session['start_time'].strftime('%I:%M %p')
+            end = session['end_time'].strftime('%I:%M %p') if pd.notnull(session['end_time']) else 'N/A'
+            cooking_time = f"{session['actual_cooking_time']:.2f}" if pd.notnull(session['actual_cooking_time']) else 'N/A'
+            time_diff = f"{session['time_difference']:.2f}" if pd.notnull(session['time_difference']) else 'N/A'
+            leftovers = f"{session['leftovers']}" if pd.notnull(session['leftovers']) else 'N/A'
+            leftovers_time = session['leftovers_time'].strftime('%I:%M %p') if pd.notnull(session['leftovers_time']) else 'N/A'
+            time_to_leftovers = f"{session['time_to_leftovers']:.2f}" if pd.notnull(session['time_to_leftovers']) else 'N/A'
+            session_info = (f"  {start} - {end}: {session['chickens']} chickens, {cooking_time} minutes, "
+                            f"Difference: {time_diff} minutes, Leftovers: {leftovers} at {leftovers_time} "
+                            f"({time_to_leftovers} minutes after finish)")
+            if pd.isnull(session['end_time']):
+                session_info += " (No finish time)"
+            output.append(session_info)
+
+    # Print the updated formatted output
+    print("\nCooking Sessions (including detailed leftovers information):")
+    print("\n".join(output))
+
+    # Print some statistics
+    print("\nCooking Time Statistics (minutes):")
+    print(cooking_sessions['actual_cooking_time'].describe())
+
+    print("\nCooking Sessions by Oven:")
+    print(cooking_sessions['oven'].value_counts().sort_index())
+
+    print("\nDate Range of Cooking Sessions:")
+    print(f"Start: {cooking_sessions['start_time'].min()}")
+    print(f"End: {cooking_sessions['end_time'].max()}")
+
+    print("\nTotal number of sessions:", len(cooking_sessions))
+
+    # Add statistics for time difference
+    print("\nTime Difference Statistics (minutes):")
+    print(cooking_sessions['time_difference'].describe())
+
+def clean_data(data):
+    # The whole cleaning step: returns the cleaned events and the cooking
+    # sessions rebuilt from them
+    data_filtered = clean_events(data)
+    cooking_sessions = build_sessions(data_filtered)
+
+    # Calculate time between end_time and leftovers_time
+    cooking_sessions['time_to_leftovers'] = (cooking_sessions['leftovers_time'] - cooking_sessions['end_time']).dt.total_seconds() / 60
+
+    report_sessions(cooking_sessions)
+    return data_filtered, cooking_sessions
+
+if __name__ == '__main__':
+    data_filtered, cooking_sessions = clean_data(load_events('merged_chicken_data.json'))
+
+    # Save the new dataset and the grouped sessions for the next steps
+    save_frame(data_filtered, 'cleaned_chicken_data.cols')
+    save_frame(cooking_sessions, 'grouped_cooking_sessions.cols')
+    print("\nCleaned data saved to 'cleaned_chicken_data.cols'")
+    print("Grouped cooking sessions saved to 'grouped_cooking_sessions.cols'")
+
+    # Text copies on request (python clean.py --export)
+    if '--export' in sys.argv[1:]:
+        data_filtered.to_json('cleaned_chicken_data.json', date_format='iso')
+        cooking_sessions.to_csv('grouped_cooking_sessions.csv', index=False)
+        print("Also exported to 'cleaned_chicken_data.json' and 'grouped_cooking_sessions.csv'")
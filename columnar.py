@@ -0,0 +1,180 @@
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+from time import perf_counter
+import numpy as np
+import pandas as pd
+
+# Binary columnar format for the pipeline's intermediate tables. A table is a
+# directory:
+#   <name>.cols/meta.json      format, row count, index and one entry per column
+#   <name>.cols/<n>.npy        the column's values
+# Numeric, bool and naive datetime columns are stored as they are in memory,
+# tz-aware datetimes as UTC values plus the zone, nullable ints and floats as
+# values plus a mask, and strings as codes into a table of the distinct values.
+# Anything else is pickled. .npy files are memory-mapped on load, so nothing
+# is parsed and columns that are never touched are never read.
+COLUMNAR_FORMAT = 1
+
+
+def save_column(series, path, stem):
+    dtype = series.dtype
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        np.save(os.path.join(path, f'{stem}.npy'), series.dt.tz_convert('UTC').dt.tz_localize(None).to_numpy())
+        return {'kind': 'datetimetz', 'tz': str(dtype.tz)}
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype) and hasattr(series.array, '_mask'):
+        # Nullable Int64/Float64/boolean
+        np.save(os.path.join(path, f'{stem}.npy'), series.to_numpy(dtype=dtype.numpy_dtype, na_value=0))
+        np.save(os.path.join(path, f'{stem}.mask.npy'), series.isna().to_numpy())
+        return {'kind': 'masked', 'dtype': str(dtype)}
+    if isinstance(dtype, np.dtype) and dtype.kind in 'biufcmM':
+        np.save(os.path.join(path, f'{stem}.npy'), series.to_numpy())
+        return {'kind': 'numpy'}
+    if pd.api.types.infer_dtype(series, skipna=True) in ('string', 'empty'):
+        codes, uniques = pd.factorize(series)
+        np.save(os.path.join(path, f'{stem}.npy'), codes.astype(np.int32))
+        np.save(os.path.join(path, f'{stem}.values.npy'), np.asarray(uniques, dtype=str))
+        return {'kind': 'strings', 'dtype': str(dtype)}
+    with open(os.path.join(path, f'{stem}.pkl'), 'wb') as f:
+        pickle.dump(series.array, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return {'kind': 'pickle'}
+
+def load_column(path, column, mmap=True):
+    # Returns an array for the DataFrame constructor. Files are mapped
+    # copy-on-write: pages are shared until a caller writes to them, and
+    # writes never reach the file.
+    stem = os.path.join(path, column['stem'])
+    mmap_mode = 'c' if mmap else None
+    kind = column['kind']
+    if kind == 'pickle':
+        with open(f'{stem}.pkl', 'rb') as f:
+            return pickle.load(f)
+    values = np.load(f'{stem}.npy', mmap_mode=mmap_mode).view(np.ndarray)
+    if kind == 'numpy':
+        return values
+    if kind == 'datetimetz':
+        return pd.Series(values, copy=False).dt.tz_localize('UTC').dt.tz_convert(column['tz']).array
+    if kind == 'masked':
+        mask = np.load(f'{stem}.mask.npy', mmap_mode=mmap_mode).view(np.ndarray)
+        return pd.api.types.pandas_dtype(column['dtype']).construct_array_type()(values, mask)
+    if kind == 'strings':
+        uniques = np.load(f'{stem}.values.npy').astype(object)
+        return pd.Categorical.from_codes(values, categories=uniques, validate=False).astype(column['dtype'])
+    raise ValueError(f"Unknown column kind {kind}")
+
+
+def save_frame(df, path):
+    # Written next to the destination and renamed into place, so readers
+    # never see a half-written table
+    tmp = f'{path}.tmp{os.getpid()}'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    columns = []
+    for position, (name, series) in enumerate(df.items()):
+        column = save_column(series, tmp, str(position))
+        columns.append(dict(column, name=name, stem=str(position)))
+    if isinstance(df.index, pd.RangeIndex):
+        index = {'kind': 'range', 'start': df.index.start, 'step': df.index.step, 'name': df.index.name}
+    else:
+        index = dict(save_column(df.index.to_series(), tmp, 'index'), stem='index', name=df.index.name)
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump({'format': COLUMNAR_FORMAT, 'rows': len(df), 'index': index, 'columns': columns}, f, indent=2)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+
+def load_frame(path, columns=None, mmap=True):
+    # columns: load only these columns, in this order
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta['format'] != COLUMNAR_FORMAT:
+        raise ValueError(f"Unsupported columnar format {meta['format']} in {path}")
+    stored = {column['name']: column for column in meta['columns']}
+    names = list(stored) if columns is None else columns
+    data = {name: load_column(path, stored[name], mmap) for name in names}
+
+    index = meta['index']
+    if index['kind'] == 'range':
+        rows = range(index['start'], index['start'] + meta['rows'] * index['step'], index['step'])
+        index_values = pd.RangeIndex(rows.start, rows.stop, rows.step, name=index['name'])
+    else:
+        index_values = pd.Index(load_column(path, index, mmap), name=index['name'])
+    return pd.DataFrame(data, index=index_values, columns=names, copy=False)
+
+
+def table_or_export(path, export_path, producer):
+    # The scripts' defaults are .cols tables, which are build outputs and not
+    # in the repository. Fall back to the text export committed with it, and
+    # with neither say which script writes the table.
+    if not path.endswith('.cols') or os.path.exists(os.path.join(path, 'meta.json')):
+        return path
+    if os.path.exists(export_path):
+        print(f"'{path}' not found, reading '{export_path}' (run {producer} to build it)")
+        return export_path
+    sys.exit(f"'{path}' not found: run {producer} first")
+
+
+def benchmark(rows=1_000_000, tmp_dir=None):
+    # Load times for the session table in each format, at `rows` rows made by
+    # repeating grouped_cooking_sessions.csv a week apart
+    sessions = pd.read_csv('grouped_cooking_sessions.csv')
+    time_columns = ['start_time', 'expected_end_time', 'leftovers_time', 'end_time']
+    for col in time_columns:
+        sessions[col] = pd.to_datetime(sessions[col], utc=True, format='mixed').dt.tz_convert('US/Eastern')
+    repeats = -(-rows // len(sessions))
+    frame = pd.concat([sessions] * repeats, ignore_index=True).iloc[:rows]
+    shift = pd.to_timedelta(np.repeat(np.arange(repeats), len(sessions))[:rows] * 7, unit='D')
+    for col in time_columns:
+        frame[col] = frame[col] + shift
+
+    def read_csv(path):
+        data = pd.read_csv(path)
+        for col in time_columns:
+            data[col] = pd.to_datetime(data[col], utc=True, format='mixed').dt.tz_convert('US/Eastern')
+        return data
+
+    def read_json(path):
+        data = pd.read_json(path, orient='records', convert_dates=False)
+        for col in time_columns:
+            data[col] = pd.to_datetime(data[col], utc=True, format='mixed').dt.tz_convert('US/Eastern')
+        return data
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as path:
+        csv_path = os.path.join(path, 'sessions.csv')
+        json_path = os.path.join(path, 'sessions.json')
+        cols_path = os.path.join(path, 'sessions.cols')
+        frame.to_csv(csv_path, index=False)
+        frame.to_json(json_path, orient='records', date_format='iso', date_unit='us')
+        save_frame(frame, cols_path)
+        sizes = {
+            'csv': os.path.getsize(csv_path),
+            'json': os.path.getsize(json_path),
+            'cols': sum(os.path.getsize(os.path.join(cols_path, name)) for name in os.listdir(cols_path)),
+        }
+        cases = [
+            ('csv + parse dates', 'csv', lambda: read_csv(csv_path)),
+            ('json + parse dates', 'json', lambda: read_json(json_path)),
+            ('cols, mmap', 'cols', lambda: load_frame(cols_path)),
+            ('cols, read', 'cols', lambda: load_frame(cols_path, mmap=False)),
+            ('cols, 3 columns', 'cols', lambda: load_frame(cols_path, ['oven', 'start_time', 'leftovers'])),
+        ]
+        print(f"{len(frame)} sessions")
+        print(f"{'Format':<20} {'MB':>8} {'Load s':>8}")
+        for name, size_key, load in cases:
+            start = perf_counter()
+            loaded = load()
+            seconds = perf_counter() - start
+            if size_key != 'cols' or name == 'cols, read':
+                # Every format has to come back as the same table
+                pd.testing.assert_frame_equal(loaded, frame, check_dtype=size_key == 'cols', check_index_type=False)
+            print(f"{name:<20} {sizes[size_key] / 1e6:>8.1f} {seconds:>8.3f}")
+
+
+if __name__ == '__main__':
+    # Usage: python columnar.py bench [rows]
+    if len(sys.argv) in (2, 3) and sys.argv[1] == 'bench':
+        benchmark(int(sys.argv[2]) if len(sys.argv) == 3 else 1_000_000)
+    else:
+        print("Usage: python columnar.py bench [rows]")
@@ -0,0 +1,276 @@
+import gzip
+import io
+import json
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from botocore.exceptions import ClientError
+
+# Layout of the event log inside the bucket:
+#   events/segments/<utc time>-<id>.json   small immutable segments, one per append
+#   events/compacted/<seq>.jsonl.gz        compressed segments built by the compactor
+#   events/manifest.json                   ordered list of compacted segments
+# An append is a single put of a new segment, so it costs the same no matter how
+# much history there is. Readers stream the compacted segments listed in the
+# manifest and then every raw segment not compacted into them, listed from
+# LATE_WINDOW before the manifest's watermark.
+SEGMENT_PREFIX = 'events/segments/'
+COMPACTED_PREFIX = 'events/compacted/'
+MANIFEST_KEY = 'events/manifest.json'
+
+# Compact once this many raw segments have piled up
+COMPACT_MIN_SEGMENTS = 50
+COMPACT_INTERVAL = 300  # seconds between compaction checks
+# Raw segments are kept this long after being compacted so readers holding an
+# older manifest can still find them
+COMPACT_GRACE = 600  # seconds
+# Segment keys carry the appender's own clock and a put can take a while to
+# land, so a new segment may sort before ones already listed. Only segments
+# whose key is older than this are compacted; anything newer is left for the
+# next run, by which time every put started before the cutoff has finished.
+COMPACT_LAG = 300  # seconds
+# A segment can still land behind the watermark: its appender's clock ran
+# slow, or its put outlasted COMPACT_LAG. Readers and the compactor list this
+# far behind the watermark and skip the keys the manifest records as
+# compacted, so such a segment is read and compacted late rather than lost.
+# The log assumes appender clocks are within this of each other and of the
+# compactor's, and that no put takes longer.
+LATE_WINDOW = 3600  # seconds
+SEGMENT_STAMP = '%Y%m%dT%H%M%S%f'
+
+
+def is_missing(error):
+    return error.response['Error']['Code'] in ('NoSuchKey', '404')
+
+
+def is_precondition_failed(error):
+    return error.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409')
+
+
+class EventLog:
+    def __init__(self, s3, bucket, legacy_key=None, logger=None):
+        self.s3 = s3
+        self.bucket = bucket
+        # The old single-file history is kept as the first segment of the log
+        self.legacy_key = legacy_key
+        self.logger = logger
+        self._compactor = None
+        self._stop = threading.Event()
+
+    def new_segment_key(self, now=None):
+        stamp = (now or datetime.now(timezone.utc)).strftime(SEGMENT_STAMP)
+        return f"{SEGMENT_PREFIX}{stamp}-{uuid.uuid4().hex[:8]}.json"
+
+    def append(self, entries):
+        if not entries:
+            return None
+        key = self.new_segment_key()
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=json.dumps(entries).encode('utf-8'),
+            ContentType='application/json'
+        )
+        return key
+
+    def load_manifest(self):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=MANIFEST_KEY)
+        except ClientError as e:
+            if not is_missing(e):
+                raise
+            segments = []
+            if self.legacy_key:
+                segments.append({'key': self.legacy_key, 'format': 'json'})
+            return {'watermark': '', 'segments': [], 'legacy': segments}, None
+        manifest = json.loads(response['Body'].read().decode('utf-8'))
+        return manifest, response['ETag']
+
+    def save_manifest(self, manifest, etag):
+        # Only one compactor may win; a stale manifest fails the precondition
+        condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=MANIFEST_KEY,
+            Body=json.dumps(manifest, indent=2).encode('utf-8'),
+            ContentType='application/json',
+            **condition
+        )
+
+    def list_segments(self, start_after=''):
+        paginator = self.s3.get_paginator('list_objects_v2')
+        params = {'Bucket': self.bucket, 'Prefix': SEGMENT_PREFIX}
+        if start_after:
+            params['StartAfter'] = start_after
+        for page in paginator.paginate(**params):
+            for obj in page.get('Contents', []):
+                yield obj['Key']
+
+    def uncompacted_segments(self, manifest, window=LATE_WINDOW):
+        # Raw segments not in any compacted segment of the manifest, in key order
+        watermark = manifest['watermark']
+        if not watermark:
+            yield from self.list_segments()
+            return
+        stamp = datetime.strptime(watermark[len(SEGMENT_PREFIX):].split('-')[0], SEGMENT_STAMP)
+        start_after = SEGMENT_PREFIX + (stamp - timedelta(seconds=window)).strftime(SEGMENT_STAMP)
+        compacted = {key for segment in manifest['segments'] for key in segment.get('raw_segments', [])}
+        # Segments compacted before raw_segments was recorded cover a key range
+        ranges = [(segment['first_segment'], segment['last_segment'])
+                  for segment in manifest['segments'] if 'raw_segments' not in segment and 'first_segment' in segment]
+        for key in self.list_segments(start_after):
+            if key not in compacted and not any(first <= key <= last for first, last in ranges):
+                yield key
+
+    def read_segment(self, key, fmt='json'):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if is_missing(e):
+                return
+            raise
+        if fmt == 'jsonl.gz':
+            with gzip.GzipFile(fileobj=response['Body']) as f:
+                for line in io.TextIOWrapper(f, encoding='utf-8'):
+                    if line.strip():
+                        yield json.loads(line)
+        else:
+            for entry in json.loads(response['Body'].read().decode('utf-8')):
+                yield entry
+
+    def iter_events(self):
+        manifest, _ = self.load_manifest()
+        for segment in manifest.get('legacy', []) + manifest['segments']:
+            yield from self.read_segment(segment['key'], segment['format'])
+        for key in self.uncompacted_segments(manifest):
+            yield from self.read_segment(key)
+
+    def compact(self, min_segments=COMPACT_MIN_SEGMENTS, lag=COMPACT_LAG):
+        manifest, etag = self.load_manifest()
+        deleted = self.delete_compacted_segments(manifest)
+
+        # Every key below the cutoff sorts before any segment still being written
+        cutoff = self.new_segment_key(datetime.now(timezone.utc) - timedelta(seconds=lag))
+        keys = [key for key in self.uncompacted_segments(manifest) if key < cutoff]
+        if len(keys) < min_segments:
+            if deleted:
+                # Remember which raw segments are gone; losing this race only
+                # means deleting them again next time
+                try:
+                    self.save_manifest(manifest, etag)
+                except ClientError as e:
+                    if not is_precondition_failed(e):
+                        raise
+            return 0
+
+        # Write the compacted segment first; it is invisible until the manifest points at it
+        buffer = io.BytesIO()
+        count = 0
+        with gzip.GzipFile(fileobj=buffer, mode='wb') as f:
+            for key in keys:
+                for entry in self.read_segment(key):
+                    f.write((json.dumps(entry) + '\n').encode('utf-8'))
+                    count += 1
+        compacted_key = f"{COMPACTED_PREFIX}{len(manifest['segments']):08d}-{uuid.uuid4().hex[:8]}.jsonl.gz"
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=compacted_key,
+            Body=buffer.getvalue(),
+            ContentType='application/gzip'
+        )
+
+        manifest['segments'].append({
+            'key': compacted_key,
+            'format': 'jsonl.gz',
+            'count': count,
+            'first_segment': keys[0],
+            'last_segment': keys[-1],
+            # Exactly the raw segments in this one; only these are ever deleted
+            'raw_segments': keys,
+            'compacted_at': time.time()
+        })
+        manifest['watermark'] = max(manifest['watermark'], keys[-1])
+        try:
+            self.save_manifest(manifest, etag)
+        except ClientError as e:
+            if not is_precondition_failed(e):
+                raise
+            # Another worker compacted first; drop our copy
+            self.s3.delete_object(Bucket=self.bucket, Key=compacted_key)
+            return 0
+        if self.logger:
+            self.logger.info(f"Compacted {len(keys)} segments ({count} events) into {compacted_key}")
+        return len(keys)
+
+    def delete_compacted_segments(self, manifest):
+        # Remove the raw segments recorded in compacted segments once every
+        # reader has had time to see the new manifest. Only recorded keys are
+        # deleted, never a key range, so a segment that landed late behind the
+        # watermark is left alone. Deleted keys are dropped from the manifest
+        # and keys S3 failed to delete stay recorded, so readers keep skipping
+        # them; returns the number of keys deleted.
+        cutoff = time.time() - COMPACT_GRACE
+        deleted = 0
+        for segment in manifest['segments']:
+            doomed = segment.get('raw_segments')
+            if not doomed or segment.get('compacted_at', 0) >= cutoff:
+                continue
+            failed = set()
+            for i in range(0, len(doomed), 1000):
+                response = self.s3.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={'Objects': [{'Key': key} for key in doomed[i:i + 1000]], 'Quiet': True}
+                )
+                failed.update(error['Key'] for error in response.get('Errors', []))
+            deleted += len(doomed) - len(failed)
+            segment['raw_segments'] = [key for key in doomed if key in failed]
+        return deleted
+
+    def start_compactor(self, interval=COMPACT_INTERVAL):
+        if self._compactor is not None:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.compact()
+                except Exception as e:
+                    if self.logger:
+                        self.logger.error(f"Event log compaction failed: {str(e)}")
+
+        self._compactor = threading.Thread(target=run, name='event-log-compactor', daemon=True)
+        self._compactor.start()
+
+    def stop_compactor(self):
+        self._stop.set()
+
+
+def export_events(event_log, filename):
+    # Stream the whole log into a local JSON array for the offline scripts
+    count = 0
+    with open(filename, 'w') as f:
+        f.write('[\n')
+        for entry in event_log.iter_events():
+            if count:
+                f.write(',\n')
+            f.write(json.dumps(entry))
+            count += 1
+        f.write('\n]\n')
+    return count
+
+
+if __name__ == '__main__':
+    import boto3
+
+    # Usage: python event_log.py export <file>   |   python event_log.py compact
+    s3 = boto3.client('s3')
+    log = EventLog(s3, 'chickentraining', legacy_key='chicken_data.json')
+    if len(sys.argv) >= 3 and sys.argv[1] == 'export':
+        count = export_events(log, sys.argv[2])
+        print(f"Exported {count} events to '{sys.argv[2]}'")
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'compact':
+        print(f"Compacted {log.compact(min_segments=1)} segments")
+    else:
+        print("Usage: python event_log.py export <file> | compact")
@@ -1,76 +1,87 @@
-from flask import Flask, jsonify, render_template, request
-import pickle
+from flask import Flask, g, jsonify, render_template, request
 from datetime import datetime, timedelta, time
-import pytz
 import numpy as np
-from queue import Queue
-from flask import Response
 import os
+import hashlib
+import threading
 from urllib.parse import unquote
 from werkzeug.serving import is_running_from_reloader
+from chicken_model import FEATURES, TARGETS, predict_fused, time_features, similar_sessions
+from model_store import ModelStore, ModelCache
+from shared_state import SharedState
+from sse_hub import BroadcastHub, make_asgi_app
+from stores import load_registry
 
 # Add near the top with other imports
 STATIC_SCHEDULE_DIR = os.path.join(os.path.dirname(__file__), 'staticschedule')
 
 app = Flask(__name__, template_folder='.')
 
-# Load the saved models
-with open('chicken_models.pkl', 'rb') as f:
-    saved_data = pickle.load(f)
-    models = saved_data['models']
-
-# Define the Eastern timezone
-eastern = pytz.timezone('US/Eastern')
-
-# Global variables
-current_prediction = None
-last_ml_prediction_time = None
-oven_details = [{'time': '--:--', 'status': 'Idle', 'leftovers': '--'} for _ in range(4)]
-clients = set()
-last_manual_update = None
+# Model artifacts are memory-mapped read-only, so the fused trees and lookup
+# tables are shared by every worker through the page cache; the training data
+# in the artifact is never touched when serving. MODEL_DIR is the default
+# store's artifact root; other stores have theirs in the registry.
+MODEL_DIR = os.environ.get('MODEL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models'))
+
+# Every store this deployment serves, with its hours, timezone, oven count and
+# models (see stores.py). Requests pick their store with ?store=<store ID>;
+# without it they are for the default store.
+STORE_REGISTRY = os.environ.get('STORE_REGISTRY', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stores.json'))
+registry = load_registry(STORE_REGISTRY, MODEL_DIR)
+
+# Pre-encoded /predict response per store for this worker. It is rebuilt when
+# the store's shared prediction state changes or when the clock reaches the
+# next point at which the response would change (see next_response_change).
+PREDICT_MAX_AGE = 30  # seconds; upper bound for Cache-Control max-age
+CONFIRMED_SECONDS = 5400  # a manual update counts as confirmed for 90 minutes
+predict_cache = {}  # store ID: (state_key, expires, body, etag)
+predict_cache_locks = {}  # store ID: lock held while that store's response is rebuilt
+
+# Fans SSE updates out to the /events connections on this worker, each
+# subscribed to the store its ?store= names
+hub = BroadcastHub(channel=lambda query: (query.get('store') or [registry.default])[0])
+
+# Prediction state lives in a SQLite file shared by all workers on the host,
+# under keys prefixed with the store ID (see state_key):
+#   chain              memoized prediction chain for one day (see extend_chain)
+#   model_version      model version the chain should be built with (see rebuild_chain)
+#   last_ml_prediction_time, last_manual_update
+# and, for every store at once,
+#   update_counts      {store ID: manual reports}; workers watch it to push SSE updates
+# Values are replaced, never mutated in place, so transaction() can tell what changed.
+SHARED_STATE_PATH = os.environ.get('SHARED_STATE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prediction_state.sqlite'))
+shared_state = SharedState(SHARED_STATE_PATH)
 
 ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
 if not ADMIN_TOKEN:
     raise ValueError("ADMIN_TOKEN environment variable must be set")
 
-def get_opening_time(date):
-    day_of_week = date.weekday()
-    if day_of_week == 6:  # Sunday
-        opening_time = time(10, 0)
-    else:
-        opening_time = time(8, 0)
-    naive_datetime = datetime.combine(date, opening_time)
-    return eastern.localize(naive_datetime)
+def state_key(store, name):
+    return f'{store.id}/{name}'
 
-def get_closing_time(date):
-    if date.weekday() == 6:  # Sunday
-        closing_time = time(18, 0)  # 6 PM closing time on Sundays
-    else:
-        closing_time = time(20, 0)  # 8 PM closing time for other days
-    naive_datetime = datetime.combine(date, closing_time)
-    return eastern.localize(naive_datetime)
+def is_within_operating_hours(store, current_time):
+    opening_time = store.hours.opening_time(current_time.date())
+    closing_time = store.hours.closing_time(current_time.date())
+    return opening_time <= current_time < closing_time
 
-def get_last_batch_time(date):
-    return get_closing_time(date) - timedelta(minutes=60)  # No batches in last hour
+def oven_outputs(model, prediction_time):
+    # Time to next batch (minutes) and leftovers for every oven, read from the
+    # per-oven lookup tables indexed as [oven, day_of_week, hour, minute], or
+    # computed with the fused trees for an artifact that has no tables
+    if model.time_table is None:
+        outputs = predict_fused(model.fused, time_features([prediction_time]))[0]
+        return outputs[:, TARGETS.index('time')], outputs[:, TARGETS.index('leftovers')]
+    index = (slice(None), prediction_time.weekday(), prediction_time.hour, prediction_time.minute)
+    return model.time_table[index], model.leftovers_table[index]
 
-def is_within_operating_hours(current_time):
-    opening_time = get_opening_time(current_time.date())
-    closing_time = get_closing_time(current_time.date())
-    return opening_time <= current_time < closing_time
+def predict_using_ml(prediction_time, model):
+    times_to_next, all_leftovers = oven_outputs(model, prediction_time)  # in minutes
 
-def predict_using_ml(prediction_time):
-    hour = prediction_time.hour
-    minute = prediction_time.minute
-    day_of_week = prediction_time.weekday()
-    
-    input_data = np.array([[hour, minute, day_of_week]])
-    
     earliest_time = None
     oven_predictions = []
-    for i, (oven, model) in enumerate(models.items()):
-        time_to_next = float(model['time'].predict(input_data)[0])  # in minutes
-        next_time = prediction_time + timedelta(minutes=time_to_next)
-        leftovers = float(model['leftovers'].predict(input_data)[0])
+    for i in range(len(times_to_next)):
+        next_time = prediction_time + timedelta(minutes=float(times_to_next[i]))
+        leftovers = float(all_leftovers[i])
         
         oven_predictions.append({
             'oven': i + 1,
@@ -83,147 +94,280 @@ def predict_using_ml(prediction_time):
     
     return earliest_time, oven_predictions
 
-def adjust_prediction(prediction, base_time):
-    if not is_within_operating_hours(prediction):
-        next_opening = get_opening_time(prediction.date() + timedelta(days=1))
+def adjust_prediction(store, prediction, base_time):
+    hours = store.hours
+    if not is_within_operating_hours(store, prediction):
+        next_opening = hours.opening_time(prediction.date() + timedelta(days=1))
         return next_opening
 
-    last_batch = get_last_batch_time(prediction.date())
+    last_batch = hours.last_batch_time(prediction.date())
     if prediction > last_batch:
         if base_time.date() == prediction.date():
             if prediction.weekday() == 6:  # Sunday
                 return prediction  # Allow predictions within buffer on Sundays
             else:
                 next_day = prediction.date() + timedelta(days=1)
-                return get_opening_time(next_day)
+                return hours.opening_time(next_day)
         else:
-            return get_opening_time(prediction.date())
+            return hours.opening_time(prediction.date())
 
     return prediction
 
-def predict_next_oven_time(force_new_prediction=False):
-    global last_ml_prediction_time, current_prediction, oven_details
+def new_chain(anchor, date, model):
+    # The chain starts at the anchor (opening time, or the last manually
+    # reported time) and each hop is (prediction_time, next_oven_time,
+    # oven_predictions). It is only ever extended from its last hop, and only
+    # replaced by a new day, a manual report or a newer model version.
+    return {'date': date, 'anchor': anchor, 'hops': [], 'version': model.version}
+
+def chain_is_current(chain, current_time, version):
+    if chain is None or chain['date'] != current_time.date() or chain.get('version') != version:
+        return False
+    hops = chain['hops']
+    if not hops:
+        return chain['anchor'] > current_time
+    return hops[-1][1] > current_time
+
+def extend_chain(store, chain, current_time, model):
+    # Returns a copy of the chain whose last hop ends after current_time,
+    # running inference only for hops that are not cached yet
+    hops = list(chain['hops'])
+    anchor = chain['anchor']
+    if not hops and anchor > current_time:
+        # A reported time in the future stands until it has passed
+        return chain
+
+    while not hops or hops[-1][1] <= current_time:
+        prediction_time = hops[-1][1] if hops else anchor
+        next_oven_time, oven_predictions = predict_using_ml(prediction_time, model)
+        next_oven_time = adjust_prediction(store, next_oven_time, prediction_time)
+        hops.append((prediction_time, next_oven_time, oven_predictions))
+        if next_oven_time <= prediction_time:
+            break  # Never spin on a chain that does not move forward
+    return dict(chain, hops=hops)
+
+def chain_prediction(chain):
+    # Next oven time and the oven predictions behind it
+    if not chain['hops']:
+        return chain['anchor'], None
+    return chain['hops'][-1][1], chain['hops'][-1][2]
+
+def get_oven_details(store, oven_predictions, current_time):
+    oven_details = [{'time': '--:--', 'status': 'Idle', 'leftovers': '--'} for _ in range(store.ovens)]
+    for pred in oven_predictions or []:
+        i = pred['oven'] - 1
+        if pred['next_time'] and pred['next_time'] > current_time:
+            time_diff = pred['next_time'] - current_time
+            time_str = f"{time_diff.seconds // 60:02d}:{time_diff.seconds % 60:02d}"
+            status = 'Active'
+        else:
+            time_str = '--:--'
+            status = 'Idle'
 
-    current_time = datetime.now(eastern)
-    opening_time = get_opening_time(current_time.date())
+        oven_details[i] = {
+            'time': time_str,
+            'status': status,
+            'leftovers': pred['leftovers']
+        }
+    return oven_details
+
+def current_chain(store, current_time, force_new_prediction=False):
+    # Steady state is a read of this worker's cached copy; only a worker that
+    # needs new hops takes the write lock, and it rechecks once it has it
+    model = models.get(store.id).current
+    chain_key, version_key = state_key(store, 'chain'), state_key(store, 'model_version')
+    state = shared_state.snapshot()
+    if state.get(version_key, model.version) != model.version:
+        # Another worker has swapped models; follow it now rather than at the next poll
+        models.check_now()
+    chain = state.get(chain_key)
+    if chain_is_current(chain, current_time, state.get(version_key, model.version)) and not force_new_prediction:
+        return chain
+
+    with shared_state.transaction() as state:
+        chain = state.get(chain_key)
+        version = state.get(version_key, model.version)
+        if version != model.version:
+            # The store serves another version (see rebuild_chain) and this
+            # worker has not swapped to it yet. Only workers on that version
+            # write the chain, so use the stored one if it is current, and
+            # otherwise answer from this model without storing it.
+            if chain_is_current(chain, current_time, version):
+                return chain
+            today = chain is not None and chain['date'] == current_time.date()
+            anchor = chain['anchor'] if today else store.hours.opening_time(current_time.date())
+            return extend_chain(store, new_chain(anchor, current_time.date(), model), current_time, model)
+        if chain is None or chain['date'] != current_time.date():
+            # If no batches have been reported today, simulate from opening time
+            chain = new_chain(store.hours.opening_time(current_time.date()), current_time.date(), model)
+        elif force_new_prediction or chain.get('version') != model.version:
+            chain = new_chain(chain['anchor'], current_time.date(), model)
+        if not chain_is_current(chain, current_time, model.version):
+            chain = extend_chain(store, chain, current_time, model)
+            state[state_key(store, 'last_ml_prediction_time')] = current_time
+        state[chain_key] = chain
+    return chain
+
+def rebuild_chain(store, model):
+    # Reload hook: make this model the one every worker serves for the store,
+    # and replay today's chain from its anchor with it before the swap so that
+    # no request has to rebuild it on the hot path
+    if len(model.fused['ovens']) > store.ovens:
+        raise ValueError(f"Model {model.version} has {len(model.fused['ovens'])} ovens, store {store.id} has {store.ovens}")
+    current_time = datetime.now(store.timezone)
+    chain_key = state_key(store, 'chain')
+    with shared_state.transaction() as state:
+        state[state_key(store, 'model_version')] = model.version
+        chain = state.get(chain_key)
+        if chain is None or chain['date'] != current_time.date() or chain.get('version') == model.version:
+            return  # Nothing cached for today, or another worker got here first
+        chain = new_chain(chain['anchor'], current_time.date(), model)
+        if current_time > store.hours.opening_time(current_time.date()):
+            chain = extend_chain(store, chain, current_time, model)
+        state[chain_key] = chain
+
+def load_models(store_id):
+    store = registry.get(store_id)
+    return ModelStore(store.models, prepare=lambda model: rebuild_chain(store, model),
+                      logger=app.logger, pinned=store.model_version)
+
+# Each worker loads a store's models on the store's first request and keeps
+# the ones it served most recently, up to MODEL_CACHE_MB of mapped arrays. One
+# thread polls the loaded stores' CURRENT and swaps in new versions once
+# today's chain has been rebuilt with them.
+MODEL_CACHE_MB = float(os.environ.get('MODEL_CACHE_MB', 256))
+models = ModelCache(load_models, max_bytes=int(MODEL_CACHE_MB * 1024 * 1024), logger=app.logger)
+models.get(registry.default)
+models.start()
+
+@app.before_request
+def resolve_store():
+    store = registry.get(request.args.get('store'))
+    if store is None:
+        return jsonify({'status': 'error', 'message': f"Unknown store {request.args['store']}"}), 404
+    g.store = store
+
+def predict_next_oven_time(store, force_new_prediction=False):
+    current_time = datetime.now(store.timezone)
+    opening_time = store.hours.opening_time(current_time.date())
     
-    # If we're past opening time and no batches reported today,
-    # simulate from opening time
-    if current_time > opening_time:
-        if not last_ml_prediction_time or last_ml_prediction_time.date() != current_time.date():
-            prediction_time = opening_time
-        else:
-            prediction_time = last_ml_prediction_time
-    else:
+    if current_time <= opening_time:
         # If before opening time, start from opening time
-        prediction_time = opening_time
         return opening_time
 
-    # Changed condition to handle None case
-    if (force_new_prediction or 
-        last_ml_prediction_time is None or 
-        current_prediction is None or 
-        current_time >= current_prediction):
-        
-        next_oven_time = None
-        # Initialize oven_predictions outside the loop
-        _, oven_predictions = predict_using_ml(prediction_time)
-
-        while prediction_time <= current_time:
-            next_oven_time, oven_predictions = predict_using_ml(prediction_time)
-            next_oven_time = adjust_prediction(next_oven_time, prediction_time)
-            
-            if next_oven_time is None or next_oven_time > current_time:
-                break
-            
-            prediction_time = next_oven_time
-
-        # Update oven_details
-        for pred in oven_predictions:
-            i = pred['oven'] - 1
-            if pred['next_time'] and pred['next_time'] > current_time:
-                time_diff = pred['next_time'] - current_time
-                time_str = f"{time_diff.seconds // 60:02d}:{time_diff.seconds % 60:02d}"
-                status = 'Active'
-            else:
-                time_str = '--:--'
-                status = 'Idle'
-
-            oven_details[i] = {
-                'time': time_str,
-                'status': status,
-                'leftovers': pred['leftovers']
-            }
-
-        last_ml_prediction_time = current_time
-        current_prediction = next_oven_time
-
-    return current_prediction
+    next_oven_time, _ = chain_prediction(current_chain(store, current_time, force_new_prediction))
+    return next_oven_time
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/predict', methods=['GET'])
-def get_predictions():
-    next_oven_time = predict_next_oven_time()
-    current_time = datetime.now(eastern)
+def prediction_state_key(store, state):
+    # Everything in the shared state that the store's /predict response depends on
+    chain = state.get(state_key(store, 'chain'))
+    if chain is None:
+        chain_key = None
+    else:
+        chain_key = (chain['date'], chain['anchor'], len(chain['hops']), chain_prediction(chain)[0], chain.get('version'))
+    return chain_key, state.get(state_key(store, 'last_manual_update')), state.get(state_key(store, 'last_ml_prediction_time'))
+
+def next_response_change(store, current_time, next_oven_time, last_manual_update):
+    # Earliest time at which the same state gives a different response: the
+    # prediction passing, opening/closing, confirmation expiring, or midnight
+    date = current_time.date()
+    candidates = [
+        store.hours.opening_time(date),
+        store.hours.closing_time(date),
+        store.timezone.localize(datetime.combine(date + timedelta(days=1), time(0, 0))),
+    ]
+    if next_oven_time:
+        candidates.append(next_oven_time)
+    if last_manual_update:
+        candidates.append(last_manual_update + timedelta(seconds=CONFIRMED_SECONDS))
+    return min(t for t in candidates if t > current_time)
+
+def build_prediction_response(store):
+    next_oven_time = predict_next_oven_time(store)
+    current_time = datetime.now(store.timezone)
+    state = shared_state.snapshot()
+    last_manual_update = state.get(state_key(store, 'last_manual_update'))
+    last_ml_prediction_time = state.get(state_key(store, 'last_ml_prediction_time'))
     
     # Calculate how old the last manual update is
     is_confirmed = False
     if last_manual_update:
         time_since_update = current_time - last_manual_update
-        is_confirmed = time_since_update.total_seconds() < 5400  # 90 minutes in seconds
+        is_confirmed = time_since_update.total_seconds() < CONFIRMED_SECONDS
     
     # Add last_prediction to response
     last_prediction = last_ml_prediction_time if last_ml_prediction_time else None
     
-    return jsonify({
+    # current_time is the time the response was built
+    body = app.json.dumps({
         'current_time': current_time.isoformat(),
-        'is_open': is_within_operating_hours(current_time),
+        'is_open': is_within_operating_hours(store, current_time),
         'earliest_time': next_oven_time.isoformat() if next_oven_time else None,
         'is_sunday': current_time.weekday() == 6,
         'last_manual_update': last_manual_update.isoformat() if last_manual_update else None,
         'is_confirmed': is_confirmed,
         'last_prediction': last_prediction.isoformat() if last_prediction else None
-    })
+    }).encode('utf-8')
+    expires = next_response_change(store, current_time, next_oven_time, last_manual_update)
+    etag = hashlib.md5(body).hexdigest()
+    return prediction_state_key(store, state), expires, body, etag
+
+@app.route('/predict', methods=['GET'])
+def get_predictions():
+    store = g.store
+    current_time = datetime.now(store.timezone)
+    key = prediction_state_key(store, shared_state.snapshot())
+    
+    cached = predict_cache.get(store.id)
+    if cached is None or cached[0] != key or current_time >= cached[1]:
+        # Single flight per store: one request rebuilds, the others for the
+        # same store wait and reuse it, and other stores are not held up
+        with predict_cache_locks.setdefault(store.id, threading.Lock()):
+            # The request that held the lock may have moved the chain on
+            key = prediction_state_key(store, shared_state.snapshot())
+            cached = predict_cache.get(store.id)
+            if cached is None or cached[0] != key or current_time >= cached[1]:
+                cached = predict_cache[store.id] = build_prediction_response(store)
+    
+    _, expires, body, etag = cached
+    max_age = max(0, min(PREDICT_MAX_AGE, int((expires - current_time).total_seconds())))
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'public, max-age={max_age}'
+    return response.make_conditional(request)
 
 @app.route('/report-actual-time', methods=['POST'])
 def report_actual_time():
-    global current_prediction, last_ml_prediction_time, last_manual_update
+    store = g.store
     data = request.json
-    app.logger.info(f'Received data: {data}')
-    actual_time = datetime.fromisoformat(data['actual_time']).astimezone(eastern)
-    current_time = datetime.now(eastern)
+    app.logger.info(f'Received data for {store.id}: {data}')
+    actual_time = datetime.fromisoformat(data['actual_time']).astimezone(store.timezone)
+    current_time = datetime.now(store.timezone)
+    model = models.get(store.id).current
     
-    if actual_time > current_time:
-        # Future time: just set it directly
-        next_oven_time = adjust_prediction(actual_time, current_time)
-        message = 'Future time set directly'
-    else:
-        # Past time: start new prediction chain from this time
-        prediction_time = actual_time
-        next_oven_time = None
+    with shared_state.transaction() as state:
+        if actual_time > current_time:
+            # Future time: just set it directly
+            chain = new_chain(adjust_prediction(store, actual_time, current_time), current_time.date(), model)
+            message = 'Future time set directly'
+        else:
+            # Past time: drop the cached hops and chain forward from this time
+            chain = extend_chain(store, new_chain(actual_time, current_time.date(), model), current_time, model)
+            message = 'New prediction chain from reported time'
         
-        # Chain predictions forward until we get a future time
-        while prediction_time <= current_time:
-            next_oven_time, oven_predictions = predict_using_ml(prediction_time)
-            next_oven_time = adjust_prediction(next_oven_time, prediction_time)
-            
-            if next_oven_time is None or next_oven_time > current_time:
-                break
-            
-            prediction_time = next_oven_time
-            
-        message = 'New prediction chain from reported time'
-    
-    global current_prediction, last_ml_prediction_time
-    current_prediction = next_oven_time
-    last_ml_prediction_time = actual_time
-    last_manual_update = datetime.now(eastern)  # Set the last update time
+        state[state_key(store, 'chain')] = chain
+        state[state_key(store, 'last_ml_prediction_time')] = actual_time
+        state[state_key(store, 'last_manual_update')] = last_manual_update = datetime.now(store.timezone)  # Set the last update time
+        # Every worker watching update_counts notifies its own SSE clients of this store
+        update_counts = dict(state.get('update_counts', {}))
+        update_counts[store.id] = update_counts.get(store.id, 0) + 1
+        state['update_counts'] = update_counts
     
-    # Notify all clients of the update
-    notify_clients()
+    current_prediction, _ = chain_prediction(chain)
     
     return jsonify({
         'status': 'success', 
@@ -234,12 +378,75 @@ def report_actual_time():
 
 @app.route('/oven-status')
 def get_oven_status():
-    predict_next_oven_time()  # Ensure we have the latest prediction
-    return jsonify(oven_details)
+    store = g.store
+    current_time = datetime.now(store.timezone)
+    oven_predictions = None
+    if current_time > store.hours.opening_time(current_time.date()):
+        # Ensure we have the latest prediction
+        _, oven_predictions = chain_prediction(current_chain(store, current_time))
+    return jsonify(get_oven_details(store, oven_predictions, current_time))
+
+def explain_prediction(model, prediction_time):
+    # Everything behind one prediction, read from the artifact's tables: what
+    # each oven's forests predict, how much they rely on each feature and the
+    # training sessions that looked most like this input
+    hour, minute, day_of_week = prediction_time.hour, prediction_time.minute, prediction_time.weekday()
+    times_to_next, all_leftovers = oven_outputs(model, prediction_time)
+    ovens = []
+    for i in range(len(model.fused['ovens'])):
+        oven = {
+            'oven': i + 1,
+            'time_to_next': round(float(times_to_next[i]), 2),
+            'leftovers': round(float(all_leftovers[i]), 2),
+            'feature_importance': None,
+            'similar_sessions': [],
+        }
+        if model.feature_importance is not None and not np.isnan(model.feature_importance[i]).any():
+            oven['feature_importance'] = {
+                target: dict(zip(FEATURES, (round(float(v), 4) for v in model.feature_importance[i, t])))
+                for t, target in enumerate(TARGETS)
+            }
+        if model.neighbors is not None:
+            for X, time_to_next, leftovers, distance in zip(*similar_sessions(model.neighbors, i, hour, minute, day_of_week)):
+                oven['similar_sessions'].append({
+                    **dict(zip(FEATURES, (int(v) for v in X))),
+                    'time_to_next': round(float(time_to_next), 2),
+                    'leftovers': round(float(leftovers), 2),
+                    'distance': round(float(distance), 3),
+                })
+        ovens.append(oven)
+    return ovens
+
+@app.route('/explain')
+def explain():
+    # Why the countdown says what it says. Explains the model inputs behind the
+    # current prediction, or the ones at ?time=<ISO time>.
+    store = g.store
+    model = models.get(store.id).current
+    current_time = datetime.now(store.timezone)
+    prediction_time = None
+    if 'time' in request.args:
+        try:
+            prediction_time = datetime.fromisoformat(request.args['time']).astimezone(store.timezone)
+        except ValueError:
+            return jsonify({'status': 'error', 'message': 'time must be an ISO 8601 time'}), 400
+    elif current_time > store.hours.opening_time(current_time.date()):
+        chain = current_chain(store, current_time)
+        if chain['hops']:
+            # The last hop's start is the input its prediction came from
+            prediction_time = chain['hops'][-1][0]
+    if prediction_time is None:
+        # Before opening, or a manually reported time: no model prediction to explain
+        return jsonify({'model_version': model.version, 'prediction_time': None, 'ovens': []})
+    return jsonify({
+        'model_version': model.version,
+        'prediction_time': prediction_time.isoformat(),
+        'ovens': explain_prediction(model, prediction_time),
+    })
 
 @app.route('/ovens')
 def ovens():
-    return render_template('ovens.html')
+    return render_template('ovens.html', ovens=g.store.ovens)
 
 @app.route('/admin/<token>')
 def admin(token):
@@ -249,55 +456,47 @@ def admin(token):
         return "Unauthorized", 401
     return render_template('admin.html')
 
-def notify_clients():
-    dead_clients = set()
-    app.logger.info(f'Notifying {len(clients)} clients')
-    
-    for client in clients:
-        try:
-            # Non-blocking put with timeout
-            client.put("update", timeout=0.1)
-        except:
-            dead_clients.add(client)
-            app.logger.info('Marked dead client for removal')
-    
-    # Clean up dead clients
-    clients.difference_update(dead_clients)
-
-@app.route('/events')
-def events():
-    def stream():
-        client = Queue(maxsize=5)  # Limit queue size
-        clients.add(client)
-        try:
-            while True:
-                try:
-                    message = client.get(timeout=30)  # Add timeout
-                    yield f"data: {message}\n\n"
-                except:
-                    # Break on timeout or error
-                    break
-        finally:
-            clients.discard(client)
-    
-    return Response(
-        stream(),
-        mimetype='text/event-stream',
-        headers={
-            'Cache-Control': 'no-cache',
-            'Connection': 'keep-alive'
-        }
-    )
+@app.route('/admin/<token>/reload-model', methods=['POST'])
+def reload_model(token):
+    # Swap in a new model version for the store now instead of waiting for the
+    # next poll. With {"version": ...} this also rolls every worker to (or
+    # back to) that version.
+    if unquote(token) != ADMIN_TOKEN:
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
+    version = (request.get_json(silent=True) or {}).get('version')
+    try:
+        store_models = models.get(g.store.id)
+        swapped = store_models.reload(version)
+    except (ValueError, OSError) as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify({'status': 'success', 'store': g.store.id, 'version': store_models.current.version, 'swapped': swapped})
+
+notified_counts = shared_state.snapshot().get('update_counts', {})
+
+def notify_clients(update_counts):
+    # Tell the SSE clients of every store with a new report to refetch
+    global notified_counts
+    for store_id, count in update_counts.items():
+        if notified_counts.get(store_id) != count:
+            app.logger.info(f'Notifying {hub.count(store_id)} clients of {store_id}')
+            hub.publish("update", store_id)
+    notified_counts = update_counts
+
+# Push manual reports from any worker to the SSE clients connected here
+shared_state.watch('update_counts', notify_clients)
 
 @app.route('/schedule')
 def get_schedule():
-    current_time = datetime.now(eastern)
+    current_time = datetime.now(g.store.timezone)
     day_of_week = current_time.weekday()  # 0-6 (Monday-Sunday)
     
     try:
-        # Read schedule based on weekday/weekend
+        # Read schedule based on weekday/weekend, from staticschedule/<store ID>/
+        # if the store has its own
         filename = 'sunday_schedule.txt' if day_of_week == 6 else 'weekday_schedule.txt'
-        filepath = os.path.join(STATIC_SCHEDULE_DIR, filename)
+        filepath = os.path.join(STATIC_SCHEDULE_DIR, g.store.id, filename)
+        if not os.path.exists(filepath):
+            filepath = os.path.join(STATIC_SCHEDULE_DIR, filename)
         
         with open(filepath, 'r') as f:
             schedule = [line.strip().split(',') for line in f if line.strip()]
@@ -309,10 +508,14 @@ def get_schedule():
         print(f"Error loading schedule: {e}")  # For debugging
         return jsonify({'schedule': [], 'error': str(e)}), 500
 
+# /events is served by the asyncio hub, the rest of the app by Flask
+asgi_app = make_asgi_app(app, hub)
+
 if __name__ == '__main__':
-    # Only use Flask's development server when running directly
+    # Only use a single development server when running under the reloader
     if is_running_from_reloader():
-        app.run(host='0.0.0.0', port=5000, debug=True)
+        import uvicorn
+        uvicorn.run(asgi_app, host='0.0.0.0', port=5000)
     else:
         # Use Gunicorn for production
         import gunicorn.app.base
@@ -330,13 +533,13 @@ if __name__ == '__main__':
             def load(self):
                 return self.application
 
+        # Uvicorn workers run the event loop for SSE; Flask requests run on
+        # each worker's pool of WSGI_THREADS threads (see make_asgi_app)
         options = {
             'bind': '0.0.0.0:5000',
             'workers': 3,
-            'threads': 4,
-            'worker_class': 'gthread',
+            'worker_class': 'uvicorn.workers.UvicornWorker',
             'timeout': 120
         }
 
-        StandaloneApplication(app, options).run()
-
+        StandaloneApplication(asgi_app, options).run()
@@ -0,0 +1,372 @@
+import hashlib
+import json
+import os
+import re
+import sys
+from datetime import datetime, timezone
+import numpy as np
+
+# Model artifacts live in a directory of versions:
+#   <root>/CURRENT                  name of the version to serve
+#   <root>/<version>/manifest.json  format, ovens, targets and array index
+#   <root>/<version>/*.npy          fused trees, lookup tables, feature importances
+#                                   and neighbour tables, memory-mapped read-only
+#                                   so every worker shares one copy
+#   <root>/<version>/training.npz   training data, only loaded on demand
+ARTIFACT_FORMAT = 1
+# Version names save_artifact gives: creation time (UTC) and content hash
+VERSION_PATTERN = re.compile(r'\d{8}T\d{6}Z-[0-9a-f]{8}')
+# Prediction targets, in the order they come out of predict_fused()
+TARGETS = ['time', 'leftovers']
+FEATURES = ['hour', 'minute', 'day_of_week']
+FEATURE_SIZES = np.array([24, 60, 7])  # every feature is an integer in range(size)
+# Most similar training rows kept for every possible input (see build_neighbor_tables)
+NEIGHBORS = 5
+NEIGHBOR_ARRAYS = ['neighbor_table', 'neighbor_X', 'neighbor_time', 'neighbor_leftovers']
+
+
+def forest_trees(forest):
+    # A fitted sklearn forest as a list of trees in the fused node layout, with
+    # child indices local to the tree
+    trees = []
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        node_ids = np.arange(tree.node_count)
+        is_leaf = tree.children_left < 0
+        trees.append({
+            'feature': np.where(is_leaf, -1, tree.feature),
+            'threshold': tree.threshold,
+            'left': np.where(is_leaf, node_ids, tree.children_left),
+            'right': np.where(is_leaf, node_ids, tree.children_right),
+            'value': tree.value[:, 0, 0],
+            'importance': estimator.feature_importances_,
+        })
+    return trees
+
+def fuse_models(models):
+    # Flatten every tree of every oven's forests into one set of node arrays so
+    # that all ovens and both targets are evaluated in a single vectorized pass.
+    # Child indices are global; leaves have feature -1 and point at themselves.
+    forests = {
+        int(oven): [forest_trees(model[target]) for target in TARGETS]
+        for oven, model in models.items()
+    }
+    return join_trees(forests)
+
+def join_trees(forests):
+    # {oven: [trees for each target]} -> fused arrays; trees of a group keep
+    # their order, oldest first
+    features, thresholds, lefts, rights, values = [], [], [], [], []
+    roots = []
+    tree_group = []
+    importances = []
+    offset = 0
+    for oven_index, targets in enumerate(forests.values()):
+        for target_index, trees in enumerate(targets):
+            for tree in trees:
+                features.append(tree['feature'])
+                thresholds.append(tree['threshold'])
+                lefts.append(tree['left'] + offset)
+                rights.append(tree['right'] + offset)
+                values.append(tree['value'])
+                # NaN for trees from artifacts that predate importances
+                importances.append(tree.get('importance', np.full(len(FEATURES), np.nan)))
+                roots.append(offset)
+                tree_group.append(oven_index * len(TARGETS) + target_index)
+                offset += len(tree['feature'])
+    return {
+        'ovens': [int(oven) for oven in forests.keys()],
+        'feature': np.concatenate(features).astype(np.int32),
+        'threshold': np.concatenate(thresholds).astype(np.float64),
+        'left': np.concatenate(lefts).astype(np.int32),
+        'right': np.concatenate(rights).astype(np.int32),
+        'value': np.concatenate(values).astype(np.float64),
+        'root': np.array(roots, dtype=np.int32),
+        'tree_group': np.array(tree_group, dtype=np.int32),
+        'tree_importance': np.array(importances, dtype=np.float64).reshape(-1, len(FEATURES)),
+    }
+
+def split_trees(fused):
+    # Inverse of join_trees: {oven: [trees for each target]}
+    ends = np.append(fused['root'][1:], len(fused['feature']))
+    importances = fused.get('tree_importance')
+    if importances is None:
+        importances = np.full((len(fused['root']), len(FEATURES)), np.nan)
+    forests = {oven: [[] for _ in TARGETS] for oven in fused['ovens']}
+    for start, end, group, importance in zip(fused['root'], ends, fused['tree_group'], importances):
+        oven = fused['ovens'][group // len(TARGETS)]
+        forests[oven][group % len(TARGETS)].append({
+            'feature': np.asarray(fused['feature'][start:end]),
+            'threshold': np.asarray(fused['threshold'][start:end]),
+            'left': np.asarray(fused['left'][start:end]) - start,
+            'right': np.asarray(fused['right'][start:end]) - start,
+            'value': np.asarray(fused['value'][start:end]),
+            'importance': np.asarray(importance),
+        })
+    return forests
+
+
+def feature_importances(fused):
+    # Importance of each feature to each oven's forests, computed from the
+    # per-tree importances the way sklearn's feature_importances_ is: the mean
+    # over the trees that are more than a single leaf, normalized to sum to 1.
+    # Trees without a known importance are left out. Returns an array of shape
+    # (n_ovens, len(TARGETS), len(FEATURES)), NaN where nothing is known.
+    n_groups = len(fused['ovens']) * len(TARGETS)
+    importances = np.full((n_groups, len(FEATURES)), np.nan)
+    if fused.get('tree_importance') is not None:
+        tree_importance = np.asarray(fused['tree_importance'])
+        node_count = np.diff(np.append(fused['root'], len(fused['feature'])))
+        known = ~np.isnan(tree_importance).any(axis=1)
+        tree_group = np.asarray(fused['tree_group'])
+        for group in range(n_groups):
+            in_group = known & (tree_group == group)
+            if not in_group.any():
+                continue
+            grown = in_group & (node_count > 1)
+            if grown.any():
+                mean = tree_importance[grown].mean(axis=0)
+                importances[group] = mean / mean.sum()
+            else:
+                importances[group] = 0.0  # Every tree is a single leaf, as sklearn reports it
+    return importances.reshape(len(fused['ovens']), len(TARGETS), len(FEATURES))
+
+
+def predict_fused(fused, X):
+    # Returns an array of shape (n_samples, n_ovens, len(TARGETS))
+    X = np.asarray(X, dtype=np.float32)  # sklearn compares float32 inputs
+    n_samples = X.shape[0]
+    rows = np.arange(n_samples)[:, None]
+    nodes = np.broadcast_to(fused['root'], (n_samples, len(fused['root']))).copy()
+    while True:
+        feature = fused['feature'][nodes]
+        if not (feature >= 0).any():
+            break
+        go_left = X[rows, np.maximum(feature, 0)] <= fused['threshold'][nodes]
+        nodes = np.where(go_left, fused['left'][nodes], fused['right'][nodes])
+
+    # Average the leaf values of each (oven, target) group of trees
+    n_groups = len(fused['ovens']) * len(TARGETS)
+    counts = np.bincount(fused['tree_group'], minlength=n_groups)
+    weights = np.zeros((len(fused['root']), n_groups))
+    weights[np.arange(len(fused['root'])), fused['tree_group']] = 1.0 / counts[fused['tree_group']]
+    return (fused['value'][nodes] @ weights).reshape(n_samples, len(fused['ovens']), len(TARGETS))
+
+
+def time_features(times):
+    return np.array([[t.hour, t.minute, t.weekday()] for t in times])
+
+
+def build_prediction_tables(fused):
+    # The models only see [hour, minute, day_of_week], so there are just
+    # 7 * 24 * 60 possible inputs. Predict them all once so serving is an index.
+    # Tables are float32 arrays indexed as [oven, day_of_week, hour, minute].
+    # Rather than walking every input down every tree, each tree is walked once
+    # over boxes of the input grid: a split cuts its node's box in two, and each
+    # leaf adds its share of the group mean to its whole box through a
+    # difference array that is summed up at the end.
+    feature, threshold, left, right, value = (np.asarray(fused[key]) for key in ('feature', 'threshold', 'left', 'right', 'value'))
+    n_trees = len(fused['root'])
+    n_groups = len(fused['ovens']) * len(TARGETS)
+    tree_group = np.asarray(fused['tree_group'])
+    weight = 1.0 / np.bincount(tree_group, minlength=n_groups)[tree_group]
+
+    node = np.asarray(fused['root']).copy()
+    tree = np.arange(n_trees)
+    low = np.zeros((n_trees, len(FEATURES)), dtype=np.int64)
+    high = np.tile(FEATURE_SIZES, (n_trees, 1))
+    leaves = []
+    while len(node):
+        split = feature[node]
+        is_leaf = split < 0
+        leaves.append((tree[is_leaf], low[is_leaf], high[is_leaf], value[node[is_leaf]]))
+        node, tree, low, high, split = (a[~is_leaf] for a in (node, tree, low, high, split))
+        rows = np.arange(len(node))
+        # Features are integers, so x <= threshold means x < floor(threshold) + 1
+        cut = np.clip(np.floor(threshold[node]).astype(np.int64) + 1, low[rows, split], high[rows, split])
+        left_high = high.copy()
+        left_high[rows, split] = cut
+        right_low = low.copy()
+        right_low[rows, split] = cut
+        go_left = cut > low[rows, split]
+        go_right = cut < high[rows, split]
+        node = np.concatenate([left[node][go_left], right[node][go_right]])
+        tree = np.concatenate([tree[go_left], tree[go_right]])
+        low = np.concatenate([low[go_left], right_low[go_right]])
+        high = np.concatenate([left_high[go_left], high[go_right]])
+
+    tree, low, high, leaf_value = (np.concatenate(parts) for parts in zip(*leaves))
+    leaf_value = leaf_value * weight[tree]
+    group = tree_group[tree]
+    diff = np.zeros((n_groups,) + tuple(FEATURE_SIZES + 1))
+    for corner in range(2 ** len(FEATURES)):
+        upper = [(corner >> axis) & 1 for axis in range(len(FEATURES))]
+        index = [np.where(is_upper, high[:, axis], low[:, axis]) for axis, is_upper in enumerate(upper)]
+        np.add.at(diff, (group, *index), leaf_value * (-1) ** sum(upper))
+    for axis in range(1, len(FEATURES) + 1):
+        diff = diff.cumsum(axis)
+
+    # [group, hour, minute, day_of_week] -> [oven, target, day_of_week, hour, minute]
+    predictions = diff[:, :24, :60, :7].transpose(0, 3, 1, 2).astype(np.float32)
+    predictions = predictions.reshape(-1, len(TARGETS), 7, 24, 60)
+    return np.ascontiguousarray(predictions[:, 0]), np.ascontiguousarray(predictions[:, 1])
+
+
+def build_neighbor_tables(oven_data_dict, ovens):
+    # The NEIGHBORS training rows closest (euclidean, on the raw features) to
+    # every possible input, found with one KD-tree per oven at training time
+    # so that serving an explanation is an index.
+    #   neighbor_table      int32 [oven, day_of_week, hour, minute, k], row
+    #                       numbers into the arrays below, nearest first, -1
+    #                       where an oven has fewer rows
+    #   neighbor_X          the training rows of all ovens, in `ovens` order
+    #   neighbor_time       their time to the next finish (minutes)
+    #   neighbor_leftovers  their leftovers
+    from sklearn.neighbors import KDTree
+
+    by_oven = {int(oven): data for oven, data in oven_data_dict.items()}
+    grid = np.stack(np.meshgrid(np.arange(24), np.arange(60), np.arange(7), indexing='ij'), axis=-1)
+    grid = grid.transpose(2, 0, 1, 3).reshape(-1, len(FEATURES))  # [day_of_week, hour, minute] order
+    table = np.full((len(ovens), len(grid), NEIGHBORS), -1, dtype=np.int32)
+    X, y_time, y_leftovers = [], [], []
+    offset = 0
+    for oven_index, oven in enumerate(ovens):
+        data = by_oven.get(oven)
+        if data is None or not len(data['X']):
+            continue
+        k = min(NEIGHBORS, len(data['X']))
+        _, rows = KDTree(np.asarray(data['X'], dtype=np.float64)).query(grid, k=k)
+        table[oven_index, :, :k] = rows + offset
+        X.append(np.asarray(data['X'], dtype=np.int64))
+        y_time.append(np.asarray(data['y_time'], dtype=np.float64))
+        y_leftovers.append(np.asarray(data['y_leftovers'], dtype=np.float64))
+        offset += len(data['X'])
+    return {
+        'neighbor_table': table.reshape(len(ovens), 7, 24, 60, NEIGHBORS),
+        'neighbor_X': np.concatenate(X) if X else np.zeros((0, len(FEATURES)), dtype=np.int64),
+        'neighbor_time': np.concatenate(y_time) if y_time else np.zeros(0),
+        'neighbor_leftovers': np.concatenate(y_leftovers) if y_leftovers else np.zeros(0),
+    }
+
+
+def similar_sessions(neighbors, oven_index, hour, minute, day_of_week):
+    # The training rows most similar to one input for one oven, nearest first:
+    # (X, time to next finish, leftovers, distance)
+    rows = np.asarray(neighbors['neighbor_table'][oven_index, day_of_week, hour, minute])
+    rows = rows[rows >= 0]
+    X = np.asarray(neighbors['neighbor_X'][rows])
+    distance = np.sqrt(((X - [hour, minute, day_of_week]) ** 2).sum(axis=1))
+    return X, np.asarray(neighbors['neighbor_time'][rows]), np.asarray(neighbors['neighbor_leftovers'][rows]), distance
+
+
+def save_artifact(root, fused, oven_data_dict=None, metadata=None, tables=None):
+    # tables: (time_table, leftovers_table) if the caller already has them
+    time_table, leftovers_table = tables if tables is not None else build_prediction_tables(fused)
+    arrays = {name: value for name, value in fused.items() if isinstance(value, np.ndarray)}
+    arrays['time_table'] = time_table
+    arrays['leftovers_table'] = leftovers_table
+    arrays['feature_importance'] = feature_importances(fused)
+    if oven_data_dict is not None:
+        arrays.update(build_neighbor_tables(oven_data_dict, fused['ovens']))
+
+    digest = hashlib.sha256()
+    for name in sorted(arrays):
+        digest.update(name.encode('utf-8'))
+        digest.update(arrays[name].tobytes())
+    version = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}-{digest.hexdigest()[:8]}"
+
+    path = os.path.join(root, version)
+    os.makedirs(path)
+    index = {}
+    for name, value in arrays.items():
+        np.save(os.path.join(path, f'{name}.npy'), value)
+        index[name] = {'file': f'{name}.npy', 'dtype': str(value.dtype), 'shape': list(value.shape)}
+    if oven_data_dict is not None:
+        training = {}
+        for oven, data in oven_data_dict.items():
+            for key, value in data.items():
+                training[f'{int(oven)}/{key}'] = value
+        np.savez_compressed(os.path.join(path, 'training.npz'), **training)
+
+    manifest = {
+        'format': ARTIFACT_FORMAT,
+        'version': version,
+        'created': datetime.now(timezone.utc).isoformat(),
+        'ovens': fused['ovens'],
+        'features': FEATURES,
+        'targets': TARGETS,
+        'arrays': index,
+        'training': 'training.npz' if oven_data_dict is not None else None,
+    }
+    manifest.update(metadata or {})
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    publish_version(root, version)
+    return version
+
+
+def publish_version(root, version):
+    # Point CURRENT at the new version with an atomic rename
+    tmp = os.path.join(root, f'.CURRENT.{os.getpid()}')
+    with open(tmp, 'w') as f:
+        f.write(version + '\n')
+    os.replace(tmp, os.path.join(root, 'CURRENT'))
+
+
+def current_version(root):
+    with open(os.path.join(root, 'CURRENT')) as f:
+        return f.read().strip()
+
+
+class ModelArtifact:
+    def __init__(self, root, version=None):
+        self.version = version or current_version(root)
+        self.path = os.path.join(root, self.version)
+        with open(os.path.join(self.path, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        if self.manifest['format'] != ARTIFACT_FORMAT:
+            raise ValueError(f"Unsupported model artifact format {self.manifest['format']}")
+
+        arrays = {
+            name: np.load(os.path.join(self.path, entry['file']), mmap_mode='r')
+            for name, entry in self.manifest['arrays'].items()
+        }
+        # Without lookup tables the backend evaluates the fused trees instead
+        self.time_table = arrays.pop('time_table', None)
+        self.leftovers_table = arrays.pop('leftovers_table', None)
+        # Artifacts from before explanations were stored have neither of these
+        self.feature_importance = arrays.pop('feature_importance', None)
+        if all(name in arrays for name in NEIGHBOR_ARRAYS):
+            self.neighbors = {name: arrays.pop(name) for name in NEIGHBOR_ARRAYS}
+        else:
+            self.neighbors = None
+        self.fused = dict(arrays, ovens=self.manifest['ovens'])
+        self._training = None
+
+    @property
+    def training(self):
+        # Training arrays per oven, {oven: {'X': ..., 'y_time': ..., 'y_leftovers': ...}}
+        if self._training is None:
+            training = {}
+            if self.manifest.get('training'):
+                with np.load(os.path.join(self.path, self.manifest['training'])) as data:
+                    for key in data.files:
+                        oven, name = key.split('/')
+                        training.setdefault(int(oven), {})[name] = data[key]
+            self._training = training
+        return self._training
+
+
+if __name__ == '__main__':
+    # Usage: python chicken_model.py convert <chicken_models.pkl> <artifact root>
+    if len(sys.argv) == 4 and sys.argv[1] == 'convert':
+        import pickle
+        with open(sys.argv[2], 'rb') as f:
+            saved_data = pickle.load(f)
+        fused = saved_data.get('fused') or fuse_models(saved_data['models'])
+        version = save_artifact(sys.argv[3], fused, saved_data.get('oven_data_dict'),
+                                {'source': os.path.basename(sys.argv[2])})
+        print(f"Wrote model version {version} to '{sys.argv[3]}'")
+    else:
+        print("Usage: python chicken_model.py convert <chicken_models.pkl> <artifact root>")
@@ -0,0 +1,196 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from chicken_model import VERSION_PATTERN, ModelArtifact, current_version, publish_version, predict_fused
+
+# Holds the model a worker serves and swaps in new versions without a restart.
+# A watcher thread polls <root>/CURRENT; when it names a new version the
+# artifact is loaded and warmed, the prepare(model) hook rebuilds whatever is
+# derived from it, and only then does `current` switch over. prepare() also
+# runs for the model loaded at startup. Requests read
+# `current` once and keep using that model even if a swap happens mid-request.
+# A store pinned to a version never follows CURRENT.
+MODEL_POLL_INTERVAL = 10  # seconds
+# Memory for the models a ModelCache keeps loaded, counted as the bytes of the
+# arrays they map
+MODEL_CACHE_BYTES = 256 * 1024 * 1024
+
+
+class ModelStore:
+    def __init__(self, root, prepare=None, interval=MODEL_POLL_INTERVAL, logger=None, pinned=None):
+        self.root = root
+        self.prepare = prepare
+        self.interval = interval
+        self.logger = logger
+        self.pinned = pinned
+        self.reload_lock = threading.Lock()
+        self.current = warm(ModelArtifact(root, pinned))
+        if self.prepare:
+            self.prepare(self.current)
+        self.watching = False
+        self.wake = threading.Event()
+
+    def after_fork(self):
+        self.reload_lock = threading.Lock()
+        self.wake = threading.Event()
+        if self.watching:
+            self.start()
+
+    def start(self):
+        def run():
+            while True:
+                self.wake.wait(self.interval)
+                self.wake.clear()
+                try:
+                    self.reload()
+                except Exception as e:
+                    # Keep serving the current model and try again next poll
+                    if self.logger:
+                        self.logger.error(f"Model reload failed: {str(e)}")
+
+        if not self.watching:
+            # Like SharedState, the watcher thread does not survive gunicorn's fork
+            os.register_at_fork(after_in_child=self.after_fork)
+        self.watching = True
+        threading.Thread(target=run, name='model-watch', daemon=True).start()
+
+    def check_now(self):
+        # Have the watcher check CURRENT without waiting for the next poll
+        self.wake.set()
+
+    def reload(self, version=None):
+        # Switch to `version` (published as CURRENT for the other workers to
+        # follow) or to whatever CURRENT names. Returns True if a swap happened.
+        with self.reload_lock:
+            if self.pinned is not None:
+                if version is not None and version != self.pinned:
+                    raise ValueError(f"Pinned to model version {self.pinned} by the store registry")
+                return False
+            if version is not None and not (isinstance(version, str) and VERSION_PATTERN.fullmatch(version)):
+                raise ValueError(f"Invalid model version {version!r}")
+            if version is not None and version != current_version(self.root):
+                if not os.path.isdir(os.path.join(self.root, version)):
+                    raise ValueError(f"Unknown model version {version}")
+                publish_version(self.root, version)
+            version = current_version(self.root)
+            if version == self.current.version:
+                return False
+
+            model = warm(ModelArtifact(self.root, version))
+            if self.prepare:
+                self.prepare(model)
+            previous, self.current = self.current, model
+            if self.logger:
+                self.logger.info(f"Swapped model {previous.version} for {model.version}")
+            return True
+
+
+class ModelCache:
+    # The ModelStores of the stores this worker has served lately, least
+    # recently used first. A store's models are loaded by load(key) on its
+    # first request and dropped again once everything loaded maps more than
+    # max_bytes, so a worker only holds the models its own traffic needs. One
+    # watcher thread polls CURRENT for every loaded store instead of one
+    # thread per store.
+    def __init__(self, load, max_bytes=MODEL_CACHE_BYTES, interval=MODEL_POLL_INTERVAL, logger=None):
+        self.load = load
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.logger = logger
+        self.entries = OrderedDict()
+        self.loading = {}  # key: lock held while that key loads
+        self.lock = threading.Lock()
+        self.watching = False
+        self.wake = threading.Event()
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def after_fork(self):
+        self.lock = threading.Lock()
+        self.loading = {}
+        self.wake = threading.Event()
+        for store in self.entries.values():
+            store.reload_lock = threading.Lock()
+        if self.watching:
+            self.start()
+
+    def get(self, key):
+        with self.lock:
+            store = self.entries.get(key)
+            if store is not None:
+                self.entries.move_to_end(key)
+                return store
+            key_lock = self.loading.setdefault(key, threading.Lock())
+
+        # Single flight per key: the first request loads, others for the same
+        # key wait for it, and hits on other keys are not held up
+        with key_lock:
+            with self.lock:
+                store = self.entries.get(key)
+                if store is not None:
+                    self.entries.move_to_end(key)
+                    return store
+            store = self.load(key)
+            with self.lock:
+                self.entries[key] = store
+                self.loading.pop(key, None)
+                self.evict()
+        return store
+
+    def evict(self):
+        # Drop least recently used stores until the rest fit; the newest always
+        # stays. Requests still holding an evicted model finish with it, and its
+        # mappings are closed once the last of them lets go.
+        sizes = {key: model_bytes(store.current) for key, store in self.entries.items()}
+        total = sum(sizes.values())
+        while total > self.max_bytes and len(self.entries) > 1:
+            key, _ = self.entries.popitem(last=False)
+            total -= sizes[key]
+            if self.logger:
+                self.logger.info(f"Evicted models for {key} ({sizes[key]} bytes)")
+
+    def memory(self):
+        with self.lock:
+            return sum(model_bytes(store.current) for store in self.entries.values())
+
+    def start(self):
+        def run():
+            while True:
+                self.wake.wait(self.interval)
+                self.wake.clear()
+                with self.lock:
+                    stores = list(self.entries.items())
+                for key, store in stores:
+                    try:
+                        store.reload()
+                    except Exception as e:
+                        # Keep serving the current model and try again next poll
+                        if self.logger:
+                            self.logger.error(f"Model reload failed for {key}: {str(e)}")
+                # A new version can be bigger than the one it replaced
+                with self.lock:
+                    self.evict()
+
+        self.watching = True
+        threading.Thread(target=run, name='model-cache-watch', daemon=True).start()
+
+    def check_now(self):
+        # Have the watcher check every loaded store without waiting for the next poll
+        self.wake.set()
+
+
+def model_bytes(model):
+    # Everything a model maps, which is as much as serving it can pull into memory
+    arrays = [model.time_table, model.leftovers_table, model.feature_importance]
+    arrays += list(model.fused.values()) + list((model.neighbors or {}).values())
+    return sum(array.nbytes for array in arrays if isinstance(array, np.ndarray))
+
+
+def warm(model):
+    # Fault the mapped pages in and run the trees once so the first request
+    # after the swap does not pay for it
+    for array in list(model.fused.values()) + [model.time_table, model.leftovers_table]:
+        if isinstance(array, np.ndarray):
+            np.asarray(array).sum()
+    predict_fused(model.fused, np.zeros((1, 3)))
+    return model
@@ -0,0 +1,101 @@
+import os
+import pickle
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Prediction state shared by every gunicorn worker on the host, kept in a small
+# SQLite database. Each process caches the last copy it read and only goes back
+# to the table when PRAGMA data_version says another connection has committed.
+# Every row carries the version of the commit that last wrote it, so going back
+# reads (and unpickles) only the keys that changed since.
+
+
+class SharedState:
+    def __init__(self, path):
+        self.path = path
+        self.watchers = []
+        self.connect()
+        # gunicorn forks its workers after the app module is imported; each
+        # worker needs its own connection and its own watcher threads
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def connect(self):
+        self.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value BLOB, version INTEGER NOT NULL DEFAULT 0)')
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(state)')]
+        if 'version' not in columns:
+            # Written before rows were versioned
+            self.conn.execute('ALTER TABLE state ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS state_version ON state (version)')
+        self.lock = threading.RLock()
+        self.cache = {}
+        self.data_version = None
+        self.version = -1  # Highest row version in self.cache
+
+    def after_fork(self):
+        self.connect()
+        watchers = self.watchers
+        self.watchers = []
+        for key, callback, interval, _ in watchers:
+            self.watch(key, callback, interval)
+
+    def refresh(self):
+        version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        if version != self.data_version:
+            rows = self.conn.execute('SELECT key, value, version FROM state WHERE version > ?', (self.version,)).fetchall()
+            for key, value, row_version in rows:
+                self.cache[key] = pickle.loads(value)
+                self.version = max(self.version, row_version)
+            self.data_version = version
+
+    def snapshot(self):
+        with self.lock:
+            self.refresh()
+            return dict(self.cache)
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the database write lock, so the block runs on
+        # the latest state and no other worker can write until it commits
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.refresh()
+                state = dict(self.cache)
+                yield state
+                # Holding the write lock, the cache has seen every row version
+                version = self.version + 1
+                changed = [key for key, value in state.items() if key not in self.cache or self.cache[key] is not value]
+                for key in changed:
+                    self.conn.execute(
+                        'INSERT OR REPLACE INTO state (key, value, version) VALUES (?, ?, ?)',
+                        (key, pickle.dumps(state[key]), version)
+                    )
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.cache = state
+            if changed:
+                self.version = version
+
+    def watch(self, key, callback, interval=0.5):
+        # Call callback(value) whenever key changes, whichever worker changed it
+        def run():
+            last = self.snapshot().get(key)
+            while True:
+                stop.wait(interval)
+                if stop.is_set():
+                    return
+                value = self.snapshot().get(key)
+                if value != last:
+                    last = value
+                    callback(value)
+
+        stop = threading.Event()
+        thread = threading.Thread(target=run, name=f'watch-{key}', daemon=True)
+        thread.start()
+        self.watchers.append((key, callback, interval, stop))
+        return stop
@@ -0,0 +1,125 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qs
+from asgiref.sync import SyncToAsync
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+# Server-sent events without a thread per connection. Every /events subscriber
+# is an asyncio queue on the worker's event loop; publish() can be called from
+# any thread and fans the message out to all of them in one loop callback.
+# With channel(query), each subscriber only gets the messages published to the
+# channel its query string picks.
+HEARTBEAT_INTERVAL = 15  # seconds between keep-alive comments
+SUBSCRIBER_QUEUE_SIZE = 5
+WSGI_THREADS = 4  # Flask requests in flight per worker, as gunicorn's gthread workers had
+
+
+class BroadcastHub:
+    def __init__(self, heartbeat=HEARTBEAT_INTERVAL, queue_size=SUBSCRIBER_QUEUE_SIZE, channel=None):
+        self.heartbeat = heartbeat
+        self.queue_size = queue_size
+        self.channel = channel
+        self.subscribers = {}  # channel: set of queues
+        self.loop = None
+
+    def count(self, channel=None):
+        return len(self.subscribers.get(channel, ()))
+
+    def publish(self, message, channel=None):
+        if self.loop is None:
+            return  # Nobody has subscribed yet
+        self.loop.call_soon_threadsafe(self.fan_out, message, channel)
+
+    def fan_out(self, message, channel):
+        for queue in self.subscribers.get(channel, ()):
+            if queue.full():
+                # Backpressure: a slow client drops its oldest message rather
+                # than holding up everyone else
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    async def serve(self, scope, receive, send):
+        self.loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        channel = self.channel(parse_qs(scope.get('query_string', b'').decode('latin-1'))) if self.channel else None
+        self.subscribers.setdefault(channel, set()).add(queue)
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream'),
+                    (b'cache-control', b'no-cache'),
+                    (b'connection', b'keep-alive'),
+                    (b'x-accel-buffering', b'no'),
+                ],
+            })
+            disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+            while not disconnected.done():
+                message = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({message, disconnected}, timeout=self.heartbeat,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if message in done:
+                    body = f"data: {message.result()}\n\n"
+                else:
+                    message.cancel()
+                    if disconnected in done:
+                        break
+                    body = ": heartbeat\n\n"
+                await send({'type': 'http.response.body', 'body': body.encode('utf-8'), 'more_body': True})
+        except OSError:
+            pass  # Client went away mid-write
+        finally:
+            subscribers = self.subscribers.get(channel, set())
+            subscribers.discard(queue)
+            if not subscribers:
+                self.subscribers.pop(channel, None)
+            if 'disconnected' in locals():
+                disconnected.cancel()
+
+
+async def wait_for_disconnect(receive):
+    while True:
+        event = await receive()
+        if event['type'] == 'http.disconnect':
+            return
+
+
+class ThreadPoolWsgiToAsgi(WsgiToAsgi):
+    # WsgiToAsgi calls the app through sync_to_async with thread_sensitive=True,
+    # which runs every request of the process one at a time on a single thread.
+    # This runs each request on a thread of its own pool instead, so a view
+    # waiting on the SQLite write lock only holds up its own thread.
+    def __init__(self, wsgi_application, threads=WSGI_THREADS):
+        super().__init__(wsgi_application)
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        instance = WsgiToAsgiInstance(self.wsgi_application)
+        instance.run_wsgi_app = SyncToAsync(partial(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, instance),
+                                            thread_sensitive=False, executor=self.executor)
+        await instance(scope, receive, send)
+
+
+def make_asgi_app(flask_app, hub, events_path='/events', threads=WSGI_THREADS):
+    # /events is served by the hub on the event loop; everything else goes to
+    # the Flask app, up to `threads` requests at a time
+    wsgi_app = ThreadPoolWsgiToAsgi(flask_app, threads)
+
+    async def app(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == events_path:
+            await hub.serve(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            while True:
+                event = await receive()
+                if event['type'] == 'lifespan.startup':
+                    hub.loop = asyncio.get_running_loop()
+                    await send({'type': 'lifespan.startup.complete'})
+                elif event['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        else:
+            await wsgi_app(scope, receive, send)
+
+    return app
@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta, time
+import pytz
+
+# Store opening hours, used by the backend and by anything else that needs to
+# know when the ovens run (synthetic.py generates events inside these hours).
+# Each store in the registry (stores.py) has its own StoreHours; the module
+# functions are the default store's: 8 AM to 8 PM, 10 AM to 6 PM on Sundays,
+# Eastern time.
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+# Weekday name, or 'default' for the days not named: (opening, closing) as 'HH:MM'
+DEFAULT_HOURS = {'default': ('08:00', '20:00'), 'sunday': ('10:00', '18:00')}
+LAST_BATCH_MINUTES = 60  # No batches in last hour
+
+
+class StoreHours:
+    def __init__(self, timezone='US/Eastern', hours=DEFAULT_HOURS, last_batch_minutes=LAST_BATCH_MINUTES):
+        self.timezone = pytz.timezone(timezone)
+        self.week = []
+        for day in WEEKDAYS:
+            if day not in hours and 'default' not in hours:
+                raise ValueError(f"No opening hours for {day}")
+            opening, closing = (time.fromisoformat(t) for t in hours.get(day, hours.get('default')))
+            if closing <= opening:
+                raise ValueError(f"Closing time {closing} is not after opening time {opening} on {day}")
+            self.week.append((opening, closing))
+        self.last_batch = timedelta(minutes=last_batch_minutes)
+
+    def opening_time(self, date):
+        return self.timezone.localize(datetime.combine(date, self.week[date.weekday()][0]))
+
+    def closing_time(self, date):
+        return self.timezone.localize(datetime.combine(date, self.week[date.weekday()][1]))
+
+    def last_batch_time(self, date):
+        return self.closing_time(date) - self.last_batch
+
+
+default_hours = StoreHours()
+eastern = default_hours.timezone
+
+def get_opening_time(date):
+    return default_hours.opening_time(date)
+
+def get_closing_time(date):
+    return default_hours.closing_time(date)
+
+def get_last_batch_time(date):
+    return default_hours.last_batch_time(date)
@@ -0,0 +1,73 @@
+import json
+import os
+import re
+from store_hours import StoreHours, DEFAULT_HOURS, LAST_BATCH_MINUTES
+
+# The stores one deployment serves, read from a JSON registry keyed by store ID:
+#
+#   {"default": "main",
+#    "stores": {
+#      "main":  {"name": "Main St", "ovens": 4},
+#      "store-002": {"name": "Harbor", "timezone": "US/Pacific", "ovens": 6,
+#                    "hours": {"default": ["07:00", "21:00"], "sunday": ["09:00", "17:00"]},
+#                    "models": "models/store-002", "model_version": "20261018T131152Z-5480a8a9"}}}
+#
+# Every field but the ID is optional. "models" is the store's artifact root
+# (CURRENT and the versions train.py publishes), relative to the registry
+# file; it defaults to models/<store ID>, or to MODEL_DIR for the default
+# store. "model_version" pins the store to one version instead of following
+# CURRENT. Without a registry file the deployment serves the one store it
+# always has.
+DEFAULT_STORE = 'main'
+DEFAULT_OVENS = 4
+STORE_ID = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+class Store:
+    def __init__(self, store_id, models, name=None, timezone='US/Eastern', hours=DEFAULT_HOURS,
+                 last_batch_minutes=LAST_BATCH_MINUTES, ovens=DEFAULT_OVENS, model_version=None):
+        if not STORE_ID.match(store_id):
+            raise ValueError(f"Invalid store ID {store_id!r}: use letters, digits, '-' and '_'")
+        if ovens < 1:
+            raise ValueError(f"Store {store_id} needs at least one oven")
+        self.id = store_id
+        self.name = name or store_id
+        self.models = models
+        self.model_version = model_version
+        self.ovens = ovens
+        self.hours = StoreHours(timezone, hours, last_batch_minutes)
+        self.timezone = self.hours.timezone
+
+
+class StoreRegistry:
+    def __init__(self, stores, default):
+        if default not in stores:
+            raise ValueError(f"Default store {default} is not in the registry")
+        self.stores = stores
+        self.default = default
+
+    def get(self, store_id=None):
+        # The store with this ID (the default store for None), or None if unknown
+        return self.stores.get(self.default if store_id is None else store_id)
+
+
+def load_registry(path, model_dir):
+    if not os.path.exists(path):
+        return StoreRegistry({DEFAULT_STORE: Store(DEFAULT_STORE, model_dir)}, DEFAULT_STORE)
+
+    with open(path) as f:
+        config = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    default = config.get('default', DEFAULT_STORE)
+    stores = {}
+    for store_id, entry in config['stores'].items():
+        entry = dict(entry)
+        if 'models' in entry:
+            models = os.path.join(base, entry.pop('models'))
+        else:
+            models = model_dir if store_id == default else os.path.join(base, 'models', store_id)
+        try:
+            stores[store_id] = Store(store_id, models, **entry)
+        except TypeError as e:
+            raise ValueError(f"Bad registry entry for store {store_id}: {e}") from None
+    return StoreRegistry(stores, default)
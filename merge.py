@@ -1,31 +1,200 @@
+import argparse
+import gzip
+import heapq
+import io
 import json
-from datetime import datetime
+import os
+import sys
+import tempfile
+import zipfile
+from datetime import datetime, timedelta, timezone
 
-def merge_chicken_data(file1, file2):
-    # Read data from both files
-    with open(file1, 'r') as f1, open(file2, 'r') as f2:
-        data1 = json.load(f1)
-        data2 = json.load(f2)
+# Merges any number of event exports into one file sorted by time, without
+# holding them in memory. Sources can be .json (a top-level array), .jsonl,
+# either of those gzipped, or .zip archives of them. Each source is parsed
+# incrementally and cut into sorted runs of RUN_SIZE events that are spilled
+# to temporary files; the runs are then streamed through a k-way merge and
+# written out, so memory stays at about RUN_SIZE events however big the
+# inputs are. Events count as duplicates when they have the same oven, action
+# and timestamp; the first one seen, in the order the sources are given, wins.
+RUN_SIZE = 100_000
+# Runs merged at once; more than this are first merged into bigger runs so
+# the number of open files stays bounded
+MERGE_FAN_IN = 64
+READ_SIZE = 1 << 16
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
 
-    # Combine the data
-    merged_data = data1 + data2
 
-    # Sort the merged data by timestamp
-    merged_data.sort(key=lambda x: datetime.fromisoformat(x['timestamp'].replace('Z', '+00:00')))
+def iter_json_array(stream):
+    # Yields the items of the top-level JSON array in a text stream one at a
+    # time, decoding each out of a buffer that is refilled as needed
+    decoder = json.JSONDecoder()
+    buffer, position, eof = '', 0, False
+    expecting = '['
+    while True:
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+        if position == len(buffer):
+            if eof:
+                raise ValueError("Unexpected end of JSON array")
+            chunk = stream.read(READ_SIZE)
+            buffer, position, eof = chunk, 0, not chunk
+            continue
 
-    # Remove duplicates based on timestamp
-    seen = set()
-    unique_data = []
-    for item in merged_data:
-        if item['timestamp'] not in seen:
-            seen.add(item['timestamp'])
-            unique_data.append(item)
+        char = buffer[position]
+        if expecting == '[':
+            if char != '[':
+                raise ValueError("Expected a JSON array of events")
+            position += 1
+            expecting = 'item or ]'
+        elif char == ']' and expecting != 'item':
+            return
+        elif expecting == ',':
+            if char != ',':
+                raise ValueError(f"Expected ',' between array items, found {char!r}")
+            position += 1
+            expecting = 'item'
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+                # A number that ends with the buffer may go on in the next chunk
+                complete = end < len(buffer) or eof
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+            if not complete:
+                chunk = stream.read(READ_SIZE)
+                buffer, position, eof = buffer[position:] + chunk, 0, not chunk
+                continue
+            yield item
+            position = end
+            expecting = ','
 
-    # Write the merged and sorted data to a new file
-    with open('merged_chicken_data.json', 'w') as outfile:
-        json.dump(unique_data, outfile, indent=2)
 
-    print("Merged data has been written to 'merged_chicken_data.json'")
+def read_events(name, open_binary, skipped):
+    # The name decides the format; open_binary() opens the raw bytes.
+    # Members and files in other formats are listed in skipped.
+    lower = name.lower()
+    if lower.endswith('.zip'):
+        with open_binary() as raw, zipfile.ZipFile(raw) as archive:
+            for member in archive.infolist():
+                if not member.is_dir():
+                    yield from read_events(f'{name}/{member.filename}', lambda member=member: archive.open(member), skipped)
+    elif lower.endswith('.gz'):
+        with open_binary() as raw:
+            yield from read_events(name[:-3], lambda: gzip.GzipFile(fileobj=raw), skipped)
+    elif lower.endswith(('.jsonl', '.ndjson')):
+        with io.TextIOWrapper(open_binary(), encoding='utf-8') as stream:
+            for line in stream:
+                if line.strip():
+                    yield json.loads(line)
+    elif lower.endswith('.json'):
+        with io.TextIOWrapper(open_binary(), encoding='utf-8') as stream:
+            yield from iter_json_array(stream)
+    else:
+        skipped.append(name)
 
-# Call the function with the two input files
-merge_chicken_data('chicken_dataog.json', 'chicken_data(1).json')
+
+def event_key(event):
+    # (microseconds since the epoch, oven, action), or None if the event has
+    # no usable timestamp. Naive timestamps are taken as UTC, as clean.py does.
+    try:
+        timestamp = datetime.fromisoformat(event['timestamp'].replace('Z', '+00:00'))
+    except (KeyError, TypeError, AttributeError, ValueError):
+        return None
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return [(timestamp - EPOCH) // timedelta(microseconds=1), str(event.get('oven')), str(event.get('action'))]
+
+
+def write_run(items, tmp_dir):
+    # items are [key, event] pairs, already in order
+    fd, path = tempfile.mkstemp(suffix='.jsonl', dir=tmp_dir)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        for item in items:
+            f.write(json.dumps(item))
+            f.write('\n')
+    return path
+
+def read_run(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+def merge_runs(paths):
+    # Stable: on equal keys, earlier runs come first
+    return heapq.merge(*(read_run(path) for path in paths), key=lambda item: item[0])
+
+
+def merge_chicken_data(sources, output='merged_chicken_data.json', run_size=RUN_SIZE, tmp_dir=None):
+    stats = {'read': 0, 'written': 0, 'duplicates': 0, 'no_timestamp': 0, 'runs': 0, 'skipped_files': []}
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as run_dir:
+        # Cut every source into sorted runs
+        runs = []
+        for source in sources:
+            buffer = []
+            for event in read_events(source, lambda source=source: open(source, 'rb'), stats['skipped_files']):
+                stats['read'] += 1
+                key = event_key(event) if isinstance(event, dict) else None
+                if key is None:
+                    stats['no_timestamp'] += 1
+                    continue
+                buffer.append([key, event])
+                if len(buffer) == run_size:
+                    buffer.sort(key=lambda item: item[0])
+                    runs.append(write_run(buffer, run_dir))
+                    buffer = []
+            if buffer:
+                buffer.sort(key=lambda item: item[0])
+                runs.append(write_run(buffer, run_dir))
+        stats['runs'] = len(runs)
+
+        while len(runs) > MERGE_FAN_IN:
+            merged = write_run(merge_runs(runs[:MERGE_FAN_IN]), run_dir)
+            for path in runs[:MERGE_FAN_IN]:
+                os.remove(path)
+            runs = [merged] + runs[MERGE_FAN_IN:]
+
+        # Merge, drop duplicates (they are next to each other) and stream out.
+        # Written next to the output and renamed over it, so the output can
+        # also be one of the sources.
+        tmp_output = f'{output}.tmp{os.getpid()}'
+        with open(tmp_output, 'w', encoding='utf-8') as f:
+            jsonl = output.lower().endswith('.jsonl')
+            if not jsonl:
+                f.write('[')
+            last_key = None
+            for key, event in merge_runs(runs):
+                if key == last_key:
+                    stats['duplicates'] += 1
+                    continue
+                last_key = key
+                if jsonl:
+                    f.write(json.dumps(event))
+                    f.write('\n')
+                else:
+                    # Same layout as json.dump(events, f, indent=2)
+                    f.write(',\n  ' if stats['written'] else '\n  ')
+                    f.write(json.dumps(event, indent=2).replace('\n', '\n  '))
+                stats['written'] += 1
+            if not jsonl:
+                f.write('\n]' if stats['written'] else ']')
+        os.replace(tmp_output, output)
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Merge event exports into one file sorted by time, without duplicates.")
+    parser.add_argument('sources', nargs='*', default=['chicken_dataog.json', 'chicken_data(1).json'],
+                        help=".json, .jsonl, .gz or .zip files; earlier sources win on duplicates")
+    parser.add_argument('-o', '--output', default='merged_chicken_data.json', help="a .json array or .jsonl file")
+    parser.add_argument('--run-size', type=int, default=RUN_SIZE, help="events sorted in memory at a time")
+    args = parser.parse_args()
+
+    stats = merge_chicken_data(args.sources, args.output, args.run_size)
+    for name in stats['skipped_files']:
+        print(f"Skipped '{name}': not a .json, .jsonl, .gz or .zip file", file=sys.stderr)
+    print(f"Read {stats['read']} events from {len(args.sources)} sources in {stats['runs']} sorted runs")
+    print(f"Dropped {stats['duplicates']} duplicates and {stats['no_timestamp']} events without a timestamp")
+    print(f"Merged data has been written to '{args.output}' ({stats['written']} events)")
@@ -0,0 +1,310 @@
+import hashlib
+import inspect
+import io
+import json
+import os
+import pickle
+import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+from time import perf_counter
+import pandas as pd
+
+import clean
+import step2
+import step3
+import step4
+import train
+import chicken_model  # on sys.path once train is imported
+from columnar import save_frame, load_frame
+
+# Runs the offline scripts as one DAG: clean -> step2, step3, step4, train.
+# DataFrames are handed from stage to stage in memory. Every stage's outputs
+# are cached under CACHE_DIR, keyed by a hash of its code, its input files
+# and the content of its inputs, so a stage whose key has not changed is
+# skipped. Stages whose inputs are ready run at the same time on a thread pool.
+# Tables are cached and exported in the columnar format (columnar.py).
+#
+#   python pipeline.py                 run everything that is out of date
+#   python pipeline.py step4 train     only these stages (and what they need)
+#   python pipeline.py --force         ignore the cache
+#   python pipeline.py --verbose       print each stage's output when it finishes
+#   python pipeline.py --export        also write the CSV/JSON files of old
+CACHE_DIR = os.environ.get('PIPELINE_CACHE', '.pipeline_cache')
+# Part of every cache key, so entries in an older layout are never read
+CACHE_FORMAT = 2
+PIPELINE_WORKERS = int(os.environ.get('PIPELINE_WORKERS', 0)) or 4
+
+
+class Stage:
+    def __init__(self, name, run, inputs=(), outputs=(), files=(), modules=()):
+        # run(*files, *inputs) returns the outputs, as a tuple if there are several.
+        # modules are the code the stage depends on, besides run itself.
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.files = list(files)
+        self.modules = list(modules)
+
+
+def run_clean(path):
+    return clean.clean_data(clean.load_events(path))
+
+def run_step2(events):
+    return step2.process_events(events)
+
+def run_step3(sessions):
+    return step3.clean_sessions(sessions)
+
+def run_step4(sessions):
+    engineered = step4.engineer_features(sessions)
+    step4.plot_features(engineered)
+    return engineered
+
+def run_train(sessions):
+    _, _, model_version = train.train_and_publish(train.prepare_sessions(sessions))
+    return model_version
+
+
+STAGES = [
+    Stage('clean', run_clean, files=['merged_chicken_data.json'], outputs=['events', 'sessions'], modules=[clean]),
+    Stage('step2', run_step2, inputs=['events'], outputs=['processed_events'], modules=[step2]),
+    Stage('step3', run_step3, inputs=['sessions'], outputs=['cleaned_sessions', 'flagged_sessions'], modules=[step3]),
+    Stage('step4', run_step4, inputs=['sessions'], outputs=['engineered_sessions'], modules=[step4]),
+    Stage('train', run_train, inputs=['sessions'], outputs=['model_version'], modules=[train, chicken_model]),
+]
+
+# Tables are also saved where the standalone scripts save them, as
+# <name>.cols, and with --export as the text files the scripts used to write
+EXPORTS = {
+    'events': ('cleaned_chicken_data', lambda df, name: df.to_json(f'{name}.json', date_format='iso')),
+    'sessions': ('grouped_cooking_sessions', lambda df, name: df.to_csv(f'{name}.csv', index=False)),
+    'processed_events': ('processed_chicken_data', lambda df, name: df.to_json(f'{name}.json', orient='records', date_format='iso')),
+    'cleaned_sessions': ('cleaned_cooking_sessions', lambda df, name: df.to_csv(f'{name}.csv', index=False)),
+    'flagged_sessions': ('cooking_sessions_with_flags', lambda df, name: df.to_csv(f'{name}.csv', index=False)),
+    'engineered_sessions': ('cooking_sessions_engineered', lambda df, name: df.to_csv(f'{name}.csv', index=False)),
+}
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def value_hash(value):
+    digest = hashlib.sha256()
+    if isinstance(value, pd.DataFrame):
+        digest.update(repr([(str(column), str(dtype)) for column, dtype in value.dtypes.items()]).encode('utf-8'))
+        try:
+            digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+        except TypeError:
+            # Columns holding unhashable objects
+            digest.update(pickle.dumps(value))
+    else:
+        digest.update(pickle.dumps(value))
+    return digest.hexdigest()
+
+def stage_key(stage, outputs):
+    code = hashlib.sha256(inspect.getsource(stage.run).encode('utf-8'))
+    for module in stage.modules:
+        with open(inspect.getsourcefile(module), 'rb') as f:
+            code.update(f.read())
+    key = {
+        'format': CACHE_FORMAT,
+        'stage': stage.name,
+        'code': code.hexdigest(),
+        'files': {path: file_hash(path) for path in stage.files},
+        'inputs': {name: outputs[name].digest for name in stage.inputs},
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+class Output:
+    # One stage output: its content hash, and its value, which for a cached
+    # stage is only read from disk once a stage that runs needs it
+    def __init__(self, digest, value=None, path=None):
+        self.digest = digest
+        self.value = value
+        self.path = path
+        self.loaded = path is None
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            if not self.loaded:
+                if self.path.endswith('.cols'):
+                    self.value = load_frame(self.path)
+                else:
+                    with open(self.path, 'rb') as f:
+                        self.value = pickle.load(f)
+                self.loaded = True
+        return self.value
+
+
+class StageLog(io.TextIOBase):
+    # Stands in for sys.stdout while stages run, so the output of stages
+    # running at the same time is collected per stage instead of interleaved
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def start(self):
+        self.local.buffer = io.StringIO()
+
+    def stop(self):
+        text = self.local.buffer.getvalue()
+        self.local.buffer = None
+        return text
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        return (buffer or self.stream).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def run_stage(stage, key, outputs, log, cache_dir, export_text):
+    # Runs on a pool thread: load the inputs, run the stage, then cache and
+    # export what it returned
+    args = list(stage.files)
+    for name in stage.inputs:
+        value = outputs[name].get()
+        # Stages modify the frames they are given, and others may share them
+        args.append(value.copy() if isinstance(value, pd.DataFrame) else value)
+
+    log.start()
+    start = perf_counter()
+    try:
+        result = stage.run(*args)
+    except BaseException:
+        sys.stderr.write(log.stop())
+        raise
+    seconds = perf_counter() - start
+    text = log.stop()
+    values = result if len(stage.outputs) > 1 else (result,)
+
+    entry = os.path.join(cache_dir, stage.name, key)
+    tmp = f'{entry}.tmp{threading.get_ident()}'
+    os.makedirs(tmp)
+    stored = {}
+    for name, value in zip(stage.outputs, values):
+        if isinstance(value, pd.DataFrame):
+            stored[name] = {'digest': value_hash(value), 'file': f'{name}.cols'}
+            save_frame(value, os.path.join(tmp, stored[name]['file']))
+        else:
+            stored[name] = {'digest': value_hash(value), 'file': f'{name}.pkl'}
+            with open(os.path.join(tmp, stored[name]['file']), 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        if name in EXPORTS:
+            export_name, export = EXPORTS[name]
+            save_frame(value, f'{export_name}.cols')
+            if export_text:
+                export(value, export_name)
+    with open(os.path.join(tmp, 'log.txt'), 'w') as f:
+        f.write(text)
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump({
+            'stage': stage.name,
+            'key': key,
+            'outputs': stored,
+            'seconds': seconds,
+            'finished': datetime.now(timezone.utc).isoformat(),
+        }, f, indent=2)
+    shutil.rmtree(entry, ignore_errors=True)
+    os.replace(tmp, entry)
+
+    return {name: Output(stored[name]['digest'], value) for name, value in zip(stage.outputs, values)}, seconds, text
+
+
+def select_stages(stages, targets):
+    # The target stages and every stage they depend on, in their original order
+    if not targets:
+        return list(stages)
+    producers = {output: stage for stage in stages for output in stage.outputs}
+    by_name = {stage.name: stage for stage in stages}
+    unknown = [name for name in targets if name not in by_name]
+    if unknown:
+        raise ValueError(f"Unknown stage(s): {', '.join(unknown)}")
+    needed = set()
+    todo = [by_name[name] for name in targets]
+    while todo:
+        stage = todo.pop()
+        if stage.name not in needed:
+            needed.add(stage.name)
+            todo.extend(producers[name] for name in stage.inputs)
+    return [stage for stage in stages if stage.name in needed]
+
+
+def run_pipeline(stages=STAGES, targets=None, force=False, workers=PIPELINE_WORKERS, cache_dir=CACHE_DIR, verbose=False,
+                 export_text=False):
+    # Returns {stage name: (status, seconds)}, where seconds is how long the
+    # stage took to run, now or when its cached outputs were made
+    pending = select_stages(stages, targets)
+    outputs = {}
+    timings = {}
+    running = {}
+    log = StageLog(sys.stdout)
+    stdout, sys.stdout = sys.stdout, log
+    start = perf_counter()
+    try:
+        with ThreadPoolExecutor(workers) as pool:
+            while pending or running:
+                # Start every stage whose inputs are ready; a cached stage
+                # makes its outputs ready at once, so go round until none is
+                ready = [stage for stage in pending if all(name in outputs for name in stage.inputs)]
+                while ready:
+                    for stage in ready:
+                        pending.remove(stage)
+                        key = stage_key(stage, outputs)
+                        entry = os.path.join(cache_dir, stage.name, key)
+                        if not force and os.path.exists(os.path.join(entry, 'meta.json')):
+                            with open(os.path.join(entry, 'meta.json')) as f:
+                                meta = json.load(f)
+                            for name, output in meta['outputs'].items():
+                                outputs[name] = Output(output['digest'], path=os.path.join(entry, output['file']))
+                            timings[stage.name] = ('cached', meta['seconds'])
+                            stdout.write(f"{stage.name}: up to date ({entry})\n")
+                        else:
+                            stdout.write(f"{stage.name}: running\n")
+                            running[pool.submit(run_stage, stage, key, outputs, log, cache_dir, export_text)] = stage
+                    ready = [stage for stage in pending if all(name in outputs for name in stage.inputs)]
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    stage_outputs, seconds, text = future.result()
+                    outputs.update(stage_outputs)
+                    timings[stage.name] = ('ran', seconds)
+                    if verbose:
+                        stdout.write(f"\n===== {stage.name} =====\n{text}\n")
+                    stdout.write(f"{stage.name}: done in {seconds:.2f}s\n")
+    finally:
+        sys.stdout = stdout
+    wall = perf_counter() - start
+
+    print(f"\n{'Stage':<8} {'Status':<8} {'Seconds':>8}")
+    for stage in stages:
+        if stage.name in timings:
+            status, seconds = timings[stage.name]
+            print(f"{stage.name:<8} {status:<8} {seconds:>8.2f}")
+    ran = sum(seconds for status, seconds in timings.values() if status == 'ran')
+    print(f"Wall time {wall:.2f}s for {ran:.2f}s of stage work")
+    return timings
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    run_pipeline(
+        targets=[arg for arg in args if not arg.startswith('--')],
+        force='--force' in args,
+        verbose='--verbose' in args,
+        export_text='--export' in args,
+    )
@@ -35,7 +35,8 @@ function initializeOvens() {
 }
 
 function loadOvenStates() {
-    fetch('/oven_states')
+    // Revalidate with the server's ETag; an unchanged state comes back as a 304
+    fetch('/oven_states', { cache: 'no-cache' })
         .then(response => response.json())
         .then(states => {
             for (let i = 1; i <= ovenCount; i++) {
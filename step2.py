@@ -1,94 +1,94 @@
 import json
+import sys
 import pandas as pd
 from datetime import datetime, timedelta
 import numpy as np
-
-# Load the JSON data
-with open('cleaned_chicken_data.json', 'r') as f:
-    data = json.load(f)
-
-# Convert to DataFrame
-df = pd.DataFrame(data)
-
-# Convert timestamp strings to datetime objects
-df['timestamp'] = pd.to_datetime(df['timestamp'])
-
-# Function to calculate cooking duration
-def calculate_cooking_duration(row):
-    if row['action'] == 'start_cooking':
-        start_time = row['timestamp']
-        finish_time = df[(df['timestamp'] > start_time) & (df['action'] == 'finish_cooking')]['timestamp'].min()
-        if pd.notnull(finish_time):
-            return (finish_time - start_time).total_seconds() / 60  # Duration in minutes
-    return None
-
-# Calculate cooking durations
-df['cooking_duration'] = df.apply(calculate_cooking_duration, axis=1)
-
-# Function to check for start times without finish times
-def check_missing_finish_times(df):
-    start_times = df[df['action'] == 'start_cooking']['timestamp']
-    missing_finish = []
-    for start_time in start_times:
-        finish_time = df[(df['timestamp'] > start_time) & (df['action'] == 'finish_cooking')]['timestamp'].min()
-        if pd.isnull(finish_time):
-            missing_finish.append(start_time)
-    return missing_finish
-
-# Highlight start times without finish times
-missing_finish_times = check_missing_finish_times(df)
-if missing_finish_times:
-    print("\nWarning: The following start times have no corresponding finish time:")
-    for time in missing_finish_times:
-        print(f"  - {time}")
-else:
-    print("\nAll start times have corresponding finish times.")
-
-# Calculate average cooking duration
-average_duration = df['cooking_duration'].mean()
-median_duration = df['cooking_duration'].median()
-
-# Function to estimate missing start times
-def estimate_start_time(row):
-    if row['action'] == 'finish_cooking':
-        if pd.notnull(row['cooking_duration']) and row['cooking_duration'] < 60:
-            # For durations less than 60 minutes, impute start time between 90-100 minutes before finish
-            imputed_duration = np.random.uniform(90, 100)
-            estimated_start = row['timestamp'] - timedelta(minutes=imputed_duration)
-            return estimated_start, True
-        else:
-            # For other cases, use the average duration as before
-            estimated_start = row['timestamp'] - timedelta(minutes=average_duration)
-            return estimated_start, True
-    return row['timestamp'], False
-
-# Estimate missing start times and add flags
-df['imputed_start_time'], df['is_imputed'] = zip(*df.apply(estimate_start_time, axis=1))
-
-# Recalculate cooking durations after imputation
-def recalculate_cooking_duration(row):
-    if row['action'] == 'finish_cooking':
-        if row['is_imputed']:
-            return (row['timestamp'] - row['imputed_start_time']).total_seconds() / 60
-        else:
-            return row['cooking_duration']
-    return row['cooking_duration']
-
-df['cooking_duration'] = df.apply(recalculate_cooking_duration, axis=1)
-
-# Correct invalid data if columns exist
-if 'batch_size' in df.columns:
-    df['batch_size'] = df['batch_size'].clip(lower=0)
-if 'leftovers' in df.columns:
-    df['leftovers'] = df['leftovers'].clip(lower=0)
-
-# Save the processed data as JSON
-df.to_json('processed_chicken_data.json', orient='records', date_format='iso')
-
-print(f"Average cooking duration: {average_duration:.2f} minutes")
-print(f"Median cooking duration: {median_duration:.2f} minutes")
-print("Processed data saved to 'processed_chicken_data.json'")
-
-# Print column names for debugging
-print("\nColumns in the DataFrame:")
-print(df.columns.tolist())
+from columnar import save_frame, load_frame, table_or_export
+
+def load_cleaned_events(path='cleaned_chicken_data.cols'):
+    path = table_or_export(path, 'cleaned_chicken_data.json', 'clean.py')
+    if path.endswith('.cols'):
+        return load_frame(path)
+
+    # Load the JSON data
+    with open(path, 'r') as f:
+        data = json.load(f)
+
+    # Convert to DataFrame
+    return pd.DataFrame(data)
+
+# Function to pair each start with its finish
+def pair_finish_times(df):
+    # For every start_cooking row, the first finish_cooking in the same oven
+    # strictly after it (NaT if there is none). One sort and an as-of join
+    # instead of a scan of the whole frame per start.
+    is_start = df['action'] == 'start_cooking'
+    starts = df.loc[is_start, ['oven', 'timestamp']].dropna().rename_axis('row').reset_index()
+    finishes = df.loc[df['action'] == 'finish_cooking', ['oven', 'timestamp']].dropna()
+    pairs = pd.merge_asof(
+        starts.sort_values('timestamp'),
+        finishes.rename(columns={'timestamp': 'finish_time'}).sort_values('finish_time'),
+        left_on='timestamp', right_on='finish_time', by='oven',
+        direction='forward', allow_exact_matches=False
+    )
+    return pairs.set_index('row')['finish_time'].reindex(df.index)
+
+def process_events(df):
+    # Convert timestamp strings to datetime objects
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+
+    # Calculate cooking durations (in minutes) for start rows
+    finish_times = pair_finish_times(df)
+    df['cooking_duration'] = (finish_times - df['timestamp']).dt.total_seconds() / 60
+
+    # Highlight start times without finish times
+    missing_finish_times = df.loc[(df['action'] == 'start_cooking') & finish_times.isnull(), 'timestamp'].tolist()
+    if missing_finish_times:
+        print("\nWarning: The following start times have no corresponding finish time:")
+        for time in missing_finish_times:
+            print(f"  - {time}")
+    else:
+        print("\nAll start times have corresponding finish times.")
+
+    # Calculate average cooking duration
+    average_duration = df['cooking_duration'].mean()
+    median_duration = df['cooking_duration'].median()
+
+    # Estimate start times for finish rows and flag them as imputed
+    is_finish = df['action'] == 'finish_cooking'
+    # For durations less than 60 minutes, impute start time between 90-100 minutes
+    # before finish; for other cases, use the average duration as before
+    short = is_finish & (df['cooking_duration'] < 60)
+    imputed_duration = pd.Series(average_duration, index=df.index)
+    imputed_duration[short] = np.random.uniform(90, 100, size=short.sum())
+    df['imputed_start_time'] = df['timestamp'].where(~is_finish, df['timestamp'] - pd.to_timedelta(imputed_duration, unit='min'))
+    df['is_imputed'] = is_finish
+
+    # Recalculate cooking durations after imputation
+    df['cooking_duration'] = df['cooking_duration'].where(
+        ~is_finish, (df['timestamp'] - df['imputed_start_time']).dt.total_seconds() / 60
+    )
+
+    # Correct invalid data if columns exist
+    if 'batch_size' in df.columns:
+        df['batch_size'] = df['batch_size'].clip(lower=0)
+    if 'leftovers' in df.columns:
+        df['leftovers'] = df['leftovers'].clip(lower=0)
+
+    print(f"Average cooking duration: {average_duration:.2f} minutes")
+    print(f"Median cooking duration: {median_duration:.2f} minutes")
+    return df
+
+if __name__ == '__main__':
+    df = process_events(load_cleaned_events())
+
+    # Save the processed data, and as JSON on request (python step2.py --export)
+    save_frame(df, 'processed_chicken_data.cols')
+    print("Processed data saved to 'processed_chicken_data.cols'")
+    if '--export' in sys.argv[1:]:
+        df.to_json('processed_chicken_data.json', orient='records', date_format='iso')
+        print("Also exported to 'processed_chicken_data.json'")
+
+    # Print column names for debugging
+    print("\nColumns in the DataFrame:")
+    print(df.columns.tolist())
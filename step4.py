@@ -1,85 +1,104 @@
+import sys
 import pandas as pd
 import numpy as np
 from datetime import timedelta
-
-# Load the cleaned data
-cooking_sessions = pd.read_csv('grouped_cooking_sessions.csv')
-
-# Convert datetime columns
-datetime_columns = ['start_time', 'expected_end_time', 'end_time']
-for col in datetime_columns:
-    cooking_sessions[col] = pd.to_datetime(cooking_sessions[col])
-
-# 1. Calculate New Features
-
-# Cooking Duration
-cooking_sessions['cooking_duration'] = (cooking_sessions['end_time'] - cooking_sessions['start_time']).dt.total_seconds() / 60
-
-# Time Since Last Batch
-cooking_sessions = cooking_sessions.sort_values(['oven', 'start_time'])
-cooking_sessions['time_since_last_batch'] = cooking_sessions.groupby('oven')['start_time'].diff().dt.total_seconds() / 60
-
-# Daily Patterns
-cooking_sessions['hour'] = cooking_sessions['start_time'].dt.hour
-cooking_sessions['day_of_week'] = cooking_sessions['start_time'].dt.dayofweek
-
-# Cyclical encoding for hour and day of week
-cooking_sessions['hour_sin'] = np.sin(cooking_sessions['hour'] * (2 * np.pi / 24))
-cooking_sessions['hour_cos'] = np.cos(cooking_sessions['hour'] * (2 * np.pi / 24))
-cooking_sessions['day_of_week_sin'] = np.sin(cooking_sessions['day_of_week'] * (2 * np.pi / 7))
-cooking_sessions['day_of_week_cos'] = np.cos(cooking_sessions['day_of_week'] * (2 * np.pi / 7))
-
-# 2. Impute Additional Features Based on Batch Size
-
-# Check if 'leftovers' column exists
-if 'leftovers' in cooking_sessions.columns:
-    # Ensure 'leftovers' and 'chickens' are numeric
-    cooking_sessions['leftovers'] = pd.to_numeric(cooking_sessions['leftovers'], errors='coerce')
-    cooking_sessions['chickens'] = pd.to_numeric(cooking_sessions['chickens'], errors='coerce')
-    
-    # Calculate leftovers ratio
-    cooking_sessions['leftovers_ratio'] = cooking_sessions['leftovers'] / cooking_sessions['chickens']
-else:
-    print("Note: 'leftovers' column not found. Skipping leftovers ratio calculation.")
-
-# Print summary of new features
-print("\nSummary of new features:")
-new_features = ['cooking_duration', 'time_since_last_batch', 'hour', 'day_of_week', 
-                'hour_sin', 'hour_cos', 'day_of_week_sin', 'day_of_week_cos']
-if 'leftovers_ratio' in cooking_sessions.columns:
-    new_features.append('leftovers_ratio')
-
-print(cooking_sessions[new_features].describe())
-
-# Save the updated dataset
-cooking_sessions.to_csv('cooking_sessions_engineered.csv', index=False)
-print("\nUpdated dataset with engineered features saved to 'cooking_sessions_engineered.csv'")
-
-# Additional analysis: Check for correlations between new features and existing ones
-print("\nCorrelations between new features and batch size:")
-correlations = cooking_sessions[['chickens'] + new_features].corr()['chickens'].sort_values(ascending=False)
-print(correlations)
-
-# Visualize the distribution of cooking durations
-import matplotlib.pyplot as plt
-
-plt.figure(figsize=(10, 6))
-plt.hist(cooking_sessions['cooking_duration'].dropna(), bins=30)
-plt.title('Distribution of Cooking Durations')
-plt.xlabel('Cooking Duration (minutes)')
-plt.ylabel('Frequency')
-plt.savefig('cooking_duration_distribution.png')
-plt.close()
-
-print("\nA histogram of cooking durations has been saved as 'cooking_duration_distribution.png'")
-
-# Visualize the relationship between batch size and cooking duration
-plt.figure(figsize=(10, 6))
-plt.scatter(cooking_sessions['chickens'], cooking_sessions['cooking_duration'])
-plt.title('Batch Size vs Cooking Duration')
-plt.xlabel('Number of Chickens')
-plt.ylabel('Cooking Duration (minutes)')
-plt.savefig('batch_size_vs_cooking_duration.png')
-plt.close()
-
-print("\nA scatter plot of batch size vs cooking duration has been saved as 'batch_size_vs_cooking_duration.png'")
+from matplotlib.figure import Figure
+from columnar import save_frame, load_frame, table_or_export
+
+def load_sessions(path='grouped_cooking_sessions.cols'):
+    path = table_or_export(path, 'grouped_cooking_sessions.csv', 'clean.py')
+    if path.endswith('.cols'):
+        return load_frame(path)
+
+    # Load the cleaned data
+    cooking_sessions = pd.read_csv(path)
+
+    # Convert datetime columns
+    datetime_columns = ['start_time', 'expected_end_time', 'end_time']
+    for col in datetime_columns:
+        cooking_sessions[col] = pd.to_datetime(cooking_sessions[col])
+    return cooking_sessions
+
+def engineer_features(cooking_sessions):
+    # 1. Calculate New Features
+
+    # Cooking Duration
+    cooking_sessions['cooking_duration'] = (cooking_sessions['end_time'] - cooking_sessions['start_time']).dt.total_seconds() / 60
+
+    # Time Since Last Batch
+    cooking_sessions = cooking_sessions.sort_values(['oven', 'start_time'])
+    cooking_sessions['time_since_last_batch'] = cooking_sessions.groupby('oven')['start_time'].diff().dt.total_seconds() / 60
+
+    # Daily Patterns
+    cooking_sessions['hour'] = cooking_sessions['start_time'].dt.hour
+    cooking_sessions['day_of_week'] = cooking_sessions['start_time'].dt.dayofweek
+
+    # Cyclical encoding for hour and day of week
+    cooking_sessions['hour_sin'] = np.sin(cooking_sessions['hour'] * (2 * np.pi / 24))
+    cooking_sessions['hour_cos'] = np.cos(cooking_sessions['hour'] * (2 * np.pi / 24))
+    cooking_sessions['day_of_week_sin'] = np.sin(cooking_sessions['day_of_week'] * (2 * np.pi / 7))
+    cooking_sessions['day_of_week_cos'] = np.cos(cooking_sessions['day_of_week'] * (2 * np.pi / 7))
+
+    # 2. Impute Additional Features Based on Batch Size
+
+    # Check if 'leftovers' column exists
+    if 'leftovers' in cooking_sessions.columns:
+        # Ensure 'leftovers' and 'chickens' are numeric
+        cooking_sessions['leftovers'] = pd.to_numeric(cooking_sessions['leftovers'], errors='coerce')
+        cooking_sessions['chickens'] = pd.to_numeric(cooking_sessions['chickens'], errors='coerce')
+
+        # Calculate leftovers ratio
+        cooking_sessions['leftovers_ratio'] = cooking_sessions['leftovers'] / cooking_sessions['chickens']
+    else:
+        print("Note: 'leftovers' column not found. Skipping leftovers ratio calculation.")
+
+    # Print summary of new features
+    print("\nSummary of new features:")
+    new_features = ['cooking_duration', 'time_since_last_batch', 'hour', 'day_of_week',
+                    'hour_sin', 'hour_cos', 'day_of_week_sin', 'day_of_week_cos']
+    if 'leftovers_ratio' in cooking_sessions.columns:
+        new_features.append('leftovers_ratio')
+
+    print(cooking_sessions[new_features].describe())
+
+    # Additional analysis: Check for correlations between new features and existing ones
+    print("\nCorrelations between new features and batch size:")
+    correlations = cooking_sessions[['chickens'] + new_features].corr()['chickens'].sort_values(ascending=False)
+    print(correlations)
+    return cooking_sessions
+
+def plot_features(cooking_sessions):
+    # Figures are drawn without pyplot so this can run on a pipeline thread
+    # Visualize the distribution of cooking durations
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    ax.hist(cooking_sessions['cooking_duration'].dropna(), bins=30)
+    ax.set_title('Distribution of Cooking Durations')
+    ax.set_xlabel('Cooking Duration (minutes)')
+    ax.set_ylabel('Frequency')
+    fig.savefig('cooking_duration_distribution.png')
+
+    print("\nA histogram of cooking durations has been saved as 'cooking_duration_distribution.png'")
+
+    # Visualize the relationship between batch size and cooking duration
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    ax.scatter(cooking_sessions['chickens'], cooking_sessions['cooking_duration'])
+    ax.set_title('Batch Size vs Cooking Duration')
+    ax.set_xlabel('Number of Chickens')
+    ax.set_ylabel('Cooking Duration (minutes)')
+    fig.savefig('batch_size_vs_cooking_duration.png')
+
+    print("\nA scatter plot of batch size vs cooking duration has been saved as 'batch_size_vs_cooking_duration.png'")
+
+if __name__ == '__main__':
+    cooking_sessions = engineer_features(load_sessions())
+
+    # Save the updated dataset, and as CSV on request (python step4.py --export)
+    save_frame(cooking_sessions, 'cooking_sessions_engineered.cols')
+    print("\nUpdated dataset with engineered features saved to 'cooking_sessions_engineered.cols'")
+    if '--export' in sys.argv[1:]:
+        cooking_sessions.to_csv('cooking_sessions_engineered.csv', index=False)
+        print("Also exported to 'cooking_sessions_engineered.csv'")
+
+    plot_features(cooking_sessions)
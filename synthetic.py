@@ -0,0 +1,253 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+from datetime import date, timedelta, timezone
+from time import perf_counter
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'frontend'))
+from store_hours import get_opening_time, get_last_batch_time
+
+# Synthetic event streams in the /log schema, for running the offline scripts
+# at sizes the real data never reaches. Each store's ovens cook batches back
+# to back inside the opening hours of store_hours.py, busier in the lunch and
+# dinner rushes and at weekends, with the mistakes the real logs have: cooking
+# time adjustments, finishes that were never logged, finishes without a start
+# (the app sends 'Invalid Date' then) and events sent twice.
+#
+#   python synthetic.py generate --stores 3 --ovens 4 --years 2     one file per store
+#   python synthetic.py scale --years 0.25 0.5 1 2 4                time every pipeline stage
+OUTPUT_DIR = 'synthetic_data'
+START_DATE = date(2024, 10, 4)  # clean.py drops events from before Oct 3, 10 AM
+NOMINAL_COOK_MINUTES = 90  # what the app sets expected_end_time to
+# (start hour, end hour, demand multiplier), Eastern time
+RUSHES = [(11.5, 13.5, 2.0), (17.0, 19.0, 1.7)]
+WEEKEND_DEMAND = 1.25
+P_ADJUST = 0.2
+P_MISSING_FINISH = 0.03
+P_MISSING_START = 0.02
+P_DUPLICATE = 0.01
+P_WEATHER = 0.5  # days with a weather event logged at opening
+# Scaling runs: a stage is superlinear if its time grows faster than
+# events ** SUPERLINEAR. Timings under MIN_SECONDS are mostly fixed costs and
+# noise, so they are left out of the fit.
+SCALE_YEARS = [0.25, 0.5, 1, 2, 4]
+SUPERLINEAR = 1.2
+MIN_SECONDS = 0.25
+
+
+def client_time(moment):
+    # Times set by the app in the browser: UTC, millisecond precision
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+def server_time(moment, rng):
+    # 'timestamp' is added by application.py when the request arrives: naive
+    # UTC with microseconds, a moment after the client's time
+    arrived = moment.astimezone(timezone.utc) + timedelta(seconds=rng.uniform(0.05, 0.6))
+    return arrived.replace(tzinfo=None).isoformat()
+
+def demand(moment, profile):
+    hour = moment.hour + moment.minute / 60
+    level = profile['demand'] * (WEEKEND_DEMAND if moment.weekday() >= 5 else 1.0)
+    for start, end, multiplier in RUSHES:
+        if start <= hour < end:
+            level *= multiplier
+    return level
+
+def store_profile(store, seed):
+    # Stores differ in how busy they are and how long their ovens take
+    rng = random.Random(f'{seed}-{store}-profile')
+    return {'demand': rng.uniform(0.7, 1.3), 'cook_minutes': rng.uniform(88, 97)}
+
+
+def oven_day(oven, day, profile, rng):
+    # One oven's events for one day, in time order
+    events = []
+    moment = get_opening_time(day) - timedelta(minutes=rng.uniform(30, 100))
+    last_batch = get_last_batch_time(day)
+    while moment <= last_batch:
+        level = demand(moment, profile)
+        chickens = max(6, min(40, round(rng.gauss(16 * level, 4))))
+        expected = moment + timedelta(minutes=NOMINAL_COOK_MINUTES)
+        finish = moment + timedelta(minutes=rng.gauss(profile['cook_minutes'], 5))
+        has_start = rng.random() >= P_MISSING_START
+
+        if has_start:
+            events.append((moment, {
+                'action': 'start_cooking', 'oven': oven, 'chickens': chickens,
+                'start_time': client_time(moment), 'expected_end_time': client_time(expected),
+            }))
+        if has_start and rng.random() < P_ADJUST:
+            adjusted = moment + timedelta(minutes=rng.uniform(20, 70))
+            time_left = max(5, round((finish - adjusted).total_seconds() / 60 + rng.gauss(0, 8)))
+            new_expected = adjusted + timedelta(minutes=time_left)
+            events.append((adjusted, {
+                'action': 'adjust_cooking_time', 'oven': oven, 'new_time_left': time_left,
+                'new_expected_end_time': client_time(new_expected),
+            }))
+            finish = new_expected + timedelta(minutes=rng.gauss(0, 3))
+        if rng.random() >= P_MISSING_FINISH:
+            events.append((finish, {
+                'action': 'finish_cooking', 'oven': oven, 'chickens': chickens,
+                'start_time': client_time(moment) if has_start else 'Invalid Date',
+                'expected_end_time': client_time(expected) if has_start else expected.strftime('%I:%M:%S %p').lstrip('0'),
+                'actual_end_time': client_time(finish),
+            }))
+
+        # Chickens are taken out once the rush after the finish is served
+        served = finish + timedelta(minutes=rng.uniform(2, 30))
+        left = round(chickens * max(0.0, min(1.0, rng.gauss(0.35 / demand(served, profile), 0.1))))
+        events.append((served, {
+            'action': 'post_rush', 'oven': oven, 'chickens_taken': chickens - left,
+            'chickens_left': left, 'time': client_time(served),
+        }))
+
+        # Busier times get the next batch in sooner
+        gap = min(180, rng.expovariate(demand(served, profile) / 30))
+        moment = max(finish, served) + timedelta(minutes=gap)
+    return events
+
+def generate_store(store, ovens, start, days, seed=0):
+    # Yields the store's events day by day in arrival order, so any number of
+    # years can be written without holding them
+    profile = store_profile(store, seed)
+    rng = random.Random(f'{seed}-{store}')
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        timed = []
+        if rng.random() < P_WEATHER:
+            opening = get_opening_time(day)
+            details = {'time': client_time(opening), 'weather': rng.choice(['sunny', 'cloudy', 'rain', 'snow']),
+                       'temperature': round(rng.gauss(60, 15))}
+            timed.append((opening, {'action': 'weather', 'time': details['time'], 'details': details}))
+        for oven in range(1, ovens + 1):
+            timed.extend(oven_day(oven, day, profile, rng))
+        timed.sort(key=lambda item: item[0])
+        for moment, event in timed:
+            event['timestamp'] = server_time(moment, rng)
+            yield event
+            if rng.random() < P_DUPLICATE:
+                yield dict(event)  # Sent twice; clean.py drops the copy
+
+def write_events(events, path):
+    # Same JSON array layout as the exports clean.py reads
+    count = 0
+    with open(path, 'w') as f:
+        f.write('[')
+        for event in events:
+            f.write(',\n' if count else '\n')
+            f.write(json.dumps(event))
+            count += 1
+        f.write('\n]\n')
+    return count
+
+def generate(stores, ovens, years, start=START_DATE, seed=0, output_dir=OUTPUT_DIR):
+    # Writes <output_dir>/store-NNN.json for every store; returns {path: events}
+    os.makedirs(output_dir, exist_ok=True)
+    days = max(1, round(years * 365))
+    written = {}
+    for store in range(1, stores + 1):
+        path = os.path.join(output_dir, f'store-{store:03d}.json')
+        written[path] = write_events(generate_store(store, ovens, start, days, seed), path)
+    return written
+
+
+def time_stages(path):
+    # Runs the pipeline stages in order on one events file and returns
+    # ({stage: seconds}, {'events': n, 'sessions': n}). Loading the JSON is
+    # timed apart from the rest of clean.
+    import clean
+    import pipeline
+
+    timings = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = perf_counter()
+        events = clean.load_events(path)
+        timings['load'] = perf_counter() - start
+        start = perf_counter()
+        outputs = dict(zip(['events', 'sessions'], clean.clean_data(events)))
+        timings['clean'] = perf_counter() - start
+        for stage in pipeline.STAGES[1:]:
+            args = [outputs[name].copy() for name in stage.inputs]
+            start = perf_counter()
+            result = stage.run(*args)
+            timings[stage.name] = perf_counter() - start
+            outputs.update(zip(stage.outputs, result if len(stage.outputs) > 1 else (result,)))
+    return timings, {'events': len(events), 'sessions': len(outputs['sessions'])}
+
+def scale(years_list=SCALE_YEARS, ovens=4, seed=0):
+    # Times every stage on one store's history of each length and points out
+    # where a stage grows faster than the data. Everything the stages write
+    # (plots, models) goes to a temporary directory.
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.environ['MODEL_DIR'] = os.path.join(work_dir, 'models')
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            rows = []
+            for years in years_list:
+                [path] = generate(1, ovens, years, seed=seed, output_dir=work_dir)
+                timings, counts = time_stages(path)
+                rows.append((years, counts, timings))
+                stages = list(timings)
+                if len(rows) == 1:
+                    print(f"{'years':>6} {'events':>9} {'sessions':>9} " + ' '.join(f'{name:>8}' for name in stages) + f" {'total':>8}")
+                print(f"{years:>6g} {counts['events']:>9,} {counts['sessions']:>9,} "
+                      + ' '.join(f'{timings[name]:>8.2f}' for name in stages) + f" {sum(timings.values()):>8.2f}", flush=True)
+        finally:
+            os.chdir(cwd)
+
+    # Growth exponent k of each stage, time ~ events ** k: between each pair
+    # of consecutive sizes to show where it bends, and fitted over every size
+    # the stage took MIN_SECONDS at to decide whether it is superlinear
+    print("\nGrowth exponent k, time ~ events ** k (1 = linear):")
+    print(f"{'events':>21} " + ' '.join(f'{name:>8}' for name in stages))
+    for (_, small, small_times), (_, large, large_times) in zip(rows, rows[1:]):
+        ratio = math.log(large['events'] / small['events'])
+        print(f"{small['events']:>9,} -> {large['events']:>9,} "
+              + ' '.join(f"{math.log(large_times[name] / small_times[name]) / ratio:>8.2f}" for name in stages))
+    fits = {}
+    for name in stages:
+        points = [(math.log(counts['events']), math.log(timings[name])) for _, counts, timings in rows if timings[name] >= MIN_SECONDS]
+        if len(points) >= 2:
+            fits[name] = float(np.polyfit(*zip(*points), 1)[0])
+    print(f"{'fit':>21} " + ' '.join(f"{fits[name]:>8.2f}" if name in fits else f"{'-':>8}" for name in stages))
+
+    superlinear = [f"{name} (k={k:.2f})" for name, k in fits.items() if k > SUPERLINEAR]
+    if superlinear:
+        print("\nSuperlinear: " + ', '.join(superlinear))
+    else:
+        print("\nNo stage grows faster than linearly over these sizes")
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate synthetic /log event streams and time the pipeline on them.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    generate_parser = commands.add_parser('generate', help="write one events file per store")
+    generate_parser.add_argument('--stores', type=int, default=1)
+    generate_parser.add_argument('--ovens', type=int, default=4, help="ovens per store")
+    generate_parser.add_argument('--years', type=float, default=1.0)
+    generate_parser.add_argument('--start', type=date.fromisoformat, default=START_DATE, help="first day, YYYY-MM-DD")
+    generate_parser.add_argument('--seed', type=int, default=0)
+    generate_parser.add_argument('--out', default=OUTPUT_DIR, help="output directory")
+    scale_parser = commands.add_parser('scale', help="time each pipeline stage on growing histories")
+    scale_parser.add_argument('--years', type=float, nargs='+', default=SCALE_YEARS)
+    scale_parser.add_argument('--ovens', type=int, default=4)
+    scale_parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        start = perf_counter()
+        written = generate(args.stores, args.ovens, args.years, args.start, args.seed, args.out)
+        for path, count in written.items():
+            print(f"Wrote {count:,} events to '{path}'")
+        print(f"Generated {sum(written.values()):,} events in {perf_counter() - start:.1f}s")
+    else:
+        scale(args.years, args.ovens, args.seed)
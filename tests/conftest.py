@@ -0,0 +1,19 @@
+import os
+import sys
+
+# The scripts are run from the repository root and the web app from frontend/,
+# so the tests import them the same way
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [REPO, os.path.join(REPO, 'frontend')]
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def apps(tmp_path_factory):
+    # application.py and backend.py, imported once with their runtime files in
+    # a temporary directory (see benchmark.load_apps)
+    from benchmark import load_apps
+    application, backend = load_apps(str(tmp_path_factory.mktemp('apps')))
+    application.write_behind.stop()
+    return application, backend
@@ -0,0 +1,94 @@
+import threading
+import pytest
+from chicken_model import current_version
+
+NEWER = '20991231T000000Z-00000000'  # A version this worker has not swapped to
+
+
+@pytest.fixture
+def backend(apps):
+    _, backend = apps
+    store = backend.registry.get()
+    keys = [backend.state_key(store, name) for name in ('chain', 'model_version', 'last_ml_prediction_time')]
+    saved = backend.shared_state.snapshot()
+    yield backend
+    with backend.shared_state.transaction() as state:
+        for key in keys:
+            if key in saved:
+                state[key] = saved[key]
+            else:
+                state.pop(key, None)
+
+
+def store_state(backend, **values):
+    store = backend.registry.get()
+    with backend.shared_state.transaction() as state:
+        for name, value in values.items():
+            state[backend.state_key(store, name)] = value
+
+
+def stored_chain(backend):
+    return backend.shared_state.snapshot().get(backend.state_key(backend.registry.get(), 'chain'))
+
+
+def newer_chain(backend, store, now, current):
+    # Today's chain as a worker on the newer version would have stored it
+    model = backend.models.get(store.id).current
+    chain = backend.extend_chain(store, backend.new_chain(store.hours.opening_time(now.date()), now.date(), model), now, model)
+    if not current:
+        chain = dict(chain, hops=chain['hops'][:1])
+    return dict(chain, version=NEWER)
+
+
+def test_lagging_worker_uses_the_chain_of_the_newer_version(backend):
+    store = backend.registry.get()
+    now = backend.datetime.now(store.timezone)
+    chain = newer_chain(backend, store, now, current=True)
+    store_state(backend, chain=chain, model_version=NEWER)
+
+    assert backend.current_chain(store, now) == chain
+    assert stored_chain(backend) == chain
+
+
+def test_lagging_worker_does_not_overwrite_a_newer_chain(backend):
+    store = backend.registry.get()
+    now = backend.datetime.now(store.timezone)
+    stale = newer_chain(backend, store, now, current=False)
+    store_state(backend, chain=stale, model_version=NEWER)
+
+    chain = backend.current_chain(store, now)
+    assert chain['version'] == backend.models.get(store.id).current.version
+    assert chain['hops'][-1][1] > now
+    assert stored_chain(backend) == stale
+
+
+def test_worker_on_the_current_version_rebuilds_an_older_chain(backend):
+    store = backend.registry.get()
+    now = backend.datetime.now(store.timezone)
+    model = backend.models.get(store.id).current
+    store_state(backend, chain=dict(newer_chain(backend, store, now, current=True), version='older'), model_version=model.version)
+
+    chain = backend.current_chain(store, now)
+    assert chain['version'] == model.version
+    assert stored_chain(backend) == chain
+
+
+def test_predict_is_not_held_up_by_another_store(backend):
+    client = backend.app.test_client()
+    backend.predict_cache.pop(backend.registry.default, None)
+    other = backend.predict_cache_locks.setdefault('other-store', threading.Lock())
+    with other:
+        result = []
+        thread = threading.Thread(target=lambda: result.append(client.get('/predict').status_code))
+        thread.start()
+        thread.join(5)
+    assert result == [200]
+
+
+@pytest.mark.parametrize('version', ['..', '/tmp'])
+def test_reload_model_rejects_paths(backend, version):
+    model_dir = backend.registry.get().models
+    published = current_version(model_dir)
+    response = backend.app.test_client().post(f'/admin/{backend.ADMIN_TOKEN}/reload-model', json={'version': version})
+    assert response.status_code == 400
+    assert current_version(model_dir) == published
@@ -0,0 +1,81 @@
+import json
+import threading
+from datetime import date
+from batch_store import MIGRATED_KEY, BatchStore
+from benchmark import LocalS3
+from event_log import EventLog
+
+BUCKET = 'test-bucket'
+LEGACY_KEY = 'chicken_data.json'
+
+
+def batch(day, end):
+    return {'batch_end_time': f'{day}T{end}', 'chickens': 8}
+
+
+def legacy_log(entries):
+    # An event log whose only history is the old single-file blob
+    s3 = LocalS3()
+    s3.put_object(Bucket=BUCKET, Key=LEGACY_KEY, Body=json.dumps(entries).encode('utf-8'))
+    return EventLog(s3, BUCKET, legacy_key=LEGACY_KEY)
+
+
+def numbers(store, day):
+    return [(e['batch_end_time'][11:16], e['batch_number']) for e in store.load_day(day)[0]]
+
+
+def test_numbering_continues_from_legacy_batches():
+    log = legacy_log([{'action': 'start_cooking', 'oven': 1}, batch('2024-05-15', '12:00:00'),
+                      batch('2024-05-15', '09:30:00'), batch('2024-05-14', '18:00:00')])
+    store = BatchStore(log.s3, BUCKET, legacy=log.iter_events)
+
+    store.add([batch('2024-05-15', '14:00:00')])
+    assert numbers(store, date(2024, 5, 15)) == [('09:30', 1), ('12:00', 2), ('14:00', 3)]
+    assert [e['batch_end_time'] for e in store.iter_batches()] == [
+        '2024-05-14T18:00:00', '2024-05-15T09:30:00', '2024-05-15T12:00:00', '2024-05-15T14:00:00']
+
+
+def test_migration_runs_once():
+    log = legacy_log([batch('2024-05-15', '09:30:00')])
+    store = BatchStore(log.s3, BUCKET, legacy=log.iter_events)
+    store.add([batch('2024-05-15', '12:00:00')])
+
+    # A fresh process sees the marker and does not copy the legacy batches again
+    restarted = BatchStore(log.s3, BUCKET, legacy=log.iter_events)
+    restarted.add([batch('2024-05-15', '14:00:00')])
+    assert numbers(restarted, date(2024, 5, 15)) == [('09:30', 1), ('12:00', 2), ('14:00', 3)]
+
+
+def test_migration_does_not_overwrite_a_partition():
+    log = legacy_log([batch('2024-05-15', '09:30:00')])
+    # Another process migrated and added a batch before this one got to it
+    other = BatchStore(log.s3, BUCKET, legacy=log.iter_events)
+    other.add([batch('2024-05-15', '12:00:00')])
+    log.s3.delete_object(Bucket=BUCKET, Key=MIGRATED_KEY)
+
+    store = BatchStore(log.s3, BUCKET, legacy=log.iter_events)
+    store.add([batch('2024-05-15', '14:00:00')])
+    assert numbers(store, date(2024, 5, 15)) == [('09:30', 1), ('12:00', 2), ('14:00', 3)]
+
+
+def test_concurrent_first_adds_migrate_once():
+    log = legacy_log([batch('2024-05-15', f'0{h}:00:00') for h in range(6, 10)])
+    stores = [BatchStore(log.s3, BUCKET, legacy=log.iter_events) for _ in range(4)]
+    threads = [threading.Thread(target=store.add, args=([batch('2024-05-15', f'1{i}:00:00')],))
+               for i, store in enumerate(stores)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    day = stores[0].load_day(date(2024, 5, 15))[0]
+    assert len(day) == 8
+    assert [e['batch_number'] for e in day] == list(range(1, 9))
+
+
+def test_no_legacy_means_no_migration():
+    s3 = LocalS3()
+    store = BatchStore(s3, BUCKET)
+    store.add([batch('2024-05-15', '12:00:00')])
+    assert numbers(store, date(2024, 5, 15)) == [('12:00', 1)]
+    assert (BUCKET, MIGRATED_KEY) not in s3.objects
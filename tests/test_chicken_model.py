@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+from chicken_model import (FEATURE_SIZES, TARGETS, ModelArtifact, build_prediction_tables, fuse_models,
+                           predict_fused, save_artifact)
+
+OVENS = [1, 2, 3]
+
+
+def grid_inputs(rng, count):
+    # Random [hour, minute, day_of_week] rows, as the models see them
+    return np.column_stack([rng.integers(0, size, count) for size in FEATURE_SIZES])
+
+
+@pytest.fixture(scope='module')
+def models():
+    rng = np.random.default_rng(0)
+    X = grid_inputs(rng, 400)
+    models = {}
+    for oven in OVENS:
+        models[oven] = {}
+        for t, target in enumerate(TARGETS):
+            y = X[:, 0] * (oven + t) + X[:, 1] / 7 + rng.normal(0, 5, len(X))
+            models[oven][target] = RandomForestRegressor(n_estimators=10, max_depth=8, random_state=oven * 10 + t).fit(X, y)
+    return models
+
+
+def test_fused_trees_match_sklearn(models):
+    X = grid_inputs(np.random.default_rng(1), 500)
+    predicted = predict_fused(fuse_models(models), X)
+    for i, oven in enumerate(OVENS):
+        for t, target in enumerate(TARGETS):
+            np.testing.assert_allclose(predicted[:, i, t], models[oven][target].predict(X), rtol=1e-9, atol=1e-9)
+
+
+def test_tables_match_fused_trees(models):
+    fused = fuse_models(models)
+    time_table, leftovers_table = build_prediction_tables(fused)
+    X = grid_inputs(np.random.default_rng(2), 500)
+    predicted = predict_fused(fused, X)
+    hour, minute, day_of_week = X.T
+    for t, table in enumerate((time_table, leftovers_table)):
+        np.testing.assert_allclose(table[:, day_of_week, hour, minute].T, predicted[:, :, t], rtol=1e-5, atol=1e-4)
+
+
+def test_backend_without_tables_predicts_from_fused_trees(apps, models, tmp_path):
+    _, backend = apps
+    save_artifact(str(tmp_path), fuse_models(models))
+    with_tables = ModelArtifact(str(tmp_path))
+    without_tables = ModelArtifact(str(tmp_path))
+    without_tables.time_table = without_tables.leftovers_table = None
+
+    start = datetime(2024, 5, 13, 8, 0)
+    for prediction_time in (start + timedelta(minutes=37 * i) for i in range(300)):
+        expected_time, expected = backend.predict_using_ml(prediction_time, with_tables)
+        actual_time, actual = backend.predict_using_ml(prediction_time, without_tables)
+        assert abs(actual_time - expected_time) < timedelta(milliseconds=10)
+        for a, e in zip(actual, expected):
+            assert a['oven'] == e['oven']
+            assert abs(a['next_time'] - e['next_time']) < timedelta(milliseconds=10)
+            assert a['leftovers'] == pytest.approx(e['leftovers'], abs=0.011)
@@ -0,0 +1,131 @@
+import random
+import numpy as np
+import pandas as pd
+import pytest
+import clean
+from benchmark_sessions import reference_sessions, synthetic_events
+
+BASE = pd.Timestamp('2024-10-04 08:00', tz='US/Eastern')
+
+
+def event(oven, minutes, action, **fields):
+    row = {'oven': oven, 'timestamp': BASE + pd.Timedelta(minutes=minutes), 'action': action}
+    for name, value in fields.items():
+        row[name] = BASE + pd.Timedelta(minutes=value) if name.endswith('_time') else value
+    return row
+
+
+def frame(rows):
+    columns = ['oven', 'timestamp', 'action', 'chickens', 'expected_end_time', 'new_expected_end_time', 'chickens_left']
+    events = pd.DataFrame(rows).reindex(columns=columns)
+    for col in ['timestamp', 'expected_end_time', 'new_expected_end_time']:
+        events[col] = pd.to_datetime(events[col], utc=True).dt.tz_convert('US/Eastern')
+    return events.sort_values(['oven', 'timestamp'], kind='stable')
+
+
+def assert_same_sessions(events, seed=0):
+    np.random.seed(seed)
+    expected = reference_sessions(events)
+    np.random.seed(seed)
+    actual = clean.build_sessions(events)
+    # The loop only had finish columns if some session finished
+    expected = expected.reindex(columns=actual.columns)
+    # The loop stored missing values as None in object columns
+    for col in ['leftovers', 'chickens']:
+        expected[col] = pd.to_numeric(expected[col])
+        actual[col] = pd.to_numeric(actual[col])
+    for col in ['start_time', 'expected_end_time', 'leftovers_time', 'end_time']:
+        expected[col] = pd.to_datetime(expected[col], utc=True).dt.as_unit('ns')
+        actual[col] = pd.to_datetime(actual[col], utc=True).dt.as_unit('ns')
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+BOUNDARY_CASES = {
+    # Exactly 60 minutes is long enough; a microsecond less is imputed
+    'sixty_minutes': [event(1, 0, 'start_cooking', chickens=12, expected_end_time=90),
+                      event(1, 60, 'finish_cooking', chickens=12)],
+    'just_under_sixty': [event(1, 0, 'start_cooking', chickens=12, expected_end_time=90),
+                         event(1, 60 - 1e-6 / 60, 'finish_cooking', chickens=12)],
+    # A finish with no start gets one 90 minutes earlier
+    'orphan_finish': [event(1, 100, 'finish_cooking', chickens=8),
+                      event(1, 110, 'post_rush', chickens_left=2)],
+    # A second finish moves the end but never imputes again
+    'repeated_finish': [event(1, 0, 'start_cooking', chickens=10, expected_end_time=90),
+                        event(1, 30, 'finish_cooking', chickens=10),
+                        event(1, 95, 'finish_cooking', chickens=10)],
+    # Adjustments after the finish change expected_end_time but not time_difference
+    'adjust_after_finish': [event(1, 0, 'start_cooking', chickens=10, expected_end_time=90),
+                            event(1, 40, 'adjust_cooking_time', new_expected_end_time=100),
+                            event(1, 98, 'finish_cooking', chickens=10),
+                            event(1, 99, 'adjust_cooking_time', new_expected_end_time=120)],
+    'adjust_without_time': [event(1, 0, 'start_cooking', chickens=10, expected_end_time=90),
+                            event(1, 40, 'adjust_cooking_time'),
+                            event(1, 92, 'finish_cooking', chickens=10)],
+    # Events while no session is open are ignored
+    'stray_events': [event(1, 0, 'adjust_cooking_time', new_expected_end_time=50),
+                     event(1, 1, 'post_rush', chickens_left=3),
+                     event(1, 5, 'start_cooking', chickens=10, expected_end_time=95),
+                     event(1, 100, 'finish_cooking', chickens=10),
+                     event(1, 110, 'post_rush', chickens_left=1),
+                     event(1, 111, 'post_rush', chickens_left=0)],
+    # A start while a session is open ends it; the last one stays open
+    'start_over_open_session': [event(1, 0, 'start_cooking', chickens=10, expected_end_time=90),
+                                event(1, 20, 'start_cooking', chickens=14, expected_end_time=110)],
+    # Ties on timestamp within an oven are taken in input order
+    # Same timestamp as the finish, but logged after it: too late to count
+    'finish_and_adjust_tie': [event(1, 0, 'start_cooking', chickens=10, expected_end_time=90),
+                              event(1, 40, 'adjust_cooking_time', new_expected_end_time=100),
+                              event(1, 95, 'finish_cooking', chickens=10),
+                              event(1, 95, 'adjust_cooking_time', new_expected_end_time=120)],
+    'finish_and_post_rush_tie': [event(1, 0, 'start_cooking', chickens=10, expected_end_time=90),
+                                 event(1, 91, 'finish_cooking', chickens=10),
+                                 event(1, 91, 'post_rush', chickens_left=4)],
+    'post_rush_and_start_tie': [event(1, 0, 'start_cooking', chickens=10, expected_end_time=90),
+                                event(1, 91, 'finish_cooking', chickens=10),
+                                event(1, 120, 'post_rush', chickens_left=4),
+                                event(1, 120, 'start_cooking', chickens=9, expected_end_time=210),
+                                event(1, 215, 'finish_cooking', chickens=9)],
+    # Ovens are independent and imputations are drawn oven by oven
+    'interleaved_ovens': [event(2, 0, 'start_cooking', chickens=10, expected_end_time=90),
+                          event(1, 5, 'finish_cooking', chickens=6),
+                          event(2, 30, 'finish_cooking', chickens=10),
+                          event(1, 40, 'start_cooking', chickens=11, expected_end_time=130),
+                          event(1, 50, 'finish_cooking', chickens=11),
+                          event(2, 35, 'post_rush', chickens_left=5)],
+}
+
+
+@pytest.mark.parametrize('case', sorted(BOUNDARY_CASES))
+def test_boundary_cases_match_reference(case):
+    assert_same_sessions(frame(BOUNDARY_CASES[case]))
+
+
+def random_stream(rng, ovens=3, length=40):
+    # Mostly well-formed sessions with every kind of mistake mixed in, on a
+    # five-minute grid so ties happen
+    rows = []
+    for oven in range(1, ovens + 1):
+        minute = 0
+        for _ in range(length):
+            minute += rng.choice([0, 5, 5, 10, 30, 60, 90])
+            action = rng.choices(['start_cooking', 'finish_cooking', 'adjust_cooking_time', 'post_rush'], [4, 4, 1, 3])[0]
+            if action == 'start_cooking':
+                rows.append(event(oven, minute, action, chickens=rng.randint(6, 30), expected_end_time=minute + 90))
+            elif action == 'finish_cooking':
+                rows.append(event(oven, minute, action, chickens=rng.randint(6, 30)))
+            elif action == 'adjust_cooking_time':
+                fields = {'new_expected_end_time': minute + rng.randint(5, 60)} if rng.random() < 0.8 else {}
+                rows.append(event(oven, minute, action, **fields))
+            else:
+                rows.append(event(oven, minute, action, chickens_left=rng.randint(0, 10)))
+    rng.shuffle(rows)
+    return frame(rows)
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_random_streams_match_reference(seed):
+    assert_same_sessions(random_stream(random.Random(seed)), seed)
+
+
+def test_synthetic_store_matches_reference():
+    assert_same_sessions(synthetic_events(3000))
@@ -0,0 +1,112 @@
+import json
+from datetime import datetime, timedelta, timezone
+import event_log
+from benchmark import LocalS3
+from event_log import EventLog
+
+BUCKET = 'test-bucket'
+
+
+def put_segment(log, entries, minutes_ago):
+    # A segment as an appender whose clock read now - minutes_ago would write it
+    key = log.new_segment_key(datetime.now(timezone.utc) - timedelta(minutes=minutes_ago))
+    log.s3.put_object(Bucket=BUCKET, Key=key, Body=json.dumps(entries).encode('utf-8'))
+    return key
+
+
+def raw_keys(log):
+    return list(log.list_segments())
+
+
+def test_recent_segments_are_not_compacted():
+    log = EventLog(LocalS3(), BUCKET)
+    old = [put_segment(log, [{'n': i}], 30 - i) for i in range(3)]
+    recent = put_segment(log, [{'n': 3}], 1)
+
+    assert log.compact(min_segments=1) == 3
+    manifest, _ = log.load_manifest()
+    assert manifest['segments'][0]['raw_segments'] == old
+    assert manifest['watermark'] == old[-1] < recent
+    assert [e['n'] for e in log.iter_events()] == [0, 1, 2, 3]
+
+
+def test_only_recorded_segments_are_deleted(monkeypatch):
+    log = EventLog(LocalS3(), BUCKET)
+    compacted = [put_segment(log, [{'n': i}], 30 - i) for i in range(3)]
+    assert log.compact(min_segments=1) == 3
+
+    # A put that was still in flight when the compactor listed: its key sorts
+    # before the watermark but it was never compacted
+    late = put_segment(log, [{'n': 'late'}], 29)
+    assert late < log.load_manifest()[0]['watermark']
+
+    # The next run deletes only the recorded keys and compacts the late one
+    monkeypatch.setattr(event_log, 'COMPACT_GRACE', -1)
+    assert log.compact(min_segments=1) == 1
+    assert raw_keys(log) == [late]
+    manifest, _ = log.load_manifest()
+    assert manifest['segments'][0]['raw_segments'] == []
+    assert manifest['segments'][1]['raw_segments'] == [late]
+    assert manifest['watermark'] == compacted[-1]
+
+    # Nothing is deleted twice
+    assert log.delete_compacted_segments(manifest) == 1
+    assert log.delete_compacted_segments(manifest) == 0
+    assert raw_keys(log) == []
+
+
+def test_events_survive_compaction_and_deletion(monkeypatch):
+    log = EventLog(LocalS3(), BUCKET)
+    for i in range(10):
+        put_segment(log, [{'n': i}], 60 - i)
+    log.append([{'n': 10}])
+    assert log.compact(min_segments=1) == 10
+    monkeypatch.setattr(event_log, 'COMPACT_GRACE', -1)
+    log.compact(min_segments=1)
+    assert [e['n'] for e in log.iter_events()] == list(range(11))
+
+
+def test_late_segment_behind_the_watermark_is_read_once():
+    log = EventLog(LocalS3(), BUCKET)
+    for i in range(3):
+        put_segment(log, [{'n': i}], 30 - i)
+    assert log.compact(min_segments=1) == 3
+    # From an appender whose clock is 20 minutes slow
+    put_segment(log, [{'n': 'late'}], 40)
+    assert [e['n'] for e in log.iter_events()] == [0, 1, 2, 'late']
+
+    assert log.compact(min_segments=1) == 1
+    assert [e['n'] for e in log.iter_events()] == [0, 1, 2, 'late']
+
+
+def test_keys_that_failed_to_delete_stay_recorded(monkeypatch):
+    s3 = LocalS3()
+    log = EventLog(s3, BUCKET)
+    keys = [put_segment(log, [{'n': i}], 30 - i) for i in range(3)]
+    assert log.compact(min_segments=1) == 3
+
+    def delete_objects(Bucket, Delete):
+        # S3 reports per-key failures in the response rather than raising
+        for obj in Delete['Objects'][1:]:
+            s3.delete_object(Bucket=Bucket, Key=obj['Key'])
+        return {'Errors': [{'Key': Delete['Objects'][0]['Key'], 'Code': 'InternalError'}]}
+
+    monkeypatch.setattr(s3, 'delete_objects', delete_objects)
+    monkeypatch.setattr(event_log, 'COMPACT_GRACE', -1)
+    log.compact(min_segments=1)
+    manifest, _ = log.load_manifest()
+    assert manifest['segments'][0]['raw_segments'] == keys[:1]
+    assert raw_keys(log) == keys[:1]
+    assert [e['n'] for e in log.iter_events()] == [0, 1, 2]
+
+
+def test_reads_manifests_without_raw_segments():
+    # Segments compacted before raw_segments was recorded, not deleted yet
+    log = EventLog(LocalS3(), BUCKET)
+    keys = [put_segment(log, [{'n': i}], 30 - i) for i in range(3)]
+    assert log.compact(min_segments=1) == 3
+    manifest, etag = log.load_manifest()
+    del manifest['segments'][0]['raw_segments']
+    log.save_manifest(manifest, etag)
+    assert raw_keys(log) == keys
+    assert [e['n'] for e in log.iter_events()] == [0, 1, 2]
@@ -0,0 +1,33 @@
+import os
+import shutil
+import pytest
+from chicken_model import current_version, publish_version
+from model_store import ModelStore
+
+SHIPPED = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'frontend', 'models')
+
+
+@pytest.fixture
+def root(tmp_path):
+    # A copy of the shipped model root
+    version = current_version(SHIPPED)
+    root = tmp_path / 'models'
+    shutil.copytree(os.path.join(SHIPPED, version), root / version)
+    publish_version(str(root), version)
+    return str(root)
+
+
+@pytest.mark.parametrize('version', ['..', '.', '', 'CURRENT', '/tmp', '../models', 7, ['x'],
+                                     '20261018T131152Z-5480a8a9/..', '20261018T131152Z-5480a8a9\n'])
+def test_reload_rejects_what_is_not_a_version_name(root, version):
+    store = ModelStore(root)
+    with pytest.raises(ValueError):
+        store.reload(version)
+    assert current_version(root) == store.current.version
+
+
+def test_reload_rejects_an_unpublished_version(root):
+    store = ModelStore(root)
+    with pytest.raises(ValueError, match='Unknown model version'):
+        store.reload('20991231T000000Z-0000abcd')
+    assert current_version(root) == store.current.version
@@ -0,0 +1,128 @@
+import json
+import threading
+import pytest
+from benchmark import LocalS3, use_bucket
+
+
+class RacingS3(LocalS3):
+    # Another instance creates oven_states.json right after our GET misses it
+    def __init__(self, other_states):
+        super().__init__()
+        self.other_states = other_states
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        try:
+            return super().get_object(Bucket, Key, IfNoneMatch)
+        except Exception:
+            if self.other_states is not None:
+                self.put_object(Bucket, Key, json.dumps(self.other_states).encode('utf-8'), IfNoneMatch='*')
+                self.other_states = None
+            raise
+
+
+def stored_states(application, s3):
+    return json.loads(s3.get_object(Bucket=application.S3_BUCKET, Key=application.S3_OVEN_STATE_KEY)['Body'].read())
+
+
+def test_cold_start_keeps_state_written_by_another_instance(apps):
+    application, _ = apps
+    other = {'2': {'status': 'cooking', 'chickens': 12}}
+    s3 = RacingS3(other)
+    use_bucket(application, s3)
+
+    states, etag = application.load_oven_states()
+    assert states == other
+    assert stored_states(application, s3) == other
+    assert etag == s3.get_object(Bucket=application.S3_BUCKET, Key=application.S3_OVEN_STATE_KEY)['ETag']
+
+
+def test_cold_start_creates_empty_states(apps):
+    application, _ = apps
+    s3 = LocalS3()
+    use_bucket(application, s3)
+    assert application.load_oven_states()[0] == {}
+    assert stored_states(application, s3) == {}
+
+
+class CountingS3(LocalS3):
+    # Counts conditional puts of oven_states.json and how many lost the race;
+    # with always_conflict every one of them fails its precondition
+    def __init__(self, latency=0.0, always_conflict=False):
+        super().__init__(latency)
+        self.always_conflict = always_conflict
+        self.attempts = self.conflicts = 0
+        self.count_lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, ContentType=None, IfMatch=None, IfNoneMatch=None):
+        if IfMatch is None:
+            return super().put_object(Bucket, Key, Body, ContentType, IfMatch, IfNoneMatch)
+        with self.count_lock:
+            self.attempts += 1
+        try:
+            if self.always_conflict:
+                raise self.error('PreconditionFailed', 'PutObject')
+            return super().put_object(Bucket, Key, Body, ContentType, IfMatch, IfNoneMatch)
+        except Exception:
+            with self.count_lock:
+                self.conflicts += 1
+            raise
+
+
+def test_concurrent_updates_to_different_ovens_are_not_lost(apps):
+    application, _ = apps
+    s3 = CountingS3(latency=0.002)
+    use_bucket(application, s3)
+    ovens, updates = 6, 15
+    applied = {}  # oven: last state the app said it saved
+
+    def worker(oven):
+        client = application.app.test_client()
+        for n in range(updates):
+            state = {'status': 'cooking', 'chickens': n, 'oven': oven}
+            response = client.post('/update_oven_state', json={'oven': oven, 'state': state})
+            assert response.status_code in (200, 409)
+            if response.status_code == 200:
+                applied[oven] = state
+
+    threads = [threading.Thread(target=worker, args=(oven,)) for oven in range(1, ovens + 1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert s3.conflicts > 0  # the threads really did race
+    stored = stored_states(application, s3)
+    assert stored == {str(oven): state for oven, state in applied.items()}
+    assert len(applied) == ovens
+
+
+def test_conflict_is_reported_only_after_retries_run_out(apps, monkeypatch):
+    application, _ = apps
+    s3 = CountingS3(always_conflict=True)
+    use_bucket(application, s3)
+    application.load_oven_states()
+    monkeypatch.setattr(application.random, 'uniform', lambda low, high: 0)  # no backoff
+
+    response = application.app.test_client().post('/update_oven_state', json={'oven': 1, 'state': {'status': 'idle'}})
+    assert response.status_code == 409
+    assert s3.attempts == application.OVEN_STATE_MAX_RETRIES
+
+
+def test_update_succeeds_after_fewer_conflicts_than_retries(apps, monkeypatch):
+    application, _ = apps
+    s3 = CountingS3(always_conflict=True)
+    use_bucket(application, s3)
+    application.load_oven_states()
+    monkeypatch.setattr(application.random, 'uniform', lambda low, high: 0)
+    original = s3.put_object
+
+    def conflict_then_succeed(*args, **kwargs):
+        # The last attempt is allowed to land
+        s3.always_conflict = s3.attempts < application.OVEN_STATE_MAX_RETRIES - 1
+        return original(*args, **kwargs)
+
+    s3.put_object = conflict_then_succeed
+    response = application.app.test_client().post('/update_oven_state', json={'oven': 3, 'state': {'status': 'idle'}})
+    assert response.status_code == 200
+    assert s3.attempts == application.OVEN_STATE_MAX_RETRIES
+    assert stored_states(application, s3) == {'3': {'status': 'idle'}}
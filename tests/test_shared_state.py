@@ -0,0 +1,75 @@
+import pickle
+import sqlite3
+import pytest
+import shared_state
+from shared_state import SharedState
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    # Counts the values unpickled, by key
+    counts = []
+    real_loads = pickle.loads
+
+    def counting_loads(data):
+        value = real_loads(data)
+        counts.append(value['key'])
+        return value
+
+    monkeypatch.setattr(shared_state.pickle, 'loads', counting_loads)
+    return counts
+
+
+def write(state, key, n):
+    with state.transaction() as values:
+        values[key] = {'key': key, 'n': n}
+
+
+def test_refresh_reads_only_changed_keys(tmp_path, loads):
+    path = str(tmp_path / 'state.sqlite')
+    worker, other = SharedState(path), SharedState(path)
+    for i in range(20):
+        write(other, f'store-{i}/chain', 0)
+    assert len(worker.snapshot()) == 20
+    assert len(loads) == 20
+
+    loads.clear()
+    write(other, 'store-3/chain', 1)
+    write(other, 'store-7/chain', 1)
+    snapshot = worker.snapshot()
+    assert sorted(loads) == ['store-3/chain', 'store-7/chain']
+    assert snapshot['store-3/chain']['n'] == snapshot['store-7/chain']['n'] == 1
+    assert snapshot['store-4/chain']['n'] == 0
+
+    loads.clear()
+    write(worker, 'store-4/chain', 2)
+    assert other.snapshot()['store-4/chain']['n'] == 2
+    assert loads == ['store-4/chain']
+    assert worker.snapshot()['store-4/chain']['n'] == 2
+    assert loads == ['store-4/chain']  # Its own write is not read back
+
+
+def test_rolled_back_transaction_does_not_hide_later_writes(tmp_path):
+    path = str(tmp_path / 'state.sqlite')
+    worker, other = SharedState(path), SharedState(path)
+    write(worker, 'a', 0)
+    with pytest.raises(RuntimeError):
+        with worker.transaction() as values:
+            values['a'] = {'key': 'a', 'n': 1}
+            raise RuntimeError
+    write(other, 'b', 0)
+    assert worker.snapshot() == {'a': {'key': 'a', 'n': 0}, 'b': {'key': 'b', 'n': 0}}
+
+
+def test_reads_a_database_from_before_row_versions(tmp_path):
+    path = str(tmp_path / 'state.sqlite')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE state (key TEXT PRIMARY KEY, value BLOB)')
+    conn.execute('INSERT INTO state VALUES (?, ?)', ('a', pickle.dumps({'key': 'a', 'n': 0})))
+    conn.commit()
+    conn.close()
+
+    worker, other = SharedState(path), SharedState(path)
+    assert worker.snapshot() == {'a': {'key': 'a', 'n': 0}}
+    write(other, 'a', 1)
+    assert worker.snapshot() == {'a': {'key': 'a', 'n': 1}}
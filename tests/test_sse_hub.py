@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+from flask import Flask
+from sse_hub import BroadcastHub, make_asgi_app
+
+SLOW_SECONDS = 0.2
+
+
+def http_scope(path, query=b''):
+    return {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query, 'headers': [],
+            'http_version': '1.1', 'scheme': 'http', 'server': ('testserver', 80)}
+
+
+async def get(asgi_app, path):
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        messages.append(message)
+
+    await asgi_app(http_scope(path), receive, send)
+    return messages[0]['status'], b''.join(m.get('body', b'') for m in messages[1:])
+
+
+def test_flask_requests_run_concurrently():
+    app = Flask(__name__)
+    threads, in_flight, peak = set(), [0], [0]
+    lock = threading.Lock()
+
+    @app.route('/slow')
+    def slow():
+        with lock:
+            threads.add(threading.get_ident())
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(SLOW_SECONDS)
+        with lock:
+            in_flight[0] -= 1
+        return 'ok'
+
+    asgi_app = make_asgi_app(app, BroadcastHub(), threads=4)
+
+    async def main():
+        return await asyncio.gather(*(get(asgi_app, '/slow') for _ in range(8)))
+
+    start = time.perf_counter()
+    responses = asyncio.run(main())
+    elapsed = time.perf_counter() - start
+    assert responses == [(200, b'ok')] * 8
+    # Two rounds of four, not eight requests one after another
+    assert peak[0] == 4 and len(threads) == 4
+    assert elapsed < 4 * SLOW_SECONDS
+
+
+def test_publish_reaches_only_its_channel():
+    hub = BroadcastHub(heartbeat=60, channel=lambda query: (query.get('store') or ['main'])[0])
+
+    async def subscriber(query, received):
+        disconnect = asyncio.Event()
+
+        async def receive():
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message.get('body', b'').startswith(b'data:'):
+                received.append(message['body'])
+                disconnect.set()
+
+        await hub.serve(http_scope('/events', query), receive, send)
+
+    async def main():
+        received = {query: [] for query in (b'', b'store=a', b'store=b')}
+        tasks = [asyncio.ensure_future(subscriber(query, got)) for query, got in received.items()]
+        await asyncio.sleep(0.05)
+        assert hub.count('main') == hub.count('a') == hub.count('b') == 1
+        hub.publish('update', 'a')
+        await asyncio.wait(tasks, timeout=0.5)
+        for task in tasks:
+            task.cancel()
+        await asyncio.sleep(0)
+        return received
+
+    received = asyncio.run(main())
+    assert received == {b'': [], b'store=a': [b'data: update\n\n'], b'store=b': []}
+    assert hub.subscribers == {}
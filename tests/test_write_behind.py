@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import time
+import pytest
+import write_behind
+from write_behind import WriteBehindLog
+
+
+class ListLog:
+    # Stands in for EventLog: keeps what was appended
+    def __init__(self):
+        self.entries = []
+
+    def append(self, entries):
+        self.entries.extend(entries)
+
+
+def new_log(tmp_path, logger=None):
+    os.makedirs(tmp_path, exist_ok=True)
+    return WriteBehindLog(ListLog(), str(tmp_path), logger=logger)
+
+
+def write_wal(path, entries):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(entry) + '\n' for entry in entries)
+
+
+def test_replay_never_takes_a_new_generation(tmp_path, monkeypatch):
+    owner, other = new_log(tmp_path), new_log(tmp_path)
+    flock = write_behind.fcntl.flock
+
+    def replay_then_flock(fd, operation):
+        # Another worker starts up between the owner creating its WAL and
+        # locking it, and sweeps the unlocked .tmp away
+        if operation == write_behind.fcntl.LOCK_EX:
+            monkeypatch.setattr(write_behind.fcntl, 'flock', flock)
+            other.replay()
+        flock(fd, operation)
+
+    monkeypatch.setattr(write_behind.fcntl, 'flock', replay_then_flock)
+    owner.wal = owner.open_wal()
+    monkeypatch.setattr(write_behind.fcntl, 'flock', flock)
+
+    owner.append([{'n': 1}])
+    other.replay()
+    assert os.listdir(tmp_path) == [os.path.basename(owner.wal.name)]
+    owner.flush()
+    assert owner.event_log.entries == [{'n': 1}]
+    assert other.event_log.entries == []
+    assert os.listdir(tmp_path) == [os.path.basename(owner.wal.name)]  # The next generation
+
+
+def test_replay_skips_a_wal_shipped_after_it_was_opened(tmp_path, monkeypatch):
+    owner, other = new_log(tmp_path), new_log(tmp_path)
+    owner.wal = owner.open_wal()
+    owner.append([{'n': 1}])
+    flock = write_behind.fcntl.flock
+
+    def flush_then_flock(fd, operation):
+        # The owner ships and removes its WAL while replay waits for the lock
+        monkeypatch.setattr(write_behind.fcntl, 'flock', flock)
+        owner.flush()
+        flock(fd, operation)
+
+    monkeypatch.setattr(write_behind.fcntl, 'flock', flush_then_flock)
+    other.replay()
+    assert owner.event_log.entries == [{'n': 1}]
+    assert other.event_log.entries == []
+
+
+def test_replay_logs_only_when_it_ships_entries(tmp_path, caplog):
+    log = new_log(tmp_path, logging.getLogger('test_write_behind'))
+    write_wal(tmp_path / 'wal-1-aaaa-00000001.log', [])
+    write_wal(tmp_path / 'wal-2-bbbb-00000001.log', [{'n': 1}, {'n': 2}])
+
+    with caplog.at_level(logging.INFO, logger='test_write_behind'):
+        log.replay()
+    assert log.event_log.entries == [{'n': 1}, {'n': 2}]
+    assert [r.getMessage() for r in caplog.records] == [f"Replayed 2 entries from {tmp_path / 'wal-2-bbbb-00000001.log'}"]
+    assert os.listdir(tmp_path) == []
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_flushes_once_max_events_are_pending(tmp_path):
+    log = WriteBehindLog(ListLog(), str(tmp_path), max_events=3, interval=60)
+    log.start()
+    try:
+        log.append([{'n': 1}, {'n': 2}])
+        time.sleep(0.2)
+        assert log.event_log.entries == []
+        log.append([{'n': 3}])
+        assert wait_for(lambda: len(log.event_log.entries) == 3)
+    finally:
+        log.stop()
+
+
+def test_flushes_after_the_interval(tmp_path):
+    log = WriteBehindLog(ListLog(), str(tmp_path), max_events=100, interval=0.3)
+    log.start()
+    try:
+        started = time.monotonic()
+        log.append([{'n': 1}])
+        assert log.event_log.entries == []
+        assert wait_for(lambda: log.event_log.entries == [{'n': 1}])
+        assert time.monotonic() - started >= 0.3
+    finally:
+        log.stop()
+
+
+def test_append_returns_only_after_fsync(tmp_path, monkeypatch):
+    log = new_log(tmp_path)
+    log.wal = log.open_wal()
+    synced = []
+    fsync = write_behind.os.fsync
+
+    def recording_fsync(fd):
+        fsync(fd)
+        with open(log.wal.name, encoding='utf-8') as f:
+            synced.append(write_behind.read_wal(f))
+
+    monkeypatch.setattr(write_behind.os, 'fsync', recording_fsync)
+    log.append([{'n': 1}, {'n': 2}])
+    assert synced == [[{'n': 1}, {'n': 2}]]
+    assert log.pending == [{'n': 1}, {'n': 2}]
+
+    def failing_fsync(fd):
+        raise OSError(5, 'Input/output error')
+
+    monkeypatch.setattr(write_behind.os, 'fsync', failing_fsync)
+    with pytest.raises(OSError):
+        log.append([{'n': 3}])
+    assert log.pending == [{'n': 1}, {'n': 2}]  # Not acknowledged, not shipped
+
+
+def test_replay_sweeps_unlocked_tmp_files(tmp_path):
+    live = new_log(tmp_path)
+    live.wal = live.open_wal()
+    orphan = tmp_path / 'wal-1-aaaa-00000001.log.tmp'
+    orphan.touch()
+    creating = open(tmp_path / 'wal-2-bbbb-00000001.log.tmp', 'a')
+    write_behind.fcntl.flock(creating, write_behind.fcntl.LOCK_EX)
+
+    new_log(tmp_path).replay()
+    assert set(os.listdir(tmp_path)) == {os.path.basename(live.wal.name), 'wal-2-bbbb-00000001.log.tmp'}
+    creating.close()
@@ -1,35 +1,106 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-from sklearn.model_selection import train_test_split
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from sklearn.model_selection import train_test_split, TimeSeriesSplit
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_squared_error, r2_score
-from sklearn.neighbors import NearestNeighbors
+from sklearn.metrics import mean_squared_error, r2_score, mean_absolute_error
 import pytz
 import pickle
+import os
+import sys
+from time import perf_counter
 
-# Load the data
-data = pd.read_csv('grouped_cooking_sessions.csv', parse_dates=['start_time', 'expected_end_time', 'leftovers_time', 'end_time'])
+# Model format helpers shared with the backend
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'frontend'))
+from chicken_model import (TARGETS, ModelArtifact, fuse_models, forest_trees, join_trees, split_trees,
+                           predict_fused, build_prediction_tables, build_neighbor_tables, similar_sessions,
+                           save_artifact)
+from columnar import load_frame, table_or_export
 
-# Remove rows with NaN values
-data = data.dropna(subset=['end_time', 'leftovers'])
-
-# Convert times to Eastern Time
 eastern = pytz.timezone('US/Eastern')
-for col in ['start_time', 'expected_end_time', 'leftovers_time', 'end_time']:
-    data[col] = data[col].dt.tz_convert(eastern)
 
-# Preprocess the data
-data['day_of_week'] = data['start_time'].dt.dayofweek
-data['hour'] = data['start_time'].dt.hour
+# Forest settings used unless a search picks others (python train.py --search)
+DEFAULT_PARAMS = {'n_estimators': 50}
+SEARCH_GRID = [
+    {'n_estimators': n_estimators, 'max_depth': max_depth, 'min_samples_leaf': min_samples_leaf}
+    for n_estimators, max_depth, min_samples_leaf in product([10, 25, 50, 100], [None, 8], [1, 3])
+]
+SEARCH_SPLITS = 4
+# The search keeps the cheapest candidate whose time error is within this
+# fraction of the best one
+SEARCH_TOLERANCE = 0.02
+# Processes used to fit forests; each forest is fitted on a single core
+TRAIN_WORKERS = int(os.environ.get('TRAIN_WORKERS', 0)) or os.cpu_count()
+# Versions are published into the backend's model root, so a backend running
+# from this checkout swaps to them; they are gitignored (see .gitignore)
+MODEL_DIR = os.environ.get('MODEL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'frontend', 'models'))
+# Incremental updates (python train.py --incremental) fit this many new trees
+# per oven and target and drop as many of the oldest ones, so forests keep
+# their size and every tree is replaced after a few updates
+INCREMENTAL_TREES = 10
+# Sessions from before the model that are relabelled with the new ones; a
+# session only waits for a label until the same weekday comes round again
+INCREMENTAL_CONTEXT_DAYS = 8
+
+def load_sessions(path='grouped_cooking_sessions.cols'):
+    # Sessions saved by clean.py, or a CSV export of them
+    path = table_or_export(path, 'grouped_cooking_sessions.csv', 'clean.py')
+    return prepare_sessions(load_frame(path) if path.endswith('.cols') else pd.read_csv(path))
+
+def prepare_sessions(data):
+    # Remove rows with NaN values
+    data = data.dropna(subset=['end_time', 'leftovers'])
+
+    # Convert times to Eastern Time. Parsing through UTC handles files that span a
+    # DST change, where the offsets in the CSV are mixed.
+    for col in ['start_time', 'expected_end_time', 'leftovers_time', 'end_time']:
+        data[col] = pd.to_datetime(data[col], utc=True, format='mixed').dt.tz_convert(eastern)
+
+    # Preprocess the data
+    data['day_of_week'] = data['start_time'].dt.dayofweek
+    data['hour'] = data['start_time'].dt.hour
+    return data
+
+# Function to find the session each session of one oven is labelled with
+def find_next_sessions(oven_data):
+    # For each session, the label is the first session of the same oven and
+    # day of week (in data order) that ends after it starts. Within each day of
+    # week, the running max of end_time is sorted and first exceeds a start
+    # time exactly at that session, so one searchsorted finds them all.
+    # Returns row positions in oven_data, -1 where there is no such session.
+    start = oven_data['start_time'].to_numpy(dtype='datetime64[ns]').view('int64')
+    end = oven_data['end_time'].to_numpy(dtype='datetime64[ns]').view('int64')
+    day_of_week = oven_data['day_of_week'].to_numpy()
+    next_session = np.full(len(oven_data), -1)
+    for day in np.unique(day_of_week):
+        rows = np.flatnonzero(day_of_week == day)
+        latest_end = np.maximum.accumulate(end[rows])
+        found = np.searchsorted(latest_end, start[rows], side='right')
+        has_next = found < len(rows)
+        next_session[rows[has_next]] = rows[found[has_next]]
+    return next_session
+
+# Function to build the training rows for one oven
+def build_training_data(oven_data, next_session=None):
+    if next_session is None:
+        next_session = find_next_sessions(oven_data)
+    start = oven_data['start_time'].to_numpy(dtype='datetime64[ns]').view('int64')
+    end = oven_data['end_time'].to_numpy(dtype='datetime64[ns]').view('int64')
+    day_of_week = oven_data['day_of_week'].to_numpy()
 
-# Function to find the next oven finish time and leftovers for a specific oven
-def find_next_oven(current_time, day_of_week, oven):
-    future_sessions = data[(data['end_time'] > current_time) & (data['day_of_week'] == day_of_week) & (data['oven'] == oven)]
-    if future_sessions.empty:
-        return None, None
-    next_session = future_sessions.iloc[0]
-    return next_session['end_time'], next_session['leftovers']
+    rows = np.flatnonzero(next_session >= 0)
+    X = np.column_stack([
+        oven_data['start_time'].dt.hour.to_numpy()[rows],
+        oven_data['start_time'].dt.minute.to_numpy()[rows],
+        day_of_week[rows],
+    ]).astype(np.int64)
+    # Minutes to the next finish, with Timedelta.total_seconds() arithmetic
+    whole, rest = np.divmod(end[next_session[rows]] - start[rows], 10**9)
+    y_time = (whole + rest / 1e9) / 60
+    y_leftovers = oven_data['leftovers'].to_numpy()[next_session[rows]]
+    return X, y_time, y_leftovers
 
 # Function to get feature importance
 def get_feature_importance(model):
@@ -37,61 +108,218 @@ def get_feature_importance(model):
     features = ['Hour', 'Minute', 'Day of Week']
     return dict(zip(features, importance))
 
-# Function to find most similar historical data points
-def find_similar_datapoints(X, current_data, n_neighbors=3):
-    nbrs = NearestNeighbors(n_neighbors=n_neighbors, metric='euclidean').fit(X)
-    distances, indices = nbrs.kneighbors([current_data])
-    return indices[0]
-
-# Prepare training data for each oven
-ovens = data['oven'].unique()
-models = {}
-oven_data_dict = {}
-
-for oven in ovens:
-    X = []
-    y_time = []
-    y_leftovers = []
-
-    oven_data = data[data['oven'] == oven]
-    for _, row in oven_data.iterrows():
-        current_time = row['start_time']
-        day_of_week = row['day_of_week']
-        next_time, leftovers = find_next_oven(current_time, day_of_week, oven)
-        if next_time is not None:
-            X.append([current_time.hour, current_time.minute, day_of_week])
-            y_time.append((next_time - current_time).total_seconds() / 60)
-            y_leftovers.append(leftovers)
-
-    X = np.array(X)
-    y_time = np.array(y_time)
-    y_leftovers = np.array(y_leftovers)
-
-    oven_data_dict[oven] = {'X': X, 'y_time': y_time, 'y_leftovers': y_leftovers}
+def fit_forest(X, y, params):
+    return RandomForestRegressor(**dict({'random_state': 42, 'n_jobs': 1}, **params)).fit(X, y)
+
+def fit_task(task):
+    # Runs in a worker process: one forest for one oven and target
+    oven, target, X, y, params = task
+    return oven, target, fit_forest(X, y, params)
+
+def train_models(oven_data_dict, params=DEFAULT_PARAMS, workers=TRAIN_WORKERS):
+    # Fit every oven's time and leftovers forests in a process pool
+    tasks = [
+        (oven, target, oven_data['X'], oven_data[f'y_{target}'], params)
+        for oven, oven_data in oven_data_dict.items() for target in TARGETS
+    ]
+    models = {oven: {} for oven in oven_data_dict}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for oven, target, model in pool.map(fit_task, tasks):
+            models[oven][target] = model
+    return models
+
+def evaluate_task(task):
+    # Runs in a worker process: fit one candidate on one rolling-origin fold
+    candidate, oven, target, fold, X, y, train_index, test_index = task
+    model = fit_forest(X[train_index], y[train_index], SEARCH_GRID[candidate])
+    error = mean_absolute_error(y[test_index], model.predict(X[test_index]))
+    return candidate, oven, target, fold, error, model
+
+def search_hyperparameters(oven_data_dict, grid=SEARCH_GRID, n_splits=SEARCH_SPLITS, workers=TRAIN_WORKERS):
+    # Rolling-origin cross-validation: each oven's rows are in time order, so
+    # every fold trains on the past and is scored on the sessions that follow.
+    # All candidate/oven/target/fold fits run in the process pool.
+    tasks = []
+    for oven, oven_data in oven_data_dict.items():
+        X = oven_data['X']
+        if len(X) <= n_splits:
+            continue  # Too little history to split
+        for fold, (train_index, test_index) in enumerate(TimeSeriesSplit(n_splits=n_splits).split(X)):
+            for candidate, target in product(range(len(grid)), TARGETS):
+                tasks.append((candidate, oven, target, fold, X, oven_data[f'y_{target}'], train_index, test_index))
+
+    errors = {}
+    last_fold = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for candidate, oven, target, fold, error, model in pool.map(evaluate_task, tasks, chunksize=4):
+            errors.setdefault((candidate, target), []).append(error)
+            if fold == n_splits - 1:
+                last_fold.setdefault(candidate, {}).setdefault(oven, {})[target] = model
+
+    # Inference cost of each candidate, measured on the fused trees the backend
+    # would load: one-row latency and the time to build its lookup tables
+    results = []
+    for candidate, params in enumerate(grid):
+        if candidate not in last_fold:
+            continue
+        fused = fuse_models(last_fold[candidate])
+        X_one = np.array([[12, 0, 2]])
+        start = perf_counter()
+        for _ in range(100):
+            predict_fused(fused, X_one)
+        predict_us = (perf_counter() - start) / 100 * 1e6
+        start = perf_counter()
+        build_prediction_tables(fused)
+        tables_ms = (perf_counter() - start) * 1000
+        results.append({
+            'params': params,
+            'time_mae': float(np.mean(errors[(candidate, 'time')])),
+            'leftovers_mae': float(np.mean(errors[(candidate, 'leftovers')])),
+            'nodes': len(fused['feature']),
+            'predict_us': predict_us,
+            'tables_ms': tables_ms,
+        })
+    return results
+
+def pick_candidate(results, tolerance=SEARCH_TOLERANCE):
+    best_error = min(result['time_mae'] for result in results)
+    close = [result for result in results if result['time_mae'] <= best_error * (1 + tolerance)]
+    return min(close, key=lambda result: (result['nodes'], result['time_mae']))
+
+def print_search_results(results, chosen):
+    print(f"\nHyperparameter search ({SEARCH_SPLITS} rolling-origin folds per oven):")
+    print(f"  {'n_estimators':>12} {'max_depth':>9} {'min_leaf':>8} {'time MAE':>9} {'left MAE':>9} {'nodes':>8} {'1-row us':>9} {'tables ms':>9}")
+    for result in sorted(results, key=lambda result: result['time_mae']):
+        params = result['params']
+        marker = ' <-' if result is chosen else ''
+        print(f"  {params['n_estimators']:>12} {str(params['max_depth']):>9} {params['min_samples_leaf']:>8} "
+              f"{result['time_mae']:>9.2f} {result['leftovers_mae']:>9.2f} {result['nodes']:>8} "
+              f"{result['predict_us']:>9.0f} {result['tables_ms']:>9.0f}{marker}")
+
+# Function to build the training rows of every oven
+def build_oven_data(data):
+    oven_data_dict = {}
+    for oven in data['oven'].unique():
+        X, y_time, y_leftovers = build_training_data(data[data['oven'] == oven])
+        oven_data_dict[oven] = {'X': X, 'y_time': y_time, 'y_leftovers': y_leftovers}
+    return oven_data_dict
+
+def train_and_publish(data, params=DEFAULT_PARAMS, model_dir=MODEL_DIR, workers=TRAIN_WORKERS):
+    # Full training run on prepared sessions: fits every oven, saves
+    # chicken_models.pkl and publishes a new artifact version in model_dir
+    oven_data_dict = build_oven_data(data)
 
     # Train models
-    rf_time = RandomForestRegressor(n_estimators=50, random_state=42)
-    rf_time.fit(X, y_time)
+    start = perf_counter()
+    models = train_models(oven_data_dict, params, workers)
+    print(f"Trained {len(models) * len(TARGETS)} forests in {perf_counter() - start:.1f}s on {workers} workers")
+
+    # Fused representation of all ovens and targets for the backend
+    fused = fuse_models(models)
+
+    # Save the models, fused trees and oven_data_dict
+    with open('chicken_models.pkl', 'wb') as f:
+        pickle.dump({'models': models, 'fused': fused, 'oven_data_dict': oven_data_dict}, f)
+
+    # Publish a new memory-mappable artifact version for the backend
+    os.makedirs(model_dir, exist_ok=True)
+    model_version = save_artifact(model_dir, fused, oven_data_dict, {
+        'params': params,
+        'sessions_through': data['start_time'].max().isoformat(),
+        'updates': 0,
+    })
+    print(f"Published model version {model_version} to {model_dir}")
+    return models, oven_data_dict, model_version
+
+def incremental_update(model_dir=MODEL_DIR, sessions_path='grouped_cooking_sessions.cols', workers=TRAIN_WORKERS):
+    # Update the current model with the sessions that started after it was
+    # trained. The new trees are fitted on the training rows stored with the
+    # model plus the rows of the new sessions. Only ovens with new sessions
+    # are refitted, and only their rows of the lookup tables are recomputed.
+    model = ModelArtifact(model_dir)
+    if not model.manifest.get('sessions_through'):
+        print(f"Model {model.version} does not record which sessions it was trained on; run a full train first")
+        return None
+    sessions_through = pd.Timestamp(model.manifest['sessions_through'])
+    data = load_sessions(sessions_path)
+    new_sessions = data[data['start_time'] > sessions_through]
+    if new_sessions.empty:
+        print(f"Model {model.version} is up to date")
+        return None
 
-    rf_leftovers = RandomForestRegressor(n_estimators=50, random_state=42)
-    rf_leftovers.fit(X, y_leftovers)
+    training = {oven: dict(arrays) for oven, arrays in model.training.items()}
+    refit_data_dict = {}
+    context = data[(data['start_time'] <= sessions_through) &
+                   (data['start_time'] > sessions_through - timedelta(days=INCREMENTAL_CONTEXT_DAYS))]
+    for oven in new_sessions['oven'].unique():
+        # New rows are the new sessions, plus the older sessions that had no
+        # label before and are labelled by a new session now
+        oven_context = context[context['oven'] == oven]
+        oven_data = pd.concat([oven_context, new_sessions[new_sessions['oven'] == oven]])
+        next_session = find_next_sessions(oven_data)
+        is_new = np.arange(len(oven_data)) >= len(oven_context)
+        next_session[~is_new & (next_session < len(oven_context))] = -1
+        new_rows = dict(zip(['X', 'y_time', 'y_leftovers'], build_training_data(oven_data, next_session)))
+        if not len(new_rows['X']):
+            continue
+        old_rows = training.get(int(oven))
+        training[int(oven)] = refit_data_dict[oven] = new_rows if old_rows is None else {
+            key: np.concatenate([old_rows[key], new_rows[key]]) for key in new_rows
+        }
+    if not refit_data_dict:
+        print("None of the new sessions has a next session to learn from yet")
+        return None
+
+    updates = model.manifest.get('updates', 0) + 1
+    params = dict(model.manifest.get('params') or DEFAULT_PARAMS, n_estimators=INCREMENTAL_TREES, random_state=42 + updates)
+    models = train_models(refit_data_dict, params, workers)
 
-    models[oven] = {'time': rf_time, 'leftovers': rf_leftovers}
+    forests = split_trees(model.fused)
+    for oven, oven_models in models.items():
+        old = forests.get(int(oven), [[] for _ in TARGETS])
+        forests[int(oven)] = [
+            old_trees[len(new_trees):] + new_trees
+            for old_trees, new_trees in zip(old, (forest_trees(oven_models[target]) for target in TARGETS))
+        ]
+    fused = join_trees(forests)
 
-# Save the models and oven_data_dict
-with open('chicken_models.pkl', 'wb') as f:
-    pickle.dump({'models': models, 'oven_data_dict': oven_data_dict}, f)
+    # Reuse the table rows of ovens that were not refitted; a base version
+    # without tables gets them built from scratch
+    refit = [int(oven) for oven in models]
+    tables = None
+    if model.time_table is not None:
+        refit_tables = build_prediction_tables(join_trees({oven: forests[oven] for oven in refit}))
+        tables = []
+        for old_table, refit_table in zip((model.time_table, model.leftovers_table), refit_tables):
+            rows = [
+                refit_table[refit.index(oven)] if oven in refit else old_table[model.fused['ovens'].index(oven)]
+                for oven in fused['ovens']
+            ]
+            tables.append(np.ascontiguousarray(np.stack(rows)))
+        tables = tuple(tables)
 
-# Function to predict next oven time and leftovers for all ovens
-def predict_next_ovens(current_time):
+    return save_artifact(model_dir, fused, training, {
+        'params': model.manifest.get('params') or DEFAULT_PARAMS,
+        'sessions_through': data['start_time'].max().isoformat(),
+        'base_version': model.version,
+        'updates': updates,
+        'refit_ovens': refit,
+    }, tables=tables)
+
+# Function to predict next oven time and leftovers for all ovens. neighbors
+# are the neighbour tables of the published artifact (built here if not given),
+# so finding similar sessions is a lookup rather than a new index per call.
+def predict_next_ovens(models, oven_data_dict, current_time, neighbors=None):
     hour = current_time.hour
     minute = current_time.minute
     day_of_week = current_time.weekday()
     
     input_data = np.array([[hour, minute, day_of_week]])
+    if neighbors is None:
+        neighbors = build_neighbor_tables(oven_data_dict, [int(oven) for oven in models])
     
     predictions = {}
-    for oven, model in models.items():
+    for oven_index, (oven, model) in enumerate(models.items()):
         time_to_next = model['time'].predict(input_data)[0]
         leftovers = model['leftovers'].predict(input_data)[0]
         next_time = current_time + timedelta(minutes=time_to_next)
@@ -99,10 +327,7 @@ def predict_next_ovens(current_time):
         time_importance = get_feature_importance(model['time'])
         leftovers_importance = get_feature_importance(model['leftovers'])
         
-        similar_indices = find_similar_datapoints(oven_data_dict[oven]['X'], input_data[0])
-        similar_data = oven_data_dict[oven]['X'][similar_indices]
-        similar_times = oven_data_dict[oven]['y_time'][similar_indices]
-        similar_leftovers = oven_data_dict[oven]['y_leftovers'][similar_indices]
+        similar_data, similar_times, similar_leftovers, _ = similar_sessions(neighbors, oven_index, hour, minute, day_of_week)
         
         predictions[oven] = {
             'next_time': next_time,
@@ -116,30 +341,53 @@ def predict_next_ovens(current_time):
     
     return predictions
 
-# Example usage
-current_time = datetime.now(eastern).replace(hour=12, minute=0, second=0, microsecond=0)
-predictions = predict_next_ovens(current_time)
+if __name__ == '__main__':
+    if '--incremental' in sys.argv[1:]:
+        start = perf_counter()
+        model_version = incremental_update()
+        if model_version:
+            print(f"Published model version {model_version} to {MODEL_DIR} in {perf_counter() - start:.1f}s")
+        sys.exit()
+
+    # Load the data
+    data = load_sessions()
+
+    # Optionally pick forest settings by time-series cross-validation
+    params = DEFAULT_PARAMS
+    if '--search' in sys.argv[1:]:
+        start = perf_counter()
+        results = search_hyperparameters(build_oven_data(data))
+        chosen = pick_candidate(results)
+        print_search_results(results, chosen)
+        print(f"Search took {perf_counter() - start:.1f}s on {TRAIN_WORKERS} workers; using {chosen['params']}")
+        params = chosen['params']
+
+    models, oven_data_dict, model_version = train_and_publish(data, params)
+
+    # Example usage
+    current_time = datetime.now(eastern).replace(hour=12, minute=0, second=0, microsecond=0)
+    predictions = predict_next_ovens(models, oven_data_dict, current_time, ModelArtifact(MODEL_DIR, model_version).neighbors)
 
-print(f"\nCurrent time (Eastern): {current_time.strftime('%Y-%m-%d %I:%M %p')}")
-for oven, prediction in predictions.items():
-    print(f"\nOven {oven}:")
-    print(f"Predicted next finish time (Eastern): {prediction['next_time'].strftime('%Y-%m-%d %I:%M %p')}")
-    print(f"Predicted leftovers: {prediction['leftovers']:.2f}")
+    print(f"\nCurrent time (Eastern): {current_time.strftime('%Y-%m-%d %I:%M %p')}")
+    for oven, prediction in predictions.items():
+        print(f"\nOven {oven}:")
+        print(f"Predicted next finish time (Eastern): {prediction['next_time'].strftime('%Y-%m-%d %I:%M %p')}")
+        print(f"Predicted leftovers: {prediction['leftovers']:.2f}")
     
-    print("\nTime Prediction Feature Importance:")
-    for feature, importance in prediction['time_importance'].items():
-        print(f"  {feature}: {importance:.4f}")
+        print("\nTime Prediction Feature Importance:")
+        for feature, importance in prediction['time_importance'].items():
+            print(f"  {feature}: {importance:.4f}")
     
-    print("\nLeftovers Prediction Feature Importance:")
-    for feature, importance in prediction['leftovers_importance'].items():
-        print(f"  {feature}: {importance:.4f}")
+        print("\nLeftovers Prediction Feature Importance:")
+        for feature, importance in prediction['leftovers_importance'].items():
+            print(f"  {feature}: {importance:.4f}")
     
-    print("\nMost Similar Historical Data Points:")
-    for i, (data_point, time, leftovers) in enumerate(zip(prediction['similar_data'], prediction['similar_times'], prediction['similar_leftovers']), 1):
-        print(f"  {i}. Input: Hour={data_point[0]}, Minute={data_point[1]}, Day={data_point[2]}")
-        print(f"     Output: Time to next finish={time:.2f} minutes, Leftovers={leftovers:.2f}")
+        print("\nMost Similar Historical Data Points:")
+        for i, (data_point, time, leftovers) in enumerate(zip(prediction['similar_data'], prediction['similar_times'], prediction['similar_leftovers']), 1):
+            print(f"  {i}. Input: Hour={data_point[0]}, Minute={data_point[1]}, Day={data_point[2]}")
+            print(f"     Output: Time to next finish={time:.2f} minutes, Leftovers={leftovers:.2f}")
 
-        print(f"  {i}. Input: Hour={data_point[0]}, Minute={data_point[1]}, Day={data_point[2]}")
-        print(f"     Output: Time to next finish={time:.2f} minutes, Leftovers={leftovers:.2f}")
+            print(f"  {i}. Input: Hour={data_point[0]}, Minute={data_point[1]}, Day={data_point[2]}")
+            print(f"     Output: Time to next finish={time:.2f} minutes, Leftovers={leftovers:.2f}")
 
 
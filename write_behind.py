@@ -0,0 +1,182 @@
+import atexit
+import fcntl
+import glob
+import json
+import os
+import threading
+import uuid
+
+# Entries are acknowledged once they are fsync'd to a local write-ahead log and
+# are shipped to the event log in batches, either when FLUSH_MAX_EVENTS pile up
+# or FLUSH_INTERVAL seconds after the first unflushed entry.
+FLUSH_MAX_EVENTS = 50
+FLUSH_INTERVAL = 15  # seconds
+
+
+class WriteBehindLog:
+    def __init__(self, event_log, wal_dir, max_events=FLUSH_MAX_EVENTS, interval=FLUSH_INTERVAL, logger=None):
+        self.event_log = event_log
+        self.wal_dir = wal_dir
+        self.max_events = max_events
+        self.interval = interval
+        self.logger = logger
+        # Each process writes its own WAL files, named wal-<owner>-<generation>.log
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.full = threading.Event()
+        self.stopped = threading.Event()
+        self.pending = []
+        self.wal = None
+        # Generations that were cut but not yet shipped: (file, entries)
+        self.unflushed = []
+        self._flusher = None
+
+    def wal_path(self, generation):
+        return os.path.join(self.wal_dir, f"wal-{self.owner}-{generation:08d}.log")
+
+    def open_wal(self):
+        # The lock is held until the generation is shipped so replay never
+        # picks it up. It is taken under a name replay does not look at and
+        # the file renamed into place, so replay never sees it unlocked.
+        self.generation += 1
+        return open(self.wal_path(self.generation), 'a', encoding='utf-8', opener=open_locked)
+
+    def start(self):
+        os.makedirs(self.wal_dir, exist_ok=True)
+        self.replay()
+        with self.lock:
+            self.wal = self.open_wal()
+        self._flusher = threading.Thread(target=self.run, name='write-behind-flusher', daemon=True)
+        self._flusher.start()
+        atexit.register(self.stop)
+
+    def replay(self):
+        # Ship WAL files left behind by processes that died before flushing
+        self.sweep()
+        for path in sorted(glob.glob(os.path.join(self.wal_dir, 'wal-*.log'))):
+            with open(path, 'r', encoding='utf-8') as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # Still owned by a live worker
+                if not same_file(f, path):
+                    continue  # Shipped and removed by its owner since we opened it
+                entries = read_wal(f)
+                if entries:
+                    self.event_log.append(entries)
+                os.remove(path)
+            if entries and self.logger:
+                self.logger.info(f"Replayed {len(entries)} entries from {path}")
+
+    def sweep(self):
+        # Remove generations a process died creating (see open_locked). They
+        # never hold entries: nothing is written before the rename.
+        for path in glob.glob(os.path.join(self.wal_dir, 'wal-*.log.tmp')):
+            try:
+                f = open(path, 'r', encoding='utf-8')
+            except FileNotFoundError:
+                continue  # Renamed into place meanwhile
+            with f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # Being created by a live worker
+                if same_file(f, path):
+                    os.remove(path)
+
+    def append(self, entries):
+        with self.lock:
+            for entry in entries:
+                self.wal.write(json.dumps(entry) + '\n')
+            self.wal.flush()
+            os.fsync(self.wal.fileno())
+            self.pending.extend(entries)
+            if len(self.pending) == len(entries):
+                self.wake.set()  # First entry starts the interval timer
+            if len(self.pending) >= self.max_events:
+                self.full.set()
+
+    def cut(self):
+        # Swap in a fresh WAL generation and hand back the entries of the old one
+        with self.lock:
+            if self.pending:
+                self.unflushed.append((self.wal, self.pending))
+                self.wal = self.open_wal()
+                self.pending = []
+
+    def flush(self):
+        with self.flush_lock:
+            self.cut()
+            while self.unflushed:
+                wal, entries = self.unflushed[0]
+                self.event_log.append(entries)
+                self.unflushed.pop(0)
+                # Removed before the lock is dropped, so replay cannot ship it again
+                os.remove(wal.name)
+                wal.close()
+                if self.logger:
+                    self.logger.info(f"Flushed {len(entries)} entries to the event log")
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wake.wait()
+            # Give the batch time to fill unless it is already full
+            self.full.wait(self.interval)
+            self.wake.clear()
+            self.full.clear()
+            if self.stopped.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                # Entries stay in their WAL generation and are retried on the next flush
+                if self.logger:
+                    self.logger.error(f"Write-behind flush failed: {str(e)}")
+                self.stopped.wait(self.interval)
+                self.wake.set()
+
+    def stop(self):
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.wake.set()
+        self.full.set()
+        try:
+            self.flush()
+        except Exception as e:
+            # Left in the WAL; the next process to start replays it
+            if self.logger:
+                self.logger.error(f"Final write-behind flush failed: {str(e)}")
+
+
+def open_locked(path, flags):
+    # opener for open(): the file only appears at path once it is locked
+    while True:
+        fd = os.open(path + '.tmp', flags, 0o666)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            os.rename(path + '.tmp', path)
+            return fd
+        except FileNotFoundError:
+            # A sweep removed it before we had the lock; make a new one
+            os.close(fd)
+
+
+def same_file(f, path):
+    try:
+        return os.path.samestat(os.fstat(f.fileno()), os.stat(path))
+    except FileNotFoundError:
+        return False
+
+
+def read_wal(f):
+    entries = []
+    for line in f:
+        try:
+            entries.append(json.loads(line))
+        except json.JSONDecodeError:
+            break  # Torn write at the end of the file
+    return entries